@@ -10,22 +10,40 @@ import sys
 import time
 import datetime # Make sure this is present for timestamp formatting
 import os
+import random
+
+from wire import PROTOCOL_JSON, PROTOCOL_BINARY, FrameDecoder, encode_command
 
 # Server Configuration (Use 'localhost' for local testing, 'server' for Docker Compose)
 # If running client outside Docker and server in Docker, use 'localhost' if port mapping 
 # is to localhost, or the Docker host IP. If client is also in Docker, use 'server'.
 SERVER_HOST = os.getenv('SERVER_HOST', 'localhost') 
 SERVER_PORT = int(os.getenv('SERVER_PORT', 12345))
+CHAT_PROTOCOL = os.getenv('CHAT_PROTOCOL', PROTOCOL_JSON) # 'json' or 'binary-v1' (compact frames, negotiated at connect)
+HANDSHAKE_TIMEOUT = 3 # Seconds to wait for the server to answer a protocol handshake
+RECONNECT_ATTEMPTS = 5 # Tries to get back to the server after a dropped connection
+RECONNECT_BASE_DELAY = 0.5 # Seconds before the first retry; doubles on every attempt
+RECONNECT_MAX_DELAY = 10
 
 class ChatClient:
-    def __init__(self, host, port):
+    def __init__(self, host, port, protocol=CHAT_PROTOCOL):
         self.host = host
         self.port = port
+        self.requested_protocol = protocol
+        self.protocol = PROTOCOL_JSON # Becomes the negotiated protocol once the server acknowledges it
+        self.handshake_done = threading.Event()
+        self.decoder = FrameDecoder()
         self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.connected = False
         self.authenticated = False
         self.username = None
         self.current_room = None
+        self.history_cursor = None # Keyset cursor for paging back through the current room's history
+        self.search_cursor = None # The last search and the offset of its next page
+        self.session_token = None # Signed by the server at login and join; lets a reconnect skip login and join_room
+        self.last_seen_id = None # Id of the newest chat message received, so a resume only replays what was missed
+        self.resuming = False
+        self.reconnecting = False
         self.receive_thread = None
 
     def connect(self):
@@ -36,26 +54,60 @@ class ChatClient:
             self.receive_thread = threading.Thread(target=self.receive_messages)
             self.receive_thread.daemon = True
             self.receive_thread.start()
+            self.negotiate_protocol()
         except Exception as e:
             print(f"Error connecting to server: {e}")
             self.connected = False
 
+    def negotiate_protocol(self):
+        if self.requested_protocol == PROTOCOL_JSON:
+            self.handshake_done.set()
+            return
+        # Nothing else is sent until the server answers, so the switch happens at a clean frame boundary
+        self.socket.sendall(encode_command(PROTOCOL_JSON, {"command": "hello", "protocol": self.requested_protocol}))
+        if not self.handshake_done.wait(HANDSHAKE_TIMEOUT):
+            print("Server did not answer the protocol handshake; using JSON.")
+            self.handshake_done.set()
+
+    def handle_handshake_response(self, response):
+        """Returns True if the response was consumed as part of the protocol handshake."""
+        if self.handshake_done.is_set():
+            return False
+        if response.get('type') == 'hello':
+            if response.get('protocol') == PROTOCOL_BINARY:
+                self.decoder.switch_to_binary() # Everything after the acknowledgement is binary
+                self.protocol = PROTOCOL_BINARY
+            self.handshake_done.set()
+            return True
+        if response.get('status') == 'error': # An older server that does not know 'hello'
+            self.handshake_done.set()
+            return True
+        return False
+
     def receive_messages(self):
-        buffer = ""
         while self.connected:
             try:
-                data = self.socket.recv(4096).decode('utf-8')
+                data = self.socket.recv(65536)
                 if not data:
                     print("Server disconnected.")
                     self.disconnect()
+                    if self.session_token:
+                        self.reconnect()
                     break
-                buffer += data
-                while '\n' in buffer:
-                    line, buffer = buffer.split('\n', 1)
-                    self.process_server_response(line.strip())
+                self.decoder.feed(data)
+                while True:
+                    response = self.decoder.next_message()
+                    if response is None:
+                        break
+                    if not isinstance(response, dict):
+                        print(f"Received malformed JSON: {response}")
+                    elif not self.handle_handshake_response(response):
+                        self.process_server_response(response)
             except ConnectionResetError:
                 print("Server closed the connection unexpectedly.")
                 self.disconnect()
+                if self.session_token:
+                    self.reconnect()
                 break
             except OSError as e:
                 if self.connected: # Only print if not intentionally disconnected
@@ -65,18 +117,40 @@ class ChatClient:
                 print(f"Error receiving data: {e}")
                 break
 
+    def reconnect(self):
+        """Opens a new connection and resumes the session from its token instead of logging in again."""
+        self.reconnecting = True
+        try:
+            for attempt in range(RECONNECT_ATTEMPTS):
+                # Jitter keeps clients dropped at the same moment from all coming back at once
+                delay = min(RECONNECT_MAX_DELAY, RECONNECT_BASE_DELAY * 2 ** attempt) * random.uniform(0.5, 1.5)
+                print(f"Reconnecting in {delay:.1f}s...")
+                time.sleep(delay)
+                self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+                self.decoder = FrameDecoder()
+                self.protocol = PROTOCOL_JSON
+                self.handshake_done.clear()
+                self.connect()
+                if self.connected:
+                    self.resuming = True
+                    self.send_command('resume', token=self.session_token, last_seen_id=self.last_seen_id)
+                    return True
+            print("Could not reconnect to the server.")
+            return False
+        finally:
+            self.reconnecting = False
+
     def send_command(self, command_type, **kwargs):
         message = {"command": command_type}
         message.update(kwargs)
         try:
-            self.socket.sendall((json.dumps(message) + '\n').encode('utf-8'))
+            self.socket.sendall(encode_command(self.protocol, message))
         except Exception as e:
             print(f"Error sending command: {e}")
             self.disconnect()
 
-    def process_server_response(self, response_json):
+    def process_server_response(self, response):
         try:
-            response = json.loads(response_json)
             response_type = response.get('type')
             status = response.get('status')
             message = response.get('message')
@@ -87,28 +161,72 @@ class ChatClient:
                 sender = response.get('sender')
                 content = response.get('content')
                 timestamp = response.get('timestamp')
+                if response.get('id') is not None:
+                    self.last_seen_id = response['id']
                 print(f"\n[{timestamp.split('T')[1].split('.')[0]}] <{sender}>: {content}")
                 sys.stdout.write(f"\n{self.username}@chat_system > ") # Reprompt user
                 sys.stdout.flush()
+            elif response_type == 'direct_message':
+                timestamp = response.get('timestamp')
+                print(f"\n[{timestamp.split('T')[1].split('.')[0]}] *{response.get('sender')} -> you*: {response.get('content')}")
+                sys.stdout.write(f"\n{self.username}@chat_system > ") # Reprompt user
+                sys.stdout.flush()
             elif status == 'success':
                 print(f"\nSERVER: {message}")
-                if 'user_id' in response: # Successful login
+                if 'token' in response:
+                    self.session_token = response['token']
+                if 'user_id' in response: # Successful login or resume
                     self.authenticated = True
                     self.username = response['username']
-                    print("You are now logged in. Type 'help' for commands.")
+                    if self.resuming:
+                        self.resuming = False
+                        self.current_room = None # Set again below if the room was restored
+                    else:
+                        print("You are now logged in. Type 'help' for commands.")
                 if 'room_name' in response: # Successful room join
                     self.current_room = response['room_name']
                     print(f"Currently in room: {self.current_room}")
                     history = response.get('history', [])
+                    resumed = response.get('resumed')
+                    if not resumed:
+                        self.history_cursor = None
+                    if response.get('truncated'):
+                        print("(Too many messages were missed to replay them all; use 'history' to page back.)")
                     if history:
-                        print("\n--- Chat History ---")
+                        print("\n--- Missed Messages ---" if resumed else "\n--- Chat History ---")
                         for msg in history:
                             print(f"[{msg['timestamp'].split('T')[1].split('.')[0]}] <{msg['username']}>: {msg['content']}")
                         print("--------------------\n")
+                        if history[-1].get('id') is not None:
+                            self.last_seen_id = history[-1]['id']
+                        if not resumed:
+                            self.history_cursor = {"before_timestamp": history[0]['timestamp'], "before_id": history[0].get('id')}
                     room_stats = response.get('room_stats', {})
                     active_users = response.get('active_users_in_room', [])
                     print(f"Room Stats: Users in room: {room_stats.get('total_users', 0)}, Total messages: {room_stats.get('total_messages', 0)}")
                     print(f"Active Users in room: {', '.join(active_users)}")
+                if 'messages' in response: # A page of older history
+                    messages = response['messages']
+                    if messages:
+                        print("\n--- Older Messages ---")
+                        for msg in messages:
+                            print(f"[{msg['timestamp'].replace('T', ' ').split('.')[0]}] <{msg['username']}>: {msg['content']}")
+                        print("----------------------\n")
+                    self.history_cursor = response.get('next_cursor')
+                    if not self.history_cursor:
+                        print("No older messages.")
+                if 'results' in response: # A page of search results
+                    results = response['results']
+                    if results:
+                        print(f"\n--- Search: {response['query']} ---")
+                        for msg in results:
+                            print(f"#{msg['room']} [{msg['timestamp'].replace('T', ' ').split('.')[0]}] <{msg['username']}>: {msg['content']}")
+                        print("----------------------\n")
+                    if self.search_cursor and response.get('next_offset') is not None:
+                        self.search_cursor['offset'] = response['next_offset']
+                        print("Type 'search' for more results.")
+                    else:
+                        self.search_cursor = None
                 if 'rooms' in response:
                     print("\n--- Available Rooms ---")
                     for room in response['rooms']:
@@ -123,42 +241,67 @@ class ChatClient:
                     print("----------------------------------\n")
                 if 'leaderboard' in response:
                     print("\n--- Leaderboard (Top Chatters) ---")
-                    print(f"{'Username':<15} {'Messages':<10} {'Last Active (IST)':<25}")
-                    print("-" * 50)
+                    print(f"{'#':<4} {'Username':<15} {'Messages':<10} {'Active Time':<12} {'Last Active (IST)':<25}")
+                    print("-" * 68)
                     for entry in response['leaderboard']:
-                        # Convert UTC to IST (UTC+5:30)
-                        utc_dt = datetime.datetime.fromisoformat(entry['last_active'])
-                        ist_tz = datetime.timezone(datetime.timedelta(hours=5, minutes=30))
-                        ist_dt = utc_dt.astimezone(ist_tz)
-                        print(f"{entry['username']:<15} {entry['message_count']:<10} {ist_dt.strftime('%Y-%m-%d %H:%M:%S'):<25}")
+                        print(self.format_leaderboard_entry(entry))
+                    my_rank = response.get('my_rank')
+                    if my_rank:
+                        print("-" * 68)
+                        print(self.format_leaderboard_entry(my_rank))
                     print("----------------------------------\n")
+                if 'online_users' in response:
+                    print("\n--- Online Users ---")
+                    for username in response['online_users']:
+                        print(f"  - {username}")
+                    if response['online_count'] > len(response['online_users']):
+                        print(f"  ... and {response['online_count'] - len(response['online_users'])} more")
+                    print("--------------------\n")
+                if 'stats' in response:
+                    print(json.dumps(response['stats'], indent=2))
                 
                 # If command was 'leave_room' or 'logout'
-                if message == "Left room" or message.startswith("Logging out"):
+                if message and (message == "Left room" or message.startswith("Logging out")):
                     self.current_room = None
                     if message.startswith("Logging out"):
                         self.authenticated = False
                         self.username = None
+                        self.session_token = None # A deliberate logout must not be resumed
                         self.disconnect() # Disconnect on logout
+            elif response_type == 'throttled':
+                print(f"\nSLOW DOWN: {message}")
+                if self.resuming: # The token is still good; ask again once the server allows it
+                    threading.Timer(response.get('retry_after', 1), self.send_command, args=('resume',),
+                                    kwargs={'token': self.session_token, 'last_seen_id': self.last_seen_id}).start()
             elif status == 'error':
                 print(f"\nERROR: {message}")
+                if self.resuming: # Token expired or the server no longer accepts it
+                    self.resuming = False
+                    self.session_token = None
             else:
-                print(f"\nSERVER RESPONSE: {response_json}")
+                print(f"\nSERVER RESPONSE: {json.dumps(response)}")
 
             sys.stdout.write(f"\n{self.username if self.authenticated else 'guest'}@chat_system > ")
             sys.stdout.flush()
 
-        except json.JSONDecodeError:
-            print(f"Received malformed JSON: {response_json}")
         except Exception as e:
-            print(f"Error processing server response: {e}, Response: {response_json}")
+            print(f"Error processing server response: {e}, Response: {response}")
             
+    def format_leaderboard_entry(self, entry):
+        # Convert UTC to IST (UTC+5:30)
+        utc_dt = datetime.datetime.fromisoformat(entry['last_active'])
+        ist_tz = datetime.timezone(datetime.timedelta(hours=5, minutes=30))
+        ist_dt = utc_dt.astimezone(ist_tz)
+        hours, remainder = divmod(entry.get('active_seconds', 0), 3600)
+        active_time = f"{hours}h {remainder // 60:02d}m"
+        return f"{entry.get('rank', ''):<4} {entry['username']:<15} {entry['message_count']:<10} {active_time:<12} {ist_dt.strftime('%Y-%m-%d %H:%M:%S'):<25}"
+
     def run(self):
         self.connect()
         if not self.connected:
             return
 
-        while self.connected:
+        while self.connected or self.reconnecting:
             try:
                 sys.stdout.write(f"\n{self.username if self.authenticated else 'guest'}@chat_system > ")
                 sys.stdout.flush()
@@ -211,12 +354,40 @@ class ChatClient:
                             print("Usage: send <your message>")
                     else:
                         print("You must join a room to send messages.")
+                elif command == 'dm':
+                    recipient, _, text = args.partition(' ')
+                    if recipient and text:
+                        self.send_command('dm', username=recipient, message=text)
+                    else:
+                        print("Usage: dm <username> <message>")
+                elif command == 'online':
+                    self.send_command('online', username=args or None)
                 elif command == 'list_rooms':
                     self.send_command('list_rooms')
                 elif command == 'room_stats':
                     self.send_command('room_stats')
+                elif command == 'history':
+                    if not self.current_room:
+                        print("You must join a room to view history.")
+                    elif args and not args.isdigit():
+                        print("Usage: history [count]")
+                    else:
+                        cursor = self.history_cursor or {}
+                        self.send_command('history', room_name=self.current_room, limit=int(args or 20), **cursor)
+                elif command == 'search':
+                    search_all = args.startswith('--all')
+                    query = args[len('--all'):].strip() if search_all else args
+                    if query:
+                        self.search_cursor = {"query": query, "global": search_all, "offset": 0}
+                        self.send_command('search', **self.search_cursor)
+                    elif self.search_cursor and not search_all:
+                        self.send_command('search', **self.search_cursor)
+                    else:
+                        print("Usage: search [--all] <words>")
                 elif command == 'leaderboard':
                     self.send_command('leaderboard')
+                elif command == 'admin_stats':
+                    self.send_command('admin_stats')
                 elif command == 'logout':
                     self.send_command('logout')
                 elif command == 'help':
@@ -0,0 +1,350 @@
+# client/src/loadgen.py
+"""Headless load generator: simulated users driven by a scenario file, speaking the client's wire protocol.
+
+    python client/src/loadgen.py client/scenarios/smoke.json --host localhost --port 12345
+    python client/src/loadgen.py client/scenarios/mixed_rooms.json --output results.json --baseline last_release.json
+
+Every user connects, registers (or reuses an existing account), logs in and joins its room.
+Once all users are ready they send messages at the scenario's rate for its duration. Each message
+carries its send time, so every delivery to every room member yields an end-to-end latency
+sample. Messages sent during the warm-up are delivered but not measured.
+
+Scenario files are JSON; keys left out take the values in SCENARIO_DEFAULTS. Room sizes follow
+rooms.distribution: 'uniform' spreads users evenly over rooms.count rooms, 'zipf' makes a few
+rooms large and most small (rooms.skew sets how steeply), and 'sizes' takes explicit
+[[members, rooms], ...] groups from rooms.sizes.
+
+Thousands of users need as many file descriptors (ulimit -n). Registration and login hash
+passwords on the server, so start it with a lower PASSWORD_HASH_ITERATIONS for large runs. The
+server's RATE_LIMITS and ROOM_MESSAGE_RATE also apply; throttled sends are reported separately.
+"""
+import argparse
+import asyncio
+import collections
+import json
+import os
+import random
+import time
+
+from wire import PROTOCOL_JSON, FrameDecoder, encode_command
+
+SERVER_HOST = os.getenv('SERVER_HOST', 'localhost')
+SERVER_PORT = int(os.getenv('SERVER_PORT', 12345))
+REQUEST_TIMEOUT = 30 # Seconds to wait for the reply to a setup command
+SETUP_RETRIES = 6 # Attempts per setup command that is throttled, refused as busy or races room creation
+PASSWORD = 'loadtest'
+
+SCENARIO_DEFAULTS = {
+    "name": "unnamed",
+    "users": 100,
+    "connect_rate": 100, # New connections per second during setup
+    "protocol": PROTOCOL_JSON,
+    "rooms": {"count": 10, "distribution": "uniform", "skew": 1.0, "sizes": None},
+    "message_rate": 0.5, # Messages per second per user, Poisson distributed
+    "message_size": 64, # Bytes of content per message
+    "warmup": 2, # Seconds of sending before measurement starts
+    "duration": 30, # Seconds of sending, including the warm-up
+    "drain": 3, # Seconds to wait for deliveries still in flight after sending stops
+    "user_prefix": "lg_", # Usernames are <prefix><n>; runs reuse accounts with the same prefix
+    "seed": 1,
+}
+
+
+def load_scenario(path):
+    with open(path) as f:
+        overrides = json.load(f)
+    scenario = dict(SCENARIO_DEFAULTS, **overrides)
+    scenario['rooms'] = dict(SCENARIO_DEFAULTS['rooms'], **overrides.get('rooms', {}))
+    return scenario
+
+
+def assign_rooms(scenario, rng):
+    """Returns the room name of every user, following the scenario's room size distribution."""
+    users = scenario['users']
+    rooms = scenario['rooms']
+    prefix = f"{scenario['user_prefix']}room"
+    if rooms['distribution'] == 'sizes':
+        names = []
+        room_number = 0
+        for members, count in rooms['sizes']:
+            for _ in range(count):
+                names.extend([f"{prefix}{room_number}"] * members)
+                room_number += 1
+        return (names * (users // max(1, len(names)) + 1))[:users] # Repeat or cut the layout to fit the user count
+    if rooms['distribution'] == 'zipf':
+        weights = [1 / (rank + 1) ** rooms['skew'] for rank in range(rooms['count'])]
+        return [f"{prefix}{k}" for k in rng.choices(range(rooms['count']), weights, k=users)]
+    return [f"{prefix}{n % rooms['count']}" for n in range(users)]
+
+
+def percentile(samples, fraction):
+    if not samples:
+        return 0.0
+    return samples[min(len(samples) - 1, int(len(samples) * fraction))]
+
+
+class Stats:
+    """Counters shared by every simulated user; all of them run on one event loop, so no locking."""
+
+    def __init__(self):
+        self.measure_from = None # perf_counter() bounds of the measurement window
+        self.measure_until = None
+        self.sent = 0
+        self.expected_deliveries = 0
+        self.deliveries = 0
+        self.latencies = [] # Seconds from send to delivery, per delivery
+        self.throttled = 0
+        self.send_errors = collections.Counter() # {error message: count}
+        self.setup_errors = collections.Counter()
+        self.disconnects = 0
+
+    def measuring(self, sent_at):
+        return self.measure_from is not None and self.measure_from <= sent_at < self.measure_until
+
+
+class SimulatedUser:
+    def __init__(self, index, room_name, scenario, stats):
+        self.index = index
+        self.username = f"{scenario['user_prefix']}{index}"
+        self.room_name = room_name
+        self.scenario = scenario
+        self.stats = stats
+        self.protocol = PROTOCOL_JSON # Switched once the server acknowledges a binary handshake
+        self.decoder = FrameDecoder()
+        self.replies = asyncio.Queue() # Replies to setup commands; None once the connection is gone
+        self.reader = None
+        self.writer = None
+        self.read_task = None
+        self.ready = False
+        self.sending = False
+        self.closing = False
+        self.room_size = 0 # Ready members of this user's room, i.e. deliveries expected per message sent
+
+    def send(self, command):
+        self.writer.write(encode_command(self.protocol, command))
+
+    async def _read_loop(self):
+        try:
+            while True:
+                data = await self.reader.read(65536)
+                if not data:
+                    break
+                self.decoder.feed(data)
+                while True:
+                    message = self.decoder.next_message()
+                    if message is None:
+                        break
+                    if isinstance(message, dict):
+                        self._handle(message)
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            if not self.closing:
+                self.stats.disconnects += 1
+            self.replies.put_nowait(None)
+
+    def _handle(self, message):
+        kind = message.get('type')
+        if kind == 'chat_message':
+            self._record_delivery(message.get('content', ''))
+        elif kind == 'prompt':
+            pass
+        elif kind == 'hello':
+            if message.get('protocol') == self.scenario['protocol']:
+                self.decoder.switch_to_binary() # Everything after the acknowledgement is binary
+                self.protocol = message['protocol']
+            self.replies.put_nowait(message)
+        elif self.sending: # send_message only answers on failure
+            if not self.stats.measuring(time.perf_counter()):
+                return # Replies arrive within milliseconds, so this attributes them to the right window
+            self.stats.expected_deliveries -= self.room_size # The refused message is never broadcast
+            if kind == 'throttled':
+                self.stats.throttled += 1
+            elif message.get('status') == 'error':
+                self.stats.send_errors[message.get('message')] += 1
+        else:
+            self.replies.put_nowait(message)
+
+    def _record_delivery(self, content):
+        # Load generator messages start with '<sender index>:<sequence>:<perf_counter at send>|'
+        header, separator, _ = content.partition('|')
+        if not separator:
+            return # A join notice or another client's message
+        try:
+            sent_at = float(header.split(':')[2])
+        except (IndexError, ValueError):
+            return
+        if self.stats.measuring(sent_at):
+            self.stats.deliveries += 1
+            self.stats.latencies.append(time.perf_counter() - sent_at)
+
+    async def request(self, command, **fields):
+        """Sends a setup command and returns its reply, retrying when the server asks to back off."""
+        reply = None
+        for attempt in range(SETUP_RETRIES):
+            self.send(dict(command=command, **fields))
+            reply = await asyncio.wait_for(self.replies.get(), REQUEST_TIMEOUT)
+            if reply is None:
+                raise ConnectionError("Connection closed by the server.")
+            message = str(reply.get('message', ''))
+            if reply.get('type') == 'throttled':
+                await asyncio.sleep(reply.get('retry_after', 1))
+            elif reply.get('status') == 'error' and ('try again' in message.lower() or message.endswith('does not exist.')):
+                await asyncio.sleep(0.2 * 2 ** attempt) # Password hashing is saturated, or the room's creator is not done yet
+            else:
+                return reply
+        return reply
+
+    async def start(self, host, port, creates_room):
+        try:
+            self.reader, self.writer = await asyncio.open_connection(host, port)
+            self.read_task = asyncio.ensure_future(self._read_loop())
+            if self.scenario['protocol'] != PROTOCOL_JSON:
+                await self.request('hello', protocol=self.scenario['protocol'])
+            await self.request('register', username=self.username, password=PASSWORD) # Fails harmlessly if the account exists
+            reply = await self.request('login', username=self.username, password=PASSWORD)
+            if reply.get('status') != 'success':
+                raise RuntimeError(f"login: {reply.get('message')}")
+            if creates_room:
+                await self.request('create_room', room_name=self.room_name) # Fails harmlessly if the room exists
+            reply = await self.request('join_room', room_name=self.room_name)
+            if reply.get('status') != 'success':
+                raise RuntimeError(f"join_room: {reply.get('message')}")
+            self.ready = True
+        except (OSError, asyncio.TimeoutError, ConnectionError, RuntimeError) as e:
+            self.stats.setup_errors[f"{type(e).__name__}: {e}"] += 1
+            await self.close()
+
+    def payload(self, sequence, sent_at):
+        header = f"{self.index}:{sequence}:{sent_at:.6f}|"
+        return header + 'x' * max(0, self.scenario['message_size'] - len(header))
+
+    async def send_loop(self, started, stop_at, rng):
+        """Sends messages with exponentially distributed gaps (a Poisson process) until stop_at."""
+        self.sending = True
+        rate = self.scenario['message_rate']
+        next_send = started + rng.expovariate(rate)
+        sequence = 0
+        while next_send < stop_at and not self.read_task.done():
+            delay = next_send - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            sent_at = time.perf_counter()
+            self.send({"command": "send_message", "message": self.payload(sequence, sent_at)})
+            if self.stats.measuring(sent_at):
+                self.stats.sent += 1
+                self.stats.expected_deliveries += self.room_size
+            sequence += 1
+            next_send += rng.expovariate(rate) # Fixed schedule: a slow server does not lower the offered load
+            try:
+                await self.writer.drain()
+            except (ConnectionError, OSError):
+                break
+
+    async def close(self):
+        self.closing = True
+        if self.writer is not None:
+            self.writer.close()
+        if self.read_task is not None:
+            await asyncio.gather(self.read_task, return_exceptions=True)
+
+
+async def run_scenario(scenario, host, port):
+    rng = random.Random(scenario['seed'])
+    stats = Stats()
+    room_of_user = assign_rooms(scenario, rng)
+    users = [SimulatedUser(index, room, scenario, stats) for index, room in enumerate(room_of_user)]
+
+    print(f"Scenario '{scenario['name']}': {len(users)} users in {len(set(room_of_user))} rooms, "
+          f"{scenario['message_rate']} msg/s each for {scenario['duration']}s ({scenario['protocol']}).")
+    setup_started = time.perf_counter()
+    creators = set()
+    tasks = []
+    for index, user in enumerate(users):
+        creates_room = user.room_name not in creators
+        creators.add(user.room_name)
+        tasks.append(asyncio.ensure_future(user.start(host, port, creates_room)))
+        delay = setup_started + (index + 1) / scenario['connect_rate'] - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+    await asyncio.gather(*tasks)
+    setup_seconds = time.perf_counter() - setup_started
+    ready = [user for user in users if user.ready]
+    room_sizes = collections.Counter(user.room_name for user in ready)
+    for user in ready:
+        user.room_size = room_sizes[user.room_name]
+    print(f"{len(ready)} of {len(users)} users ready in {setup_seconds:.1f}s.")
+
+    started = time.perf_counter()
+    stats.measure_from = started + scenario['warmup']
+    stats.measure_until = stop_at = started + scenario['duration']
+    await asyncio.gather(*(user.send_loop(started, stop_at, random.Random(scenario['seed'] * 100003 + user.index)) for user in ready))
+    await asyncio.sleep(scenario['drain'])
+    await asyncio.gather(*(user.close() for user in users))
+    return report(scenario, stats, len(users), len(ready), setup_seconds)
+
+
+def report(scenario, stats, users, ready, setup_seconds):
+    window = max(1e-9, stats.measure_until - stats.measure_from)
+    latencies = sorted(latency * 1000 for latency in stats.latencies)
+    return {
+        "scenario": scenario['name'],
+        "users": users,
+        "ready_users": ready,
+        "setup_seconds": round(setup_seconds, 2),
+        "setup_errors": dict(stats.setup_errors),
+        "target_send_rate": round(ready * scenario['message_rate'], 1),
+        "send_rate": round(stats.sent / window, 1),
+        "sent": stats.sent, # Includes throttled and failed sends
+        "throttled": stats.throttled,
+        "send_errors": dict(stats.send_errors),
+        "expected_deliveries": stats.expected_deliveries,
+        "deliveries": stats.deliveries,
+        "delivery_ratio": round(stats.deliveries / stats.expected_deliveries, 4) if stats.expected_deliveries else 0,
+        "fanout_per_sec": round(stats.deliveries / window, 1),
+        "disconnects": stats.disconnects,
+        "latency_ms": {name: round(percentile(latencies, fraction), 2) for name, fraction in
+                       (("p50", 0.5), ("p90", 0.9), ("p99", 0.99), ("p999", 0.999), ("max", 1.0))},
+    }
+
+
+def print_report(result, baseline=None):
+    latency = result['latency_ms']
+    print(f"\nSetup:      {result['ready_users']}/{result['users']} users ready in {result['setup_seconds']}s"
+          + (f", errors: {result['setup_errors']}" if result['setup_errors'] else ""))
+    print(f"Sent:       {result['sent']} messages, {result['send_rate']}/s (target {result['target_send_rate']}/s), "
+          f"{result['throttled']} throttled" + (f", errors: {result['send_errors']}" if result['send_errors'] else ""))
+    print(f"Delivered:  {result['deliveries']} of {result['expected_deliveries']} ({result['delivery_ratio']:.2%}), "
+          f"fan-out {result['fanout_per_sec']}/s, {result['disconnects']} disconnects")
+    print(f"Latency ms: p50 {latency['p50']}  p90 {latency['p90']}  p99 {latency['p99']}  p99.9 {latency['p999']}  max {latency['max']}")
+    if baseline:
+        print(f"\nAgainst baseline '{baseline['scenario']}':")
+        for label, new, old in (
+            ("send rate", result['send_rate'], baseline['send_rate']),
+            ("fan-out/s", result['fanout_per_sec'], baseline['fanout_per_sec']),
+            ("delivery ratio", result['delivery_ratio'], baseline['delivery_ratio']),
+            ("latency p50", latency['p50'], baseline['latency_ms']['p50']),
+            ("latency p99", latency['p99'], baseline['latency_ms']['p99']),
+        ):
+            change = f"{(new - old) / old:+.1%}" if old else "n/a"
+            print(f"  {label:<15} {old:>10} -> {new:<10} ({change})")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('scenario', help="Scenario JSON file (see client/scenarios)")
+    parser.add_argument('--host', default=SERVER_HOST)
+    parser.add_argument('--port', type=int, default=SERVER_PORT)
+    parser.add_argument('--output', help="Write the results as JSON to this file")
+    parser.add_argument('--baseline', help="Results JSON from an earlier run to compare against")
+    args = parser.parse_args()
+
+    result = asyncio.run(run_scenario(load_scenario(args.scenario), args.host, args.port))
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    print_report(result, baseline)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2)
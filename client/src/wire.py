@@ -0,0 +1,88 @@
+# client/src/wire.py
+# Client side of the chat wire protocols. Mirrors server/src/protocol.py, which is packaged separately.
+import datetime
+import json
+import struct
+
+PROTOCOL_JSON = 'json'
+PROTOCOL_BINARY = 'binary-v1'
+
+FRAME_HEADER = struct.Struct('>I')
+FRAME_CHAT_MESSAGE = 0x01
+FRAME_JSON = 0x02
+FRAME_SEND_MESSAGE = 0x03
+CHAT_MESSAGE_HEADER = struct.Struct('>BqdHI') # type, message id (0 if none), timestamp as seconds from the epoch in UTC, sender length, content length
+
+
+def encode_command(protocol, message):
+    """Encodes a command dict for the given protocol."""
+    if protocol != PROTOCOL_BINARY:
+        return (json.dumps(message) + '\n').encode('utf-8')
+    if message.get('command') == 'send_message' and set(message) == {'command', 'message'}:
+        body = bytes((FRAME_SEND_MESSAGE,)) + message['message'].encode('utf-8')
+    else:
+        body = bytes((FRAME_JSON,)) + json.dumps(message).encode('utf-8')
+    return FRAME_HEADER.pack(len(body)) + body
+
+
+def decode_binary_frame(frame):
+    """Decodes one length-prefixed frame body into the same dict the JSON protocol would carry."""
+    frame_type = frame[0]
+    if frame_type == FRAME_JSON:
+        return json.loads(bytes(frame[1:]))
+    if frame_type == FRAME_CHAT_MESSAGE:
+        _, message_id, timestamp, sender_length, content_length = CHAT_MESSAGE_HEADER.unpack_from(frame)
+        offset = CHAT_MESSAGE_HEADER.size
+        sender = bytes(frame[offset:offset + sender_length]).decode('utf-8')
+        offset += sender_length
+        content = bytes(frame[offset:offset + content_length]).decode('utf-8')
+        message = {
+            "type": "chat_message",
+            "sender": sender,
+            "content": content,
+            # The server encodes its timestamps as UTC; decoding them the same way reproduces the JSON protocol's text
+            "timestamp": datetime.datetime.fromtimestamp(timestamp, datetime.timezone.utc).replace(tzinfo=None).isoformat()
+        }
+        if message_id:
+            message["id"] = message_id
+        return message
+    raise ValueError(f"Unknown frame type {frame_type}")
+
+
+class FrameDecoder:
+    """Incrementally splits received bytes into decoded messages for either protocol.
+
+    Starts in JSON-lines mode; switch_to_binary() is called once the server acknowledges the
+    binary handshake, and any bytes already buffered are then parsed as binary frames.
+    """
+
+    def __init__(self):
+        self.buffer = bytearray()
+        self.binary = False
+
+    def switch_to_binary(self):
+        self.binary = True
+
+    def feed(self, data):
+        self.buffer += data
+
+    def next_message(self):
+        """Returns the next complete message as a dict (or a raw str for undecodable JSON lines), or None."""
+        if self.binary:
+            if len(self.buffer) < FRAME_HEADER.size:
+                return None
+            (length,) = FRAME_HEADER.unpack_from(self.buffer)
+            if len(self.buffer) < FRAME_HEADER.size + length:
+                return None
+            frame = bytes(self.buffer[FRAME_HEADER.size:FRAME_HEADER.size + length])
+            del self.buffer[:FRAME_HEADER.size + length]
+            return decode_binary_frame(frame)
+        newline = self.buffer.find(b'\n')
+        if newline == -1:
+            return None
+        line = self.buffer[:newline].decode('utf-8').strip()
+        del self.buffer[:newline + 1]
+        try:
+            return json.loads(line)
+        except json.JSONDecodeError:
+            return line
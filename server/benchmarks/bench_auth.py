@@ -0,0 +1,108 @@
+# server/benchmarks/bench_auth.py
+"""Measures login throughput and latency for password verification under concurrent logins.
+
+No database is needed; each simulated login only verifies a stored hash:
+
+    python server/benchmarks/bench_auth.py --clients 1 8 64 --logins 400
+
+Compares the legacy unsalted sha256 check, PBKDF2 computed inline on each client's thread,
+and PBKDF2 on the bounded PasswordHasher pool. While logins run, a probe thread measures
+how long a trivial piece of work waits for the interpreter, i.e. how badly a login storm
+stalls everything else.
+"""
+import argparse
+import hashlib
+import os
+import statistics
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from passwords import PasswordHasher, HasherBusy, check_password, hash_password
+
+PASSWORD = 'correct horse battery staple'
+
+
+def percentile(samples, fraction):
+    samples = sorted(samples)
+    return samples[max(0, int(len(samples) * fraction) - 1)]
+
+
+def probe(stop, delays):
+    # Sleeps 1ms at a time; anything beyond that is time spent waiting for the GIL
+    while not stop.is_set():
+        started = time.perf_counter()
+        time.sleep(0.001)
+        delays.append((time.perf_counter() - started - 0.001) * 1000)
+
+
+def run_case(verify, clients, logins):
+    latencies = []
+    refused = [0]
+    lock = threading.Lock()
+    per_client = max(1, logins // clients)
+
+    def client():
+        for _ in range(per_client):
+            started = time.perf_counter()
+            try:
+                verify()
+            except HasherBusy:
+                with lock:
+                    refused[0] += 1
+                continue
+            elapsed = (time.perf_counter() - started) * 1000
+            with lock:
+                latencies.append(elapsed)
+
+    stop = threading.Event()
+    delays = []
+    probe_thread = threading.Thread(target=probe, args=(stop, delays))
+    probe_thread.start()
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    stop.set()
+    probe_thread.join()
+    return {
+        'logins_per_sec': len(latencies) / elapsed,
+        'p50': statistics.median(latencies) if latencies else 0,
+        'p95': percentile(latencies, 0.95) if latencies else 0,
+        'probe_p95': percentile(delays, 0.95) if delays else 0,
+        'refused': refused[0]
+    }
+
+
+def run(client_counts, logins, iterations, workers):
+    legacy_hash = hashlib.sha256(PASSWORD.encode()).hexdigest()
+    pbkdf2_hash = hash_password(PASSWORD, iterations)
+    hasher = PasswordHasher(workers=workers, iterations=iterations)
+    cases = [
+        ('sha256 (legacy)', lambda: check_password(PASSWORD, legacy_hash, iterations)),
+        ('pbkdf2 inline', lambda: check_password(PASSWORD, pbkdf2_hash, iterations)),
+        (f'pbkdf2 pool({workers})', lambda: hasher.verify(PASSWORD, pbkdf2_hash)),
+    ]
+    print(f"PBKDF2-SHA256 with {iterations} iterations, {os.cpu_count()} CPUs")
+    print(f"{'clients':>8} {'mode':<18} {'logins/s':>10} {'p50 ms':>9} {'p95 ms':>9} {'stall p95 ms':>13} {'refused':>8}")
+    for clients in client_counts:
+        for name, verify in cases:
+            r = run_case(verify, clients, logins)
+            print(f"{clients:>8} {name:<18} {r['logins_per_sec']:>10.1f} {r['p50']:>9.2f} {r['p95']:>9.2f} "
+                  f"{r['probe_p95']:>13.2f} {r['refused']:>8}")
+    hasher.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--clients', type=int, nargs='+', default=[1, 8, 64], help="Concurrent login threads")
+    parser.add_argument('--logins', type=int, default=200, help="Logins per case")
+    parser.add_argument('--iterations', type=int, default=int(os.getenv('PASSWORD_HASH_ITERATIONS', 310000)))
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 2, help="PasswordHasher pool size")
+    args = parser.parse_args()
+    run(args.clients, args.logins, args.iterations, args.workers)
@@ -0,0 +1,75 @@
+# server/benchmarks/bench_fanout.py
+"""Measures broadcast fan-out cost per message as a room grows.
+
+Compares encoding the chat frame once per recipient (the old broadcast loop) with fan_out,
+which encodes once per protocol and hands the same bytes to every recipient's OutboundQueue.
+Needs no database or network:
+
+    python server/benchmarks/bench_fanout.py --sizes 10 100 1000 2000 5000
+"""
+import argparse
+import datetime
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from outbound import OutboundQueue, fan_out
+from protocol import CODECS, JSON_CODEC
+
+
+class QueuedRecipient:
+    """The enqueue side of a client connection, without a socket or writer behind it."""
+
+    def __init__(self, codec):
+        self.codec = codec
+        self.queue = OutboundQueue(max_frames=1 << 30, max_bytes=1 << 40)
+
+    def send(self, frame):
+        return self.queue.put(frame)
+
+
+def per_recipient_encode(recipients, message_data, exclude_user_id=None):
+    # The pre-fan_out broadcast loop: encode inside the loop, once for every member
+    for user_id, connection in recipients:
+        if user_id != exclude_user_id:
+            connection.send(connection.codec.encode(message_data))
+
+
+def measure(broadcast, recipients, messages):
+    started = time.perf_counter()
+    for message_id in range(messages):
+        broadcast(recipients, {
+            "type": "chat_message",
+            "id": message_id,
+            "sender": "benchmark",
+            "content": "The quick brown fox jumps over the lazy dog. " * 3,
+            "timestamp": datetime.datetime.now().isoformat()
+        })
+    elapsed = time.perf_counter() - started
+    for _, connection in recipients:
+        connection.queue.take_all()
+    return elapsed / messages * 1e6 # Microseconds per message
+
+
+def run(sizes, messages, binary_share):
+    print(f"{'room size':>10} {'strategy':<22} {'us/message':>12} {'us/recipient':>14}")
+    for size in sizes:
+        binary_count = int(size * binary_share)
+        recipients = [
+            (user_id, QueuedRecipient(CODECS['binary-v1'] if user_id < binary_count else JSON_CODEC))
+            for user_id in range(size)
+        ]
+        for name, broadcast in (('encode per recipient', per_recipient_encode), ('encode once (fan_out)', fan_out)):
+            per_message = measure(broadcast, recipients, messages)
+            print(f"{size:>10} {name:<22} {per_message:>12.1f} {per_message / size:>14.3f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 1000, 2000, 5000], help="Room sizes to test")
+    parser.add_argument('--messages', type=int, default=200, help="Messages broadcast per measurement")
+    parser.add_argument('--binary-share', type=float, default=0.0, help="Fraction of recipients using the binary protocol")
+    args = parser.parse_args()
+    run(args.sizes, args.messages, args.binary_share)
@@ -0,0 +1,107 @@
+# server/benchmarks/bench_prepared.py
+"""Compares per-query latency of the hot Database statements with and without prepared statements.
+
+Run against a scratch database (its tables are dropped and rebuilt):
+
+    BENCH_DB=chat_bench python server/benchmarks/bench_prepared.py --iterations 2000
+
+Connection settings come from the same DB_HOST / POSTGRES_USER / POSTGRES_PASSWORD variables as the server.
+Identity caches are bypassed so every call reaches Postgres.
+"""
+import argparse
+import datetime
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+import database
+from database import Database
+
+USERS = 1000
+ROOMS = 20
+MESSAGES = 50000
+
+
+def open_database(prepared):
+    return Database(
+        os.getenv('BENCH_DB', 'chat_bench'),
+        os.getenv('POSTGRES_USER', 'chat_user'),
+        os.getenv('POSTGRES_PASSWORD', 'chat_password'),
+        os.getenv('DB_HOST', 'localhost'),
+        min_connections=1, max_connections=1, # One connection, so every call after the first reuses its statements
+        prepared_statements=prepared
+    )
+
+
+def reset(db):
+    def rebuild(cursor):
+        cursor.execute("TRUNCATE messages, room_counters, leaderboard, rooms, users RESTART IDENTITY CASCADE;")
+        cursor.execute("INSERT INTO users (username, password_hash) SELECT 'user' || g, 'x' FROM generate_series(1, %s) g;", (USERS,))
+        cursor.execute("INSERT INTO leaderboard (user_id) SELECT id FROM users;")
+        cursor.execute("INSERT INTO rooms (name) SELECT 'room' || g FROM generate_series(1, %s) g;", (ROOMS,))
+        cursor.execute("""
+            INSERT INTO messages (room_id, user_id, content, timestamp)
+            SELECT 1 + (g %% %s), 1 + (g %% %s), 'benchmark message ' || g, TIMESTAMP '2024-01-01' + g * INTERVAL '1 second'
+            FROM generate_series(1, %s) g;
+        """, (ROOMS, USERS, MESSAGES))
+        cursor.execute("INSERT INTO room_counters (room_id, message_count) SELECT room_id, COUNT(*) FROM messages GROUP BY room_id;")
+        cursor.execute("ANALYZE;")
+    db._execute(rebuild)
+
+
+def time_calls(call, iterations):
+    call() # Warm up (and prepare, on the first use of the connection)
+    samples = []
+    for i in range(iterations):
+        started = time.perf_counter()
+        call(i)
+        samples.append((time.perf_counter() - started) * 1e6)
+    samples.sort()
+    return statistics.median(samples), samples[int(len(samples) * 0.95) - 1]
+
+
+def cases(db):
+    now = datetime.datetime(2025, 1, 1)
+    next_id = [10 ** 8]
+
+    def batch(size):
+        def save(i=0):
+            rows = []
+            for n in range(size):
+                next_id[0] += 1
+                rows.append((next_id[0], 1 + n % ROOMS, 1 + n % USERS, 'bench', now))
+            db.save_messages_batch(rows)
+        return save
+
+    return [
+        ('username_by_id', lambda i=0: db._fetchone(database.USERNAME_BY_ID, (1 + i % USERS,))),
+        ('user_credentials', lambda i=0: db._fetchone(database.USER_CREDENTIALS, (f"user{1 + i % USERS}",))),
+        ('room_details', lambda i=0: db._fetchone(database.ROOM_DETAILS, (f"room{1 + i % ROOMS}",))),
+        ('message_history', lambda i=0: db.get_message_history(1 + i % ROOMS, 50)),
+        ('save batch of 1', batch(1)),
+        ('save batch of 100', batch(100)),
+    ]
+
+
+def run(iterations):
+    results = {}
+    for prepared in (False, True):
+        db = open_database(prepared)
+        reset(db)
+        for name, call in cases(db):
+            results[(name, prepared)] = time_calls(call, iterations)
+        db.close()
+    print(f"{'statement':<20} {'plain p50':>10} {'prepared p50':>13} {'plain p95':>10} {'prepared p95':>13}   (microseconds)")
+    for name, _ in cases(None):
+        plain, prepared = results[(name, False)], results[(name, True)]
+        print(f"{name:<20} {plain[0]:>10.1f} {prepared[0]:>13.1f} {plain[1]:>10.1f} {prepared[1]:>13.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--iterations', type=int, default=2000)
+    args = parser.parse_args()
+    run(args.iterations)
@@ -0,0 +1,125 @@
+# server/benchmarks/bench_schema.py
+"""Measures message history and leaderboard query latency before and after the index migration.
+
+Run against a scratch database (its tables are dropped and rebuilt):
+
+    BENCH_DB=chat_bench python server/benchmarks/bench_schema.py --sizes 1000000 10000000
+
+Connection settings come from the same DB_HOST / POSTGRES_USER / POSTGRES_PASSWORD variables as the server.
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+import psycopg2
+
+from migrations import apply_migrations, LATEST_VERSION
+
+INDEX_MIGRATION = 3
+
+HISTORY_QUERY = """
+    SELECT u.username, m.content, m.timestamp
+    FROM messages m
+    JOIN users u ON m.user_id = u.id
+    WHERE m.room_id = %s
+    ORDER BY m.timestamp DESC, m.id DESC
+    LIMIT 50;
+"""
+
+LEADERBOARD_QUERY = """
+    SELECT u.username, l.message_count, l.last_active
+    FROM leaderboard l
+    JOIN users u ON l.user_id = u.id
+    ORDER BY l.message_count DESC, l.last_active DESC
+    LIMIT 10;
+"""
+
+
+def connect():
+    conn = psycopg2.connect(
+        dbname=os.getenv('BENCH_DB', 'chat_bench'),
+        user=os.getenv('POSTGRES_USER', 'chat_user'),
+        password=os.getenv('POSTGRES_PASSWORD', 'chat_password'),
+        host=os.getenv('DB_HOST', 'localhost')
+    )
+    conn.autocommit = True
+    return conn
+
+
+def reset_schema(cursor):
+    cursor.execute("DROP TABLE IF EXISTS schema_version, room_counters, leaderboard, messages, rooms, users CASCADE;")
+    apply_migrations(cursor, target_version=INDEX_MIGRATION - 1)
+
+
+def load_data(cursor, total_messages, users, rooms):
+    cursor.execute(
+        "INSERT INTO users (username, password_hash) SELECT 'user' || g, 'x' FROM generate_series(1, %s) g;",
+        (users,)
+    )
+    cursor.execute("INSERT INTO leaderboard (user_id) SELECT id FROM users;")
+    cursor.execute(
+        "INSERT INTO rooms (name) SELECT 'room' || g FROM generate_series(1, %s) g;",
+        (rooms,)
+    )
+    # Spread messages over rooms and users, one second apart, in chunks to keep memory flat
+    chunk = 1000000
+    for start in range(0, total_messages, chunk):
+        end = min(start + chunk, total_messages)
+        cursor.execute("""
+            INSERT INTO messages (room_id, user_id, content, timestamp)
+            SELECT 1 + (g %% %s), 1 + (g %% %s), 'benchmark message ' || g,
+                   TIMESTAMP '2024-01-01' + g * INTERVAL '1 second'
+            FROM generate_series(%s, %s) g;
+        """, (rooms, users, start + 1, end))
+    cursor.execute("""
+        UPDATE leaderboard l SET message_count = c.n, last_active = c.last_active
+        FROM (SELECT user_id, COUNT(*) AS n, MAX(timestamp) AS last_active FROM messages GROUP BY user_id) c
+        WHERE l.user_id = c.user_id;
+    """)
+    cursor.execute("ANALYZE;")
+
+
+def time_query(cursor, query, params, iterations):
+    samples = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        cursor.execute(query, params)
+        cursor.fetchall()
+        samples.append((time.perf_counter() - started) * 1000)
+    samples.sort()
+    return statistics.median(samples), samples[int(len(samples) * 0.95) - 1]
+
+
+def run(sizes, users, rooms, iterations):
+    conn = connect()
+    cursor = conn.cursor()
+    print(f"{'messages':>12} {'query':<12} {'phase':<8} {'p50 ms':>10} {'p95 ms':>10}")
+    for size in sizes:
+        reset_schema(cursor)
+        load_data(cursor, size, users, rooms)
+        for phase in ('before', 'after'):
+            if phase == 'after':
+                apply_migrations(cursor, target_version=LATEST_VERSION)
+                cursor.execute("ANALYZE;")
+            for name, query, params in (
+                ('history', HISTORY_QUERY, (rooms // 2,)),
+                ('leaderboard', LEADERBOARD_QUERY, None),
+            ):
+                p50, p95 = time_query(cursor, query, params, iterations)
+                print(f"{size:>12} {name:<12} {phase:<8} {p50:>10.2f} {p95:>10.2f}")
+    cursor.close()
+    conn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000000, 10000000], help="Message table sizes to test")
+    parser.add_argument('--users', type=int, default=10000)
+    parser.add_argument('--rooms', type=int, default=200)
+    parser.add_argument('--iterations', type=int, default=50)
+    args = parser.parse_args()
+    run(args.sizes, args.users, args.rooms, args.iterations)
@@ -0,0 +1,164 @@
+# server/benchmarks/bench_search.py
+"""Measures message search latency before and after the full-text search migration.
+
+Run against a scratch database (its tables are dropped and rebuilt):
+
+    BENCH_DB=chat_bench python server/benchmarks/bench_search.py --sizes 2000000
+
+Message content is made of words 'w1' .. 'w<vocabulary>' drawn with a log-uniform (roughly Zipf)
+distribution, so 'w1' is in about a third of all messages and the rarest words in a handful.
+'before' is a regular expression scan, the only way to search without the migration; 'after'
+uses the server's own search statements.
+
+Connection settings come from the same DB_HOST / POSTGRES_USER / POSTGRES_PASSWORD variables as the server.
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+import psycopg2
+
+from database import SEARCH_ROOM_MESSAGES, SEARCH_PUBLIC_MESSAGES
+from migrations import apply_migrations, LATEST_VERSION
+from storage import SEARCH_MAX_MATCHES
+
+SEARCH_MIGRATION = 6
+WORDS_PER_MESSAGE = 8
+PAGE_SIZE = 20
+
+# Newest page of matches, as a search without a full-text index would have to find them
+SCAN_ROOM_MESSAGES = """
+    SELECT m.id, m.content, m.timestamp FROM messages m
+    WHERE m.content ~ %s AND m.room_id = %s
+    ORDER BY m.timestamp DESC, m.id DESC
+    LIMIT %s;
+"""
+SCAN_PUBLIC_MESSAGES = """
+    SELECT m.id, m.content, m.timestamp FROM messages m
+    JOIN rooms r ON m.room_id = r.id
+    WHERE m.content ~ %s AND NOT r.is_private
+    ORDER BY m.timestamp DESC, m.id DESC
+    LIMIT %s;
+"""
+
+
+def connect():
+    conn = psycopg2.connect(
+        dbname=os.getenv('BENCH_DB', 'chat_bench'),
+        user=os.getenv('POSTGRES_USER', 'chat_user'),
+        password=os.getenv('POSTGRES_PASSWORD', 'chat_password'),
+        host=os.getenv('DB_HOST', 'localhost')
+    )
+    conn.autocommit = True
+    return conn
+
+
+def reset_schema(cursor):
+    cursor.execute("DROP TABLE IF EXISTS schema_version, room_counters, leaderboard, messages, rooms, users CASCADE;")
+    apply_migrations(cursor, target_version=SEARCH_MIGRATION - 1)
+
+
+def load_data(cursor, total_messages, users, rooms, vocabulary):
+    cursor.execute(
+        "INSERT INTO users (username, password_hash) SELECT 'user' || g, 'x' FROM generate_series(1, %s) g;",
+        (users,)
+    )
+    cursor.execute("INSERT INTO leaderboard (user_id) SELECT id FROM users;")
+    # Every tenth room is private, so global search has rooms to skip
+    cursor.execute(
+        "INSERT INTO rooms (name, is_private) SELECT 'room' || g, g %% 10 = 0 FROM generate_series(1, %s) g;",
+        (rooms,)
+    )
+    chunk = 1000000
+    for start in range(0, total_messages, chunk):
+        end = min(start + chunk, total_messages)
+        # The subquery refers to g so it is evaluated once per message rather than once in total
+        cursor.execute("""
+            INSERT INTO messages (room_id, user_id, content, timestamp)
+            SELECT 1 + (g %% %s), 1 + (g %% %s),
+                   (SELECT string_agg('w' || floor(exp(random() * ln(%s)))::int, ' ')
+                    FROM generate_series(1, %s) w WHERE g > 0),
+                   TIMESTAMP '2024-01-01' + g * INTERVAL '1 second'
+            FROM generate_series(%s, %s) g;
+        """, (rooms, users, vocabulary, WORDS_PER_MESSAGE, start + 1, end))
+    cursor.execute("ANALYZE;")
+
+
+def time_query(cursor, query, params, iterations):
+    samples = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        cursor.execute(query, params)
+        cursor.fetchall()
+        samples.append((time.perf_counter() - started) * 1000)
+    samples.sort()
+    return statistics.median(samples), samples[max(0, int(len(samples) * 0.95) - 1)]
+
+
+def searches(vocabulary, room_id):
+    """(name, words, room_id) for each search that is timed; room_id None searches every public room."""
+    rare = f"w{vocabulary // 100}" # In about one message in 1,500
+    return (
+        ('rare room', [rare], room_id),
+        ('rare all', [rare], None),
+        ('common room', ['w1'], room_id),
+        ('common all', ['w1'], None),
+        ('two words', ['w2', 'w3'], None),
+        ('no match', ['nothing'], None),
+    )
+
+
+def scan_query(words, room_id):
+    pattern = ''.join(f"(?=.*\\m{word}\\M)" for word in words) # Every word, in any order
+    if room_id is None:
+        return SCAN_PUBLIC_MESSAGES, (pattern, PAGE_SIZE)
+    return SCAN_ROOM_MESSAGES, (pattern, room_id, PAGE_SIZE)
+
+
+def search_query(words, room_id, max_matches):
+    params = {"query": ' '.join(words), "room_id": room_id, "max_matches": max_matches, "limit": PAGE_SIZE, "offset": 0}
+    return (SEARCH_PUBLIC_MESSAGES if room_id is None else SEARCH_ROOM_MESSAGES), params
+
+
+def run(sizes, users, rooms, vocabulary, iterations, scan_iterations, max_matches):
+    conn = connect()
+    cursor = conn.cursor()
+    room_id = rooms // 2 + 1 # A public room
+    print(f"{'messages':>12} {'search':<12} {'phase':<8} {'p50 ms':>10} {'p95 ms':>10} {'results':>8}")
+    for size in sizes:
+        reset_schema(cursor)
+        started = time.perf_counter()
+        load_data(cursor, size, users, rooms, vocabulary)
+        print(f"Loaded {size} messages in {time.perf_counter() - started:.1f}s")
+        for name, words, scope in searches(vocabulary, room_id):
+            query, params = scan_query(words, scope)
+            p50, p95 = time_query(cursor, query, params, scan_iterations)
+            print(f"{size:>12} {name:<12} {'before':<8} {p50:>10.2f} {p95:>10.2f} {cursor.rowcount:>8}")
+
+        started = time.perf_counter()
+        apply_migrations(cursor, target_version=LATEST_VERSION)
+        cursor.execute("ANALYZE;")
+        print(f"Migration {SEARCH_MIGRATION} (search column and indexes) took {time.perf_counter() - started:.1f}s")
+        for name, words, scope in searches(vocabulary, room_id):
+            query, params = search_query(words, scope, max_matches)
+            p50, p95 = time_query(cursor, query, params, iterations)
+            print(f"{size:>12} {name:<12} {'after':<8} {p50:>10.2f} {p95:>10.2f} {cursor.rowcount:>8}")
+    cursor.close()
+    conn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[2000000], help="Message table sizes to test")
+    parser.add_argument('--users', type=int, default=10000)
+    parser.add_argument('--rooms', type=int, default=200)
+    parser.add_argument('--vocabulary', type=int, default=100000, help="Distinct words in message content")
+    parser.add_argument('--iterations', type=int, default=50)
+    parser.add_argument('--scan-iterations', type=int, default=5, help="Iterations of the slow 'before' searches")
+    parser.add_argument('--max-matches', type=int, default=SEARCH_MAX_MATCHES, help="Newest matches ranked per search")
+    args = parser.parse_args()
+    run(args.sizes, args.users, args.rooms, args.vocabulary, args.iterations, args.scan_iterations, args.max_matches)
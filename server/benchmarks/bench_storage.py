@@ -0,0 +1,117 @@
+# server/benchmarks/bench_storage.py
+"""Compares persistence overhead across the storage backends (DB_BACKEND=postgres, sqlite, memory).
+
+    python server/benchmarks/bench_storage.py --backends memory sqlite
+    BENCH_DB=chat_bench python server/benchmarks/bench_storage.py --backends memory sqlite postgres
+
+Everything goes through the Storage interface the server uses. The SQLite file is created in
+a temporary directory. PostgreSQL runs against BENCH_DB with the usual DB_HOST /
+POSTGRES_USER / POSTGRES_PASSWORD settings and adds rows to it, so point it at a scratch
+database; it is skipped if it cannot be reached.
+"""
+import argparse
+import datetime
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+import storage
+from storage import StorageError, open_storage
+from persistence import MessageWriter, MessageIdAllocator
+
+USERS = 200
+ROOMS = 10
+
+
+def open_backend(backend, directory):
+    if backend == 'sqlite':
+        storage.SQLITE_PATH = os.path.join(directory, 'bench.db')
+    return open_storage(
+        backend,
+        dbname=os.getenv('BENCH_DB', 'chat_bench'),
+        user=os.getenv('POSTGRES_USER', 'chat_user'),
+        password=os.getenv('POSTGRES_PASSWORD', 'chat_password'),
+        host=os.getenv('DB_HOST', 'localhost')
+    )
+
+
+def populate(db):
+    # Names are unique per run so repeated runs against the same PostgreSQL database do not collide
+    tag = f"{os.getpid()}_{int(time.time())}"
+    for i in range(USERS):
+        db.add_user(f"bench{tag}_{i}", 'x')
+    user_ids = [db.get_user_credentials(f"bench{tag}_{i}")[0] for i in range(USERS)]
+    room_ids = [db.create_room(f"bench{tag}_{i}", False, user_ids[0]) for i in range(ROOMS)]
+    return user_ids, room_ids
+
+
+def latency(call, iterations):
+    samples = []
+    for i in range(iterations):
+        started = time.perf_counter()
+        call(i)
+        samples.append((time.perf_counter() - started) * 1e6)
+    samples.sort()
+    return statistics.median(samples), samples[int(len(samples) * 0.95) - 1]
+
+
+def bench_backend(db, iterations, messages):
+    user_ids, room_ids = populate(db)
+    ids = MessageIdAllocator(db)
+    now = datetime.datetime.now()
+
+    def rows(size, offset):
+        return [(ids.next_id(), room_ids[(offset + n) % ROOMS], user_ids[(offset + n) % USERS], 'benchmark message', now)
+                for n in range(size)]
+
+    results = {}
+    for size in (1, 100):
+        results[f'save batch of {size}'] = latency(lambda i: db.save_messages_batch(rows(size, i)), iterations // size or 1)
+    results['message history (50)'] = latency(lambda i: db.get_message_history(room_ids[i % ROOMS], 50), iterations)
+    first_id = db.get_message_history(room_ids[0], 1)[0]['id']
+    results['messages after'] = latency(lambda i: db.get_messages_after(room_ids[0], first_id, 50), iterations)
+    results['user credentials'] = latency(lambda i: db.get_user_credentials('missing user'), iterations)
+    results['leaderboard (10)'] = latency(lambda i: db.get_leaderboard(10), iterations)
+
+    # The write-behind path the server actually uses: submit() returns at once, batches flush in the background
+    writer = MessageWriter(db)
+    started = time.perf_counter()
+    for n in range(messages):
+        writer.submit(ids.next_id(), room_ids[n % ROOMS], user_ids[n % USERS], 'benchmark message', now)
+    writer.close()
+    throughput = messages / (time.perf_counter() - started)
+    return results, throughput
+
+
+def run(backends, iterations, messages):
+    with tempfile.TemporaryDirectory() as directory:
+        table = {}
+        for backend in backends:
+            try:
+                db = open_backend(backend, directory)
+            except StorageError as e:
+                print(f"Skipping {backend}: {e}")
+                continue
+            table[backend] = bench_backend(db, iterations, messages)
+            db.close()
+    if not table:
+        return
+    names = list(next(iter(table.values()))[0])
+    print()
+    print(f"{'operation (p50 / p95 us)':<26}" + ''.join(f"{backend:>22}" for backend in table))
+    for name in names:
+        print(f"{name:<26}" + ''.join(f"{table[b][0][name][0]:>12.1f} / {table[b][0][name][1]:>7.1f}" for b in table))
+    print(f"{'write-behind msgs/s':<26}" + ''.join(f"{table[b][1]:>22.0f}" for b in table))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--backends', nargs='+', default=['memory', 'sqlite', 'postgres'], choices=['memory', 'sqlite', 'postgres'])
+    parser.add_argument('--iterations', type=int, default=1000, help="Calls per latency measurement")
+    parser.add_argument('--messages', type=int, default=50000, help="Messages pushed through the write-behind writer")
+    args = parser.parse_args()
+    run(args.backends, args.iterations, args.messages)
@@ -0,0 +1,173 @@
+# server/src/async_server.py
+import asyncio
+import logging
+import os
+import signal
+import socket
+from concurrent.futures import ThreadPoolExecutor
+
+from server import ChatServer, AUTH_PROMPT
+from outbound import OutboundQueue
+from framing import MAX_FRAME_BYTES, LENGTH_PREFIX
+from protocol import JSON_CODEC
+
+log = logging.getLogger(__name__)
+
+# Database calls are still blocking, so request handling runs on a small shared pool
+# instead of one thread per connection. Accept, reads and writes stay on the event loop.
+ASYNC_WORKER_THREADS = int(os.getenv('ASYNC_WORKER_THREADS', 32))
+
+
+class StreamConnection:
+    """Socket-like wrapper around an asyncio StreamWriter with a bounded outbound queue.
+
+    ChatManager and ChatServer call send/sendall from worker threads; frames are queued
+    without blocking and a per-connection writer task on the event loop drains them,
+    honouring transport backpressure. A client that falls too far behind is handled by
+    the OutboundQueue slow-consumer policy.
+    """
+
+    def __init__(self, loop, writer):
+        self.loop = loop
+        self.writer = writer
+        self.codec = JSON_CODEC # Switched when the client negotiates another protocol
+        self.queue = OutboundQueue()
+        self.ready = asyncio.Event()
+        self.closing = False
+        self.writer_task = loop.create_task(self._drain())
+
+    def send(self, frame):
+        if self.closing or self.writer.is_closing():
+            return False
+        if not self.queue.put(frame):
+            self.loop.call_soon_threadsafe(self._abort)
+            return False
+        self.loop.call_soon_threadsafe(self.ready.set)
+        return True
+
+    def sendall(self, data):
+        if not self.send(data):
+            raise ConnectionResetError("Connection is closed.")
+
+    async def _drain(self):
+        try:
+            while True:
+                await self.ready.wait()
+                self.ready.clear()
+                data = self.queue.take_all()
+                if data:
+                    self.writer.write(data)
+                    await self.writer.drain()
+                if (self.closing or self.queue.closed) and not len(self.queue):
+                    break
+        except (ConnectionError, OSError):
+            self.queue.close()
+        finally:
+            self.writer.close()
+
+    def _abort(self):
+        self.queue.close()
+        self.writer.transport.abort()
+        self.ready.set()
+
+    def _close(self):
+        self.closing = True
+        self.ready.set()
+
+    def shutdown(self, how=socket.SHUT_RDWR):
+        # The writer task flushes whatever is queued and then closes the transport
+        self.close()
+
+    def close(self):
+        self.closing = True
+        if not self.loop.is_closed(): # After the loop has stopped its transports are already gone
+            self.loop.call_soon_threadsafe(self._close)
+
+
+class AsyncChatServer(ChatServer):
+    """Single event loop front end: no thread is created per client connection."""
+
+    def __init__(self, host, port, backlog, reuse_port=False, bus=None):
+        super().__init__(host, port, backlog, reuse_port, bus)
+        self.loop = None
+        self.executor = ThreadPoolExecutor(max_workers=ASYNC_WORKER_THREADS, thread_name_prefix='chat-worker')
+
+    def start(self):
+        try:
+            asyncio.run(self.serve())
+        except KeyboardInterrupt:
+            pass
+        except Exception:
+            log.exception("Server error")
+        finally:
+            self.executor.shutdown(wait=False)
+            self.shutdown()
+
+    async def serve(self):
+        self.loop = asyncio.get_running_loop()
+        server = await asyncio.start_server(
+            self.handle_connection, self.host, self.port,
+            backlog=self.backlog, reuse_address=True, reuse_port=self.reuse_port or None, limit=MAX_FRAME_BYTES
+        )
+        log.info("Server listening on %s:%s (asyncio mode, backlog %s)", self.host, self.port, self.backlog)
+        stopping = asyncio.Event()
+        try:
+            # Stop the loop cleanly on SIGTERM so ChatServer.shutdown can flush buffered messages
+            self.loop.add_signal_handler(signal.SIGTERM, stopping.set)
+        except (NotImplementedError, RuntimeError):
+            pass # Not in the main thread or not supported on this platform
+        async with server:
+            await stopping.wait()
+            server.close()
+            for connection in list(self.clients):
+                connection.close() # Newer Pythons wait for open connections when the server exits
+
+    async def handle_connection(self, reader, writer):
+        client_address = writer.get_extra_info('peername')
+        connection = StreamConnection(self.loop, writer)
+        self.client_id_counter += 1
+        self.clients[connection] = {'thread': None, 'address': client_address, 'user_id': None, 'username': None}
+        session = self.new_session(client_address)
+        log.info("New connection from %s. Assigned temporary ID: %s", client_address, self.client_id_counter,
+                 extra={'event': 'connection_opened'})
+
+        self.send_response(connection, AUTH_PROMPT)
+        try:
+            while True:
+                if connection.codec.length_prefixed:
+                    data = await self.read_prefixed_frame(reader)
+                else:
+                    line = await reader.readline()
+                    if not line:
+                        break # Client disconnected
+                    data = line.decode('utf-8', errors='replace').strip()
+                if not data:
+                    continue
+                keep_open = await self.loop.run_in_executor(self.executor, self.handle_request, connection, session, data)
+                if not keep_open:
+                    break
+        except asyncio.CancelledError:
+            pass # Server is shutting down
+        except asyncio.IncompleteReadError as e:
+            if e.partial:
+                log.info("Client %s disconnected mid-frame.", client_address)
+        except ConnectionResetError:
+            log.info("Client %s disconnected abruptly.", client_address)
+        except ValueError as e: # A frame longer than MAX_FRAME_BYTES
+            log.info("Closing %s: %s", client_address, e)
+        except Exception:
+            log.exception("Unexpected error with client %s", client_address)
+        finally:
+            try:
+                await self.loop.run_in_executor(
+                    self.executor, self.cleanup_client, connection, session['user_id'], session['current_room_id']
+                )
+            except asyncio.CancelledError:
+                pass # The loop is stopping; ChatServer.shutdown closes whatever is left
+
+    async def read_prefixed_frame(self, reader):
+        header = await reader.readexactly(LENGTH_PREFIX.size)
+        (length,) = LENGTH_PREFIX.unpack(header)
+        if length > MAX_FRAME_BYTES:
+            raise ValueError(f"Frame exceeds {MAX_FRAME_BYTES} bytes.")
+        return await reader.readexactly(length)
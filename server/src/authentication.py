@@ -1,15 +1,29 @@
 # server/src/authentication.py
-import hashlib
 import json
+import secrets
+
+from cache import LRUCache
+from passwords import PasswordHasher, HasherBusy
+from session_tokens import SessionTokens, SESSION_SECRET
 
 class Authentication:
     def __init__(self, db):
         self.db = db
+        self.hasher = PasswordHasher() # Salted PBKDF2, computed on a bounded pool
+        # Signed tokens that let a reconnecting client skip the password check. Without SESSION_SECRET the first
+        # server to start stores a random key, which every process and restart then shares
+        secret = SESSION_SECRET or db.get_or_create_setting('session_secret', secrets.token_hex(32))
+        self.tokens = SessionTokens(secret)
+        self.generations = LRUCache(10000) # {user_id: session generation} for users with sessions on this server
 
     def register_user(self, username, password):
         if not username or not password:
             return {"status": "error", "message": "Username and password cannot be empty."}
-        if self.db.add_user(username, password):
+        try:
+            password_hash = self.hasher.hash(password)
+        except HasherBusy as e:
+            return {"status": "error", "message": str(e)}
+        if self.db.add_user(username, password_hash):
             return {"status": "success", "message": "Registration successful."}
         else:
             return {"status": "error", "message": "Username already exists."}
@@ -17,8 +31,48 @@ class Authentication:
     def login_user(self, username, password):
         if not username or not password:
             return {"status": "error", "message": "Username and password cannot be empty."}
-        user_id = self.db.verify_user(username, password)
-        if user_id:
-            return {"status": "success", "message": "Login successful.", "user_id": user_id, "username": username}
+        credentials = self.db.get_user_credentials(username)
+        # An unknown username still runs a full verify on the same pool, so response time does not reveal which names exist
+        user_id, stored_hash = credentials or (None, self.hasher.dummy_hash)
+        try:
+            matches, needs_rehash = self.hasher.verify(password, stored_hash)
+        except HasherBusy as e:
+            return {"status": "error", "message": str(e)}
+        if matches and user_id is not None:
+            if needs_rehash:
+                # Legacy sha256 row or an outdated work factor: upgrade it now that we know the password
+                try:
+                    self.db.update_password_hash(user_id, self.hasher.hash(password))
+                except HasherBusy:
+                    pass # Upgraded on a later login
+            return {"status": "success", "message": "Login successful.", "user_id": user_id, "username": username,
+                    "token": self.issue_token(user_id, username)}
+        return {"status": "error", "message": "Invalid username or password."}
+
+    def issue_token(self, user_id, username, room_id=None):
+        generation = self.generations.get(user_id)
+        if generation is None:
+            generation = self.db.get_session_generation(user_id) or 0
+            self.generations.put(user_id, generation)
+        return self.tokens.issue(user_id, username, room_id, generation)
+
+    def resume_session(self, token):
+        claims = self.tokens.verify(token)
+        # Checked against the database rather than the cache, so a logout on any server revokes the token
+        generation = self.db.get_session_generation(claims['uid']) if claims else None
+        if generation is None or claims.get('gen', 0) != generation:
+            return {"status": "error", "message": "Session expired or invalid. Please log in."}
+        self.generations.put(claims['uid'], generation)
+        return {"status": "success", "message": "Session resumed.", "user_id": claims['uid'],
+                "username": claims['name'], "room_id": claims.get('room')}
+
+    def revoke_sessions(self, user_id):
+        """Invalidates every session token issued to the user so far."""
+        generation = self.db.revoke_sessions(user_id)
+        if generation is None:
+            self.generations.discard(user_id)
         else:
-            return {"status": "error", "message": "Invalid username or password."}
+            self.generations.put(user_id, generation)
+
+    def close(self):
+        self.hasher.close()
@@ -0,0 +1,356 @@
+# server/src/bus.py
+import collections
+import itertools
+import json
+import logging
+import os
+import select
+import socket
+import threading
+import time
+import uuid
+
+from framing import FrameReader, FrameTooLarge
+from storage import StorageError
+
+log = logging.getLogger(__name__)
+
+ROOM_BUS = os.getenv('ROOM_BUS', 'local') # 'local' (this host's processes only) or 'postgres' (every node on the database)
+BUS_SOCKET_PATH = os.getenv('BUS_SOCKET_PATH', '/tmp/chat_bus.sock') # Unix socket of the supervisor's room event hub
+BUS_FLUSH_INTERVAL = float(os.getenv('BUS_FLUSH_INTERVAL', 0.005)) # Seconds events are held to share one NOTIFY round trip
+BUS_MAX_BATCH = int(os.getenv('BUS_MAX_BATCH', 200)) # Pending events that trigger an immediate flush
+NOTIFY_CHANNEL_PREFIX = 'chat_room_'
+NOTIFY_PAYLOAD_LIMIT = 7900 # Postgres rejects NOTIFY payloads of 8000 bytes or more
+LISTENER_RECONNECT_DELAY = 1.0 # Seconds between attempts to re-open a lost LISTEN connection
+BUS_MAX_FRAME_BYTES = 16 * 1024 * 1024 # Longest line on the local bus socket; far above any single event
+
+
+class RoomBus:
+    """Carries room events between server processes.
+
+    ChatManager subscribes to a room while it has local members, publishes every event it
+    broadcasts locally, and receives other processes' events for its subscribed rooms through
+    the on_event(room_id, event) callback. The base class is the single-process bus: it
+    connects nothing and delivers nothing.
+    """
+
+    distributed = False # True when other processes may hold members of the same rooms
+
+    def __init__(self):
+        self.on_event = None
+
+    def start(self, on_event):
+        self.on_event = on_event
+
+    def subscribe(self, room_id):
+        pass
+
+    def unsubscribe(self, room_id):
+        pass
+
+    def publish(self, room_id, event):
+        pass
+
+    def close(self):
+        pass
+
+
+class UnixSocketBus(RoomBus):
+    """Worker side of the supervisor's BusHub, spoken as newline-delimited JSON over a Unix socket."""
+
+    distributed = True
+
+    def __init__(self, path=BUS_SOCKET_PATH):
+        super().__init__()
+        self.path = path
+        self.socket = None
+        self.send_lock = threading.Lock()
+        self.reader_thread = None
+
+    def start(self, on_event):
+        super().start(on_event)
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.socket.connect(self.path)
+        self.reader_thread = threading.Thread(target=self._read_events, name='room-bus', daemon=True)
+        self.reader_thread.start()
+        log.info("Connected to room bus at %s.", self.path)
+
+    def _send(self, message):
+        data = (json.dumps(message) + '\n').encode('utf-8')
+        try:
+            with self.send_lock:
+                self.socket.sendall(data)
+        except OSError as e:
+            log.error("Room bus send failed: %s", e)
+
+    def subscribe(self, room_id):
+        self._send({"op": "sub", "room": room_id})
+
+    def unsubscribe(self, room_id):
+        self._send({"op": "unsub", "room": room_id})
+
+    def publish(self, room_id, event):
+        self._send({"op": "pub", "room": room_id, "event": event})
+
+    def _read_events(self):
+        reader = FrameReader(self.socket, max_frame_size=BUS_MAX_FRAME_BYTES)
+        while True:
+            try:
+                line = reader.read_frame()
+            except (OSError, FrameTooLarge):
+                line = None
+            if line is None:
+                log.error("Room bus connection lost; cross-process delivery stopped.")
+                return
+            try:
+                message = json.loads(line)
+                self.on_event(message['room'], message['event'])
+            except Exception as e:
+                log.error("Error handling room bus event: %s", e)
+
+    def close(self):
+        if self.socket:
+            try:
+                self.socket.close()
+            except OSError:
+                pass
+
+
+class BusHub:
+    """Supervisor side of the room bus: routes each published event to the other workers subscribed to its room.
+
+    Rooms are sharded by interest: a worker only receives events for rooms in which it
+    currently holds members, so no worker sees traffic for every room.
+    """
+
+    def __init__(self, path=BUS_SOCKET_PATH):
+        self.path = path
+        self.server_socket = None
+        self.subscriptions = {} # {room_id: set of worker sockets}
+        self.send_locks = {} # {worker socket: threading.Lock()}
+        self.lock = threading.Lock()
+
+    def start(self):
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self.server_socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.server_socket.bind(self.path)
+        self.server_socket.listen(64)
+        threading.Thread(target=self._accept, name='bus-hub', daemon=True).start()
+        log.info("Room bus listening on %s.", self.path)
+
+    def _accept(self):
+        while True:
+            try:
+                worker_socket, _ = self.server_socket.accept()
+            except OSError:
+                return # Hub closed
+            with self.lock:
+                self.send_locks[worker_socket] = threading.Lock()
+            threading.Thread(target=self._serve_worker, args=(worker_socket,), daemon=True).start()
+
+    def _serve_worker(self, worker_socket):
+        reader = FrameReader(worker_socket, max_frame_size=BUS_MAX_FRAME_BYTES)
+        try:
+            while True:
+                line = reader.read_frame()
+                if line is None:
+                    break
+                self._route(worker_socket, line)
+        except FrameTooLarge as e:
+            log.error("Dropping room bus worker connection: %s", e)
+        except OSError:
+            pass
+        finally:
+            with self.lock:
+                for subscribers in self.subscriptions.values():
+                    subscribers.discard(worker_socket)
+                self.send_locks.pop(worker_socket, None)
+            worker_socket.close()
+
+    def _route(self, worker_socket, line):
+        try:
+            message = json.loads(line)
+            op, room_id = message['op'], message['room']
+        except (ValueError, KeyError):
+            return
+        with self.lock:
+            if op == 'sub':
+                self.subscriptions.setdefault(room_id, set()).add(worker_socket)
+                return
+            if op == 'unsub':
+                self.subscriptions.get(room_id, set()).discard(worker_socket)
+                return
+            targets = [(s, self.send_locks[s]) for s in self.subscriptions.get(room_id, ()) if s is not worker_socket]
+        frame = line + b'\n' # Forwarded as-is; workers treat a 'pub' line as an incoming event
+        for target, send_lock in targets:
+            try:
+                with send_lock:
+                    target.sendall(frame)
+            except OSError:
+                pass # The worker's reader thread cleans up its subscriptions
+
+    def close(self):
+        if self.server_socket:
+            self.server_socket.close()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+
+class PostgresNotifyBus(RoomBus):
+    """Cluster bus over PostgreSQL LISTEN/NOTIFY, so server nodes that share the database share rooms.
+
+    Each room is its own channel and a node LISTENs only while it has members in the room.
+    Published events are held for BUS_FLUSH_INTERVAL and coalesced per room: one NOTIFY carries
+    every event a room produced in that window, and all rooms go out in one statement. Payloads
+    over the NOTIFY size limit are split into parts and reassembled by the receivers. Every
+    payload is tagged with this node's id so a node skips its own events, which it has already
+    delivered locally.
+    """
+
+    distributed = True
+
+    def __init__(self, db, flush_interval=BUS_FLUSH_INTERVAL, max_batch=BUS_MAX_BATCH):
+        super().__init__()
+        if not db.supports_notify:
+            raise StorageError(f"ROOM_BUS=postgres needs DB_BACKEND=postgres, not {db.backend}.")
+        self.db = db
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self.node_id = uuid.uuid4().hex[:12]
+        self.sequence = itertools.count()
+        self.pending = collections.OrderedDict() # {room_id: [event, ...]} waiting for the next flush
+        self.pending_count = 0
+        self.condition = threading.Condition()
+        self.channel_changes = collections.deque() # ('LISTEN' or 'UNLISTEN', room_id), applied by the listener thread
+        self.channels = set() # Rooms the listener connection is subscribed to
+        self.partial = {} # {(node_id, sequence): [part, ...]} for payloads split across notifications
+        self.running = True
+        self.wake_read, self.wake_write = os.pipe() # Interrupts the listener's select() when channels change
+        self.listener = None
+
+    def start(self, on_event):
+        super().start(on_event)
+        self.listener = self.db.open_listener()
+        threading.Thread(target=self._listen, name='room-bus-listen', daemon=True).start()
+        self.flush_thread = threading.Thread(target=self._flush_loop, name='room-bus-notify', daemon=True)
+        self.flush_thread.start()
+        log.info("Room bus using PostgreSQL LISTEN/NOTIFY (node %s).", self.node_id)
+
+    def _change_channel(self, action, room_id):
+        self.channel_changes.append((action, room_id))
+        os.write(self.wake_write, b'x')
+
+    def subscribe(self, room_id):
+        self._change_channel('LISTEN', room_id)
+
+    def unsubscribe(self, room_id):
+        self._change_channel('UNLISTEN', room_id)
+
+    def publish(self, room_id, event):
+        with self.condition:
+            self.pending.setdefault(room_id, []).append(event)
+            self.pending_count += 1
+            if self.pending_count == 1 or self.pending_count >= self.max_batch:
+                self.condition.notify() # Opens the batching window, or closes it early when full
+
+    def _flush_loop(self):
+        while True:
+            with self.condition:
+                while self.running and not self.pending:
+                    self.condition.wait()
+                if not self.pending:
+                    return # Stopped with nothing left to send
+                if self.running and self.pending_count < self.max_batch:
+                    self.condition.wait(self.flush_interval) # Let the batch fill up
+                batch, self.pending, self.pending_count = self.pending, collections.OrderedDict(), 0
+            notifications = []
+            for room_id, events in batch.items():
+                notifications.extend(self._encode(room_id, events))
+            self.db.notify_batch(notifications) # Best effort: messages are persisted independently of the bus
+
+    def _encode(self, room_id, events):
+        # ensure_ascii keeps one character per byte, so the payload can be cut anywhere
+        data = json.dumps(events)
+        sequence = next(self.sequence)
+        chunk = NOTIFY_PAYLOAD_LIMIT - 64 # Room for the header
+        pieces = [data[i:i + chunk] for i in range(0, len(data), chunk)]
+        channel = f"{NOTIFY_CHANNEL_PREFIX}{room_id}"
+        return [(channel, f"{self.node_id} {sequence} {index}/{len(pieces)} {piece}")
+                for index, piece in enumerate(pieces)]
+
+    def _listen(self):
+        while self.running:
+            try:
+                self._apply_channel_changes()
+                readable, _, _ = select.select([self.listener, self.wake_read], [], [])
+                if self.wake_read in readable:
+                    os.read(self.wake_read, 4096)
+                if self.listener in readable:
+                    self.listener.poll()
+                    while self.listener.notifies:
+                        notify = self.listener.notifies.pop(0)
+                        try:
+                            self._receive(notify.channel, notify.payload)
+                        except Exception as e:
+                            log.warning("Ignoring malformed room bus notification on %s: %s", notify.channel, e)
+            except Exception as e:
+                if not self.running:
+                    return
+                log.error("Room bus listener error: %s; reconnecting.", e)
+                self._reconnect()
+
+    def _apply_channel_changes(self):
+        with self.listener.cursor() as cursor:
+            while self.channel_changes:
+                action, room_id = self.channel_changes.popleft()
+                cursor.execute(f"{action} {NOTIFY_CHANNEL_PREFIX}{int(room_id)};")
+                if action == 'LISTEN':
+                    self.channels.add(room_id)
+                else:
+                    self.channels.discard(room_id)
+
+    def _reconnect(self):
+        while self.running:
+            time.sleep(LISTENER_RECONNECT_DELAY)
+            try:
+                try:
+                    self.listener.close()
+                except Exception:
+                    pass
+                self.listener = self.db.open_listener()
+                # Queue the current subscriptions again for the new connection
+                self.channel_changes.extendleft(('LISTEN', room_id) for room_id in self.channels)
+                return
+            except Exception as e:
+                log.error("Room bus reconnect failed: %s", e)
+
+    def _receive(self, channel, payload):
+        node_id, sequence, part, data = payload.split(' ', 3)
+        if node_id == self.node_id:
+            return # Already delivered locally when it was published
+        index, total = (int(n) for n in part.split('/'))
+        if total > 1:
+            parts = self.partial.setdefault((node_id, sequence), [None] * total)
+            parts[index] = data
+            if None in parts:
+                return
+            del self.partial[(node_id, sequence)]
+            data = ''.join(parts)
+        room_id = int(channel[len(NOTIFY_CHANNEL_PREFIX):])
+        for event in json.loads(data):
+            self.on_event(room_id, event)
+
+    def close(self):
+        # Send whatever is still batched, then stop listening
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+        if self.on_event is not None:
+            self.flush_thread.join()
+        os.write(self.wake_write, b'x')
+        if self.listener is not None:
+            try:
+                self.listener.close()
+            except Exception:
+                pass
@@ -1,43 +1,111 @@
 # server/src/chat_manager.py
 import threading
+import itertools
 import json
 import time
+import datetime
+import os
+import logging
+import uuid
+
+from leaderboard import Leaderboard
+from persistence import MessageWriter, MessageIdAllocator
+from outbound import fan_out
+from room_history import RoomHistory
+from bus import RoomBus
+from metrics import METRICS, SIZE_BUCKETS
+
+log = logging.getLogger(__name__)
+
+HISTORY_MAX_PAGE_SIZE = 100 # Largest page a client may request from the history command
+RESUME_MAX_MESSAGES = 500 # Missed messages replayed on resume; beyond this the client gets recent history instead
+ROOM_COUNTER_RECONCILE_INTERVAL = float(os.getenv('ROOM_COUNTER_RECONCILE_INTERVAL', 60)) # Seconds between counter reconciliations
+SEARCH_MAX_PAGE_SIZE = 50 # Largest page of search results a client may request
+SEARCH_MAX_QUERY_LENGTH = 200 # Characters; longer queries are refused rather than parsed
+ONLINE_LIST_LIMIT = 100 # Usernames returned by the online command; the count is always exact
+ROOM_MEMBER_LIST_LIMIT = 100 # Usernames listed with a room's stats; total_users is always exact
+DIRECT_MESSAGE_CHANNEL = 0 # Bus key for direct messages between server processes; room ids start at 1
+PRESENCE_HEARTBEAT_INTERVAL = 10 # Seconds between presence heartbeats; well inside storage.PRESENCE_TTL
+
+BROADCAST_SECONDS = METRICS.histogram('chat_broadcast_seconds', 'Time to fan one room event out to its local members')
+BROADCAST_RECIPIENTS = METRICS.histogram('chat_broadcast_recipients', 'Local members one room event is fanned out to', buckets=SIZE_BUCKETS)
+MESSAGES_TOTAL = METRICS.counter('chat_messages_total', 'Chat messages accepted from clients of this server')
+DIRECT_MESSAGES_TOTAL = METRICS.counter('chat_direct_messages_total', 'Direct messages sent by clients of this server', ['delivery'])
 
 class ChatManager:
-    def __init__(self, db):
+    def __init__(self, db, bus=None):
         self.db = db
-        self.rooms = {}  # {room_id: {'name': 'room_name', 'clients': {user_id: socket_object}, 'messages_count': 0}}
+        self.rooms = {}  # {room_id: {'name': 'room_name', 'clients': {user_id: connection}, 'messages_count': 0}}
         self.room_locks = {} # {room_id: threading.Lock()}
+        self.rooms_lock = threading.Lock() # Guards adding rooms that were created by another process
         self.active_users = {} # {user_id: {'username': username, 'current_room_id': room_id}}
+        self.connections = {} # {user_id: connection} for every user logged in on this server
+        self.online_user_ids = {} # {username: user_id}, the same users by name
+        self.node_id = uuid.uuid4().hex[:12] # Identifies this process in the shared presence table
+        self.message_ids = MessageIdAllocator(db) # Ids are assigned before the message is persisted
+        self.message_writer = MessageWriter(db) # Batches message inserts off the send path
+        self.bus = bus or RoomBus() # Carries room events to and from other server processes
+        self.leaderboard = Leaderboard(db, shared=self.bus.distributed) # Ranked in memory, checkpointed periodically
         self.load_rooms_from_db()
+        self.bus.start(self.deliver_remote)
+        # With rooms spanning processes, online and dm need to know who is connected anywhere, so
+        # presence is kept in the database as well as in the local index
+        self.shared_presence = self.bus.distributed
+        if self.shared_presence:
+            self.bus.subscribe(DIRECT_MESSAGE_CHANNEL) # Direct messages for users who may be connected here
+            self.db.heartbeat_node(self.node_id)
+        self.stopped = threading.Event()
+        self.reconcile_thread = threading.Thread(target=self._reconcile_room_counts_loop, name='room-counters', daemon=True)
+        self.reconcile_thread.start()
+        if self.shared_presence:
+            threading.Thread(target=self._presence_heartbeat_loop, name='presence', daemon=True).start()
+        self._register_metrics()
+
+    def _register_metrics(self):
+        METRICS.callback('gauge', 'chat_rooms_loaded', 'Rooms held in memory', lambda: len(self.rooms))
+        METRICS.callback('gauge', 'chat_rooms_active', 'Rooms with at least one member on this server',
+                         lambda: sum(1 for room in list(self.rooms.values()) if room['clients']))
+        METRICS.callback('gauge', 'chat_room_members', 'Room memberships on this server',
+                         lambda: sum(len(room['clients']) for room in list(self.rooms.values())))
+        METRICS.callback('gauge', 'chat_persist_queue_depth', 'Messages waiting to be written to the database',
+                         lambda: len(self.message_writer.pending))
+        METRICS.callback('counter', 'chat_persist_messages_total', 'Messages written by the write-behind writer',
+                         lambda: self.message_writer.stats['persisted'])
+        METRICS.callback('counter', 'chat_persist_failed_flushes_total', 'Message batches that failed to write and were retried',
+                         lambda: self.message_writer.stats['failed_flushes'])
+        METRICS.callback('counter', 'chat_persist_dead_lettered_total', 'Messages that could not be written and went to the dead-letter file',
+                         lambda: self.message_writer.stats['dead_lettered'])
+        METRICS.callback('gauge', 'chat_bus_pending_events', 'Room events waiting to be published to other servers',
+                         lambda: getattr(self.bus, 'pending_count', 0))
 
     def load_rooms_from_db(self):
         """Loads existing public rooms from the database on startup."""
         db_rooms = self.db.get_all_rooms()
+        message_counts = self.db.get_room_message_counts() # One query instead of a COUNT(*) per room
         for room_data in db_rooms:
-            room_id = room_data['id']
-            room_name = room_data['name']
-            if room_id not in self.rooms:
-                self.rooms[room_id] = {
-                    'name': room_name,
-                    'clients': {},  # user_id: client_socket
-                    'messages_count': self.db.get_room_stats(room_id).get('total_messages', 0),
-                    'is_private': room_data['is_private']
-                }
-                self.room_locks[room_id] = threading.Lock()
-                print(f"Loaded room: {room_name} (ID: {room_id}, Private: {room_data['is_private']})")
+            if self._add_room(room_data['id'], room_data['name'], room_data['is_private'], message_counts.get(room_data['id'], 0)):
+                log.info("Loaded room: %s (ID: %s, Private: %s)", room_data['name'], room_data['id'], room_data['is_private'])
 
-    def create_room(self, room_name, is_private, created_by_user_id):
-        room_id = self.db.create_room(room_name, is_private, created_by_user_id)
-        if room_id:
+    def _add_room(self, room_id, room_name, is_private, messages_count=0):
+        """Registers a room in memory unless it is already known. Returns True if it was added."""
+        with self.rooms_lock:
+            if room_id in self.rooms:
+                return False
+            self.room_locks[room_id] = threading.Lock()
             self.rooms[room_id] = {
                 'name': room_name,
-                'clients': {},
-                'messages_count': 0,
-                'is_private': is_private
+                'clients': {},  # user_id: connection (ClientConnection or StreamConnection)
+                'messages_count': messages_count,
+                'is_private': is_private,
+                'history': RoomHistory() # Warmed from the database on first use
             }
-            self.room_locks[room_id] = threading.Lock()
-            print(f"Created new room: {room_name} (ID: {room_id}, Private: {is_private})")
+            return True
+
+    def create_room(self, room_name, is_private, created_by_user_id):
+        room_id = self.db.create_room(room_name, is_private, created_by_user_id)
+        if room_id:
+            self._add_room(room_id, room_name, is_private)
+            log.info("Created new room: %s (ID: %s, Private: %s)", room_name, room_id, is_private)
             return room_id
         return None
 
@@ -47,47 +115,94 @@ class ChatManager:
             return {"status": "error", "message": f"Room '{room_name}' does not exist."}
 
         room_id = room_details['id']
+        self._enter_room(user_id, username, client_socket, room_details)
+
+        # Recent history comes from the room's ring buffer; only a cold room touches the database
+        history = self.get_room_history(room_id).snapshot()
+        return self._room_response(room_id, f"Joined room '{room_name}'.", history)
+
+    def resume_room(self, user_id, username, client_socket, room_id, last_seen_id=None):
+        """Rejoins a room from a session token, replaying only the messages after last_seen_id."""
+        if room_id in self.rooms:
+            room_details = {'id': room_id, 'name': self.rooms[room_id]['name']}
+        else:
+            room_name = self.db.get_room_name(room_id) # Loaded by another server process
+            room_details = room_name and self.db.get_room_details(room_name)
+            if not room_details:
+                return {"status": "error", "message": "Room no longer exists."}
+        room_name = room_details['name']
+        self._enter_room(user_id, username, client_socket, room_details)
+
+        missed, truncated = None, False
+        if last_seen_id is not None:
+            missed, truncated = self.get_messages_since(room_id, last_seen_id)
+        response = self._room_response(room_id, f"Rejoined room '{room_name}'.",
+                                       missed if missed is not None else self.get_room_history(room_id).snapshot())
+        response["resumed"] = missed is not None
+        response["truncated"] = truncated
+        return response
+
+    def _enter_room(self, user_id, username, client_socket, room_details):
+        room_id = room_details['id']
+        room_name = room_details['name']
+        if room_id not in self.rooms:
+            # Created by another server process since this one started
+            self._add_room(room_id, room_name, room_details['is_private'],
+                           self.db.get_room_stats(room_id)['total_messages'])
 
         # Leave previous room if any
         if user_id in self.active_users and self.active_users[user_id].get('current_room_id'):
             self.leave_room(user_id, self.active_users[user_id]['current_room_id'])
 
-        with self.room_locks.get(room_id, threading.Lock()): # Use existing lock or create a dummy one if somehow missing
+        with self.room_locks[room_id]:
+            first_member = not self.rooms[room_id]['clients']
             self.rooms[room_id]['clients'][user_id] = client_socket
             self.active_users[user_id] = {'username': username, 'current_room_id': room_id}
-            self.db.update_user_active_time(user_id) # Mark user as active
+        if first_member:
+            self._subscribe_room(room_id)
+        if self.shared_presence:
+            self.db.set_presence_room(user_id, self.node_id, room_id)
+        self.leaderboard.touch(user_id, username) # Mark user as active; persisted at the next checkpoint
 
-        print(f"User {username} (ID: {user_id}) joined room: {room_name} (ID: {room_id})")
+        log.info("User %s (ID: %s) joined room: %s (ID: %s)", username, user_id, room_name, room_id,
+                 extra={'event': 'room_joined', 'user_id': user_id, 'room_id': room_id})
         
         # Notify others in the room
         join_message = f"{username} has joined the room."
         self.broadcast_message(room_id, "SERVER", join_message, exclude_user_id=user_id)
 
-        # Get history
-        history = self.db.get_message_history(room_id)
-        room_stats = self.get_room_stats(room_id)
-        active_users_in_room = [self.active_users[uid]['username'] for uid in self.rooms[room_id]['clients']]
-        
+    def _room_response(self, room_id, message, history):
+        total_users, active_users_in_room = self._room_members(room_id)
+        room_stats = {"total_users": total_users, "total_messages": self.rooms[room_id]['messages_count']}
         return {
             "status": "success",
-            "message": f"Joined room '{room_name}'.",
+            "message": message,
             "room_id": room_id,
-            "room_name": room_name,
+            "room_name": self.rooms[room_id]['name'],
             "history": history,
             "room_stats": room_stats,
             "active_users_in_room": active_users_in_room
         }
 
-    def leave_room(self, user_id, room_id):
+    def leave_room(self, user_id, room_id, client_socket=None):
+        """Removes the user from the room; given client_socket, only if that connection still holds the membership."""
         if room_id in self.rooms and user_id in self.rooms[room_id]['clients']:
+            if client_socket is not None and self.rooms[room_id]['clients'].get(user_id) is not client_socket:
+                return False # A newer login or resume took over the membership
             with self.room_locks[room_id]:
                 del self.rooms[room_id]['clients'][user_id]
+                last_member = not self.rooms[room_id]['clients']
                 if user_id in self.active_users:
                     self.active_users[user_id]['current_room_id'] = None # Mark as no longer in a room
+            if last_member:
+                self.bus.unsubscribe(room_id) # Other processes stop routing this room's events here
+            if self.shared_presence:
+                self.db.set_presence_room(user_id, self.node_id, None)
 
-            username = self.db.get_username_by_id(user_id)
-            room_name = self.db.get_room_name(room_id)
-            print(f"User {username} (ID: {user_id}) left room: {room_name} (ID: {room_id})")
+            username = self.get_username(user_id)
+            room_name = self.rooms[room_id]['name']
+            log.info("User %s (ID: %s) left room: %s (ID: %s)", username, user_id, room_name, room_id,
+                     extra={'event': 'room_left', 'user_id': user_id, 'room_id': room_id})
             
             # Notify others in the room
             leave_message = f"{username} has left the room."
@@ -95,13 +210,37 @@ class ChatManager:
             return True
         return False
 
-    def disconnect_user(self, user_id):
+    def get_username(self, user_id):
+        # Logged-in users are resolved from the session; anyone else goes through the database's identity cache
+        session = self.active_users.get(user_id)
+        if session:
+            return session['username']
+        return self.db.get_username_by_id(user_id)
+
+    def user_logged_in(self, user_id, username, client_socket):
+        self.active_users[user_id] = {'username': username, 'current_room_id': None}
+        self.connections[user_id] = client_socket # A newer login or resume replaces an older connection
+        self.online_user_ids[username] = user_id
+        if self.shared_presence:
+            self.db.set_presence(user_id, self.node_id)
+        self.leaderboard.session_started(user_id, username) # Starts the active-time clock
+
+    def disconnect_user(self, user_id, client_socket=None):
+        if client_socket is not None and self.connections.get(user_id) is not client_socket:
+            return # Replaced by a newer login or resume, which now owns the user's state
+        self.connections.pop(user_id, None)
+        if self.shared_presence:
+            self.db.clear_presence(user_id, self.node_id) # A no-op if another process has the user now
+        username = self.active_users.get(user_id, {}).get('username')
+        if username is not None and self.online_user_ids.get(username) == user_id:
+            del self.online_user_ids[username]
         if user_id in self.active_users:
             room_id = self.active_users[user_id].get('current_room_id')
             if room_id:
                 self.leave_room(user_id, room_id)
             del self.active_users[user_id]
-            print(f"User ID {user_id} disconnected.")
+            self.leaderboard.session_ended(user_id)
+            log.info("User ID %s disconnected.", user_id, extra={'event': 'user_disconnected', 'user_id': user_id})
 
     def send_message(self, user_id, room_id, message_content):
         if room_id not in self.rooms:
@@ -109,23 +248,152 @@ class ChatManager:
         if user_id not in self.rooms[room_id]['clients']:
             return {"status": "error", "message": "You are not in this room."}
 
-        username = self.db.get_username_by_id(user_id)
+        username = self.get_username(user_id)
         if not username:
             return {"status": "error", "message": "Invalid user."}
 
-        # Save to database
-        self.db.save_message(room_id, user_id, message_content)
+        message_id = self.message_ids.next_id()
+        timestamp = datetime.datetime.now()
+        history = self.get_room_history(room_id) # Warm before appending so the buffer stays in order
+
+        # Queue for batched persistence; the write happens off the request path
+        self.message_writer.submit(message_id, room_id, user_id, message_content, timestamp)
+        history.append({"id": message_id, "username": username, "content": message_content, "timestamp": timestamp.isoformat()})
+        self.leaderboard.record_message(user_id, username, timestamp)
+        MESSAGES_TOTAL.inc()
         
         # Update in-memory message count for stats
         with self.room_locks[room_id]:
             self.rooms[room_id]['messages_count'] += 1
 
         # Broadcast to clients in the room
-        self.broadcast_message(room_id, username, message_content)
+        self.broadcast_message(room_id, username, message_content, timestamp=timestamp, message_id=message_id, sender_user_id=user_id)
         
         return {"status": "success", "message": "Message sent."}
 
-    def broadcast_message(self, room_id, sender_username, message_content, exclude_user_id=None):
+    def send_direct_message(self, user_id, recipient_username, message_content):
+        """Delivers a message to one user by name; direct messages are not persisted."""
+        username = self.get_username(user_id)
+        if not username:
+            return {"status": "error", "message": "Invalid user."}
+        if recipient_username == username:
+            return {"status": "error", "message": "You cannot send a direct message to yourself."}
+        message_data = {
+            "type": "direct_message",
+            "sender": username,
+            "recipient": recipient_username,
+            "content": message_content,
+            "timestamp": datetime.datetime.now().isoformat()
+        }
+        if self._deliver_direct(recipient_username, message_data):
+            DIRECT_MESSAGES_TOTAL.labels('local').inc()
+            return {"status": "success", "message": f"Direct message sent to {recipient_username}."}
+        online = self.db.is_user_online(recipient_username) if self.shared_presence else False
+        if online is None:
+            return {"status": "error", "message": f"Could not check whether {recipient_username} is online."}
+        if not online:
+            return {"status": "error", "message": f"User {recipient_username} is not online."}
+        # Connected to another server process; each one checks its own index
+        self.bus.publish(DIRECT_MESSAGE_CHANNEL, {"recipient": recipient_username, "message": message_data})
+        DIRECT_MESSAGES_TOTAL.labels('remote').inc()
+        return {"status": "success", "message": f"Direct message sent to {recipient_username}."}
+
+    def _deliver_direct(self, recipient_username, message_data):
+        # Two dict lookups, however many users and rooms there are
+        recipient_id = self.online_user_ids.get(recipient_username)
+        connection = self.connections.get(recipient_id)
+        if connection is None:
+            return False
+        return not fan_out([(recipient_id, connection)], message_data)
+
+    def search_messages(self, query, room_id=None, page_size=20, offset=0):
+        """Full-text search of one room, or of every public room when room_id is None, best match first."""
+        query = (query or '').strip()
+        if not query:
+            return {"status": "error", "message": "Search query cannot be empty."}
+        if len(query) > SEARCH_MAX_QUERY_LENGTH:
+            return {"status": "error", "message": f"Search query is longer than {SEARCH_MAX_QUERY_LENGTH} characters."}
+        try:
+            page_size = max(1, min(int(page_size), SEARCH_MAX_PAGE_SIZE))
+            offset = max(0, int(offset))
+        except (TypeError, ValueError):
+            return {"status": "error", "message": "Invalid search page."}
+
+        # Fetch one extra row to learn whether another page exists
+        rows = self.db.search_messages(query, room_id, page_size + 1, offset)
+        if rows is None:
+            return {"status": "error", "message": "Could not search messages."}
+        next_offset = offset + page_size if len(rows) > page_size else None
+        rows = rows[:page_size]
+        return {
+            "status": "success",
+            "message": f"{len(rows)} results for '{query}'." if rows or offset else f"No messages match '{query}'.",
+            "query": query,
+            "room_id": room_id,
+            "results": rows,
+            "next_offset": next_offset
+        }
+
+    def get_online_users(self, username=None, limit=ONLINE_LIST_LIMIT):
+        """Whether one user is online, or up to limit of the users logged in on any server process."""
+        if username:
+            online = username in self.online_user_ids or (self.shared_presence and self.db.is_user_online(username))
+            if online is None:
+                return {"status": "error", "message": "Could not check who is online."}
+            return {"status": "success", "username": username, "online": online,
+                    "message": f"{username} is {'online' if online else 'offline'}."}
+        if self.shared_presence:
+            result = self.db.list_online_users(limit)
+            if result is None:
+                return {"status": "error", "message": "Could not check who is online."}
+            count, usernames = result
+        else:
+            count, usernames = len(self.online_user_ids), sorted(itertools.islice(self.online_user_ids, limit))
+        return {"status": "success", "online_count": count, "online_users": usernames, "message": f"{count} users online."}
+
+    def get_room_history(self, room_id):
+        history = self.rooms[room_id]['history']
+        history.ensure_warm(lambda limit: self._recent_messages(room_id, limit))
+        return history
+
+    def _recent_messages(self, room_id, limit):
+        """The room's newest limit messages, oldest first: persisted ones and those still in the write-behind queue."""
+        # Read the queue first: a batch flushed in between then shows up twice, not not at all
+        pending = self.message_writer.pending_for_room(room_id)
+        messages = self.db.get_message_history(room_id, limit)
+        persisted_ids = {message['id'] for message in messages}
+        for message_id, _, user_id, content, timestamp in pending:
+            if message_id not in persisted_ids:
+                messages.append({"id": message_id, "username": self.get_username(user_id), "content": content,
+                                 "timestamp": timestamp.isoformat()})
+        if pending:
+            messages.sort(key=lambda message: (datetime.datetime.fromisoformat(message['timestamp']), message['id']))
+        return messages[-limit:]
+
+    def get_messages_since(self, room_id, last_seen_id):
+        """Returns (messages after last_seen_id, truncated), oldest first.
+
+        A recent last_seen_id is answered from the ring buffer. An older one is read from the
+        database, topped up with buffered messages that are not persisted yet. If the database
+        does not know last_seen_id or more than RESUME_MAX_MESSAGES were missed, the recent
+        history is returned with truncated=True and older messages are left to the history command.
+        """
+        history = self.get_room_history(room_id)
+        try:
+            last_seen_id = int(last_seen_id)
+        except (TypeError, ValueError):
+            return None, False
+        missed = history.since(last_seen_id)
+        if missed is not None:
+            return missed, False
+        rows = self.db.get_messages_after(room_id, last_seen_id, RESUME_MAX_MESSAGES + 1)
+        buffered = history.since(None)
+        if rows is None or len(rows) > RESUME_MAX_MESSAGES:
+            return buffered, True
+        persisted_ids = {row['id'] for row in rows}
+        return rows + [m for m in buffered if m['id'] not in persisted_ids], False
+
+    def broadcast_message(self, room_id, sender_username, message_content, exclude_user_id=None, timestamp=None, message_id=None, sender_user_id=None):
         if room_id not in self.rooms:
             return
 
@@ -133,23 +401,59 @@ class ChatManager:
             "type": "chat_message",
             "sender": sender_username,
             "content": message_content,
-            "timestamp": datetime.datetime.now().isoformat()
+            "timestamp": (timestamp or datetime.datetime.now()).isoformat()
         }
-        message_json = json.dumps(message_data) + '\n' # Add newline delimiter
+        if message_id is not None:
+            message_data["id"] = message_id # Server-assigned; system notices have none
+
+        self._deliver_local(room_id, message_data, exclude_user_id)
+        # Members connected to other server processes get the same event through the bus
+        self.bus.publish(room_id, {"message": message_data, "user_id": sender_user_id})
 
+    def _deliver_local(self, room_id, message_data, exclude_user_id=None):
+        # Only snapshot the membership under the lock; enqueueing never blocks on a slow reader
         with self.room_locks[room_id]:
-            clients_to_remove = []
-            for client_user_id, client_socket in list(self.rooms[room_id]['clients'].items()):
-                if client_user_id == exclude_user_id:
-                    continue
-                try:
-                    client_socket.sendall(message_json.encode('utf-8'))
-                except Exception as e:
-                    print(f"Error sending message to {self.db.get_username_by_id(client_user_id)}: {e}")
-                    clients_to_remove.append(client_user_id)
-            
-            for user_to_remove in clients_to_remove:
-                self.leave_room(user_to_remove, room_id)
+            recipients = list(self.rooms[room_id]['clients'].items())
+
+        started = time.perf_counter()
+        failed = fan_out(recipients, message_data, exclude_user_id)
+        BROADCAST_SECONDS.observe(time.perf_counter() - started)
+        BROADCAST_RECIPIENTS.observe(len(recipients))
+        for user_to_remove in failed:
+            log.warning("Dropping user ID %s from room %s: connection closed or too slow.", user_to_remove, room_id,
+                        extra={'event': 'client_dropped', 'user_id': user_to_remove, 'room_id': room_id})
+            self.leave_room(user_to_remove, room_id)
+
+    def _subscribe_room(self, room_id):
+        """Starts receiving the room's events from other processes once it has a local member."""
+        if not self.bus.distributed:
+            return # Single process: the ring buffer already holds every message
+        # Events published while nobody here was subscribed never reached the ring buffer, so
+        # drop it and re-warm after subscribing, from the database and this process's unflushed messages.
+        self.bus.subscribe(room_id)
+        self.rooms[room_id]['history'].reset()
+
+    def deliver_remote(self, room_id, event):
+        """Handles a room event published by another server process."""
+        if room_id == DIRECT_MESSAGE_CHANNEL:
+            self._deliver_direct(event['recipient'], event['message'])
+            return
+        room = self.rooms.get(room_id)
+        if room is None:
+            return # No local members have ever joined it
+        message_data = event['message']
+        self._deliver_local(room_id, message_data)
+        if 'id' not in message_data:
+            return # System notice
+        room['history'].append({
+            "id": message_data['id'], "username": message_data['sender'],
+            "content": message_data['content'], "timestamp": message_data['timestamp']
+        })
+        with self.room_locks[room_id]:
+            room['messages_count'] += 1
+        if event.get('user_id') is not None:
+            self.leaderboard.record_message(event['user_id'], message_data['sender'],
+                                            datetime.datetime.fromisoformat(message_data['timestamp']))
 
     def get_room_list(self, user_id):
         # For now, show all rooms. In a more complex system, private rooms would require invitations.
@@ -160,20 +464,93 @@ class ChatManager:
         if room_id not in self.rooms:
             return {"total_users": 0, "total_messages": 0}
 
-        db_stats = self.db.get_room_stats(room_id)
-        current_active_users = len(self.rooms[room_id]['clients'])
+        current_active_users, _ = self._room_members(room_id)
         
         return {
             "total_users": current_active_users,
-            "total_messages": db_stats.get('total_messages', 0)
+            "total_messages": self.rooms[room_id]['messages_count']
         }
 
+    def _room_members(self, room_id):
+        """Returns (members of the room, up to ROOM_MEMBER_LIST_LIMIT of their usernames) across every server process."""
+        if self.shared_presence:
+            result = self.db.list_room_members(room_id, ROOM_MEMBER_LIST_LIMIT)
+            if result is not None:
+                return result
+            # The database could not answer; members on this process are the best we know
+        usernames = [self.get_username(uid) for uid in list(self.rooms[room_id]['clients'])]
+        usernames = [u for u in usernames if u is not None]
+        return len(usernames), sorted(usernames)[:ROOM_MEMBER_LIST_LIMIT]
+
+    def reconcile_room_counts(self):
+        """Brings in-memory room totals in line with the persisted counters plus messages not yet flushed.
+
+        Counts only ever move forward, so a flush racing with this check cannot make a total go backwards.
+        """
+        persisted = self.db.get_room_message_counts()
+        pending = self.message_writer.pending_counts_by_room()
+        for room_id, room in list(self.rooms.items()):
+            expected = persisted.get(room_id, 0) + pending.get(room_id, 0)
+            with self.room_locks[room_id]:
+                if expected > room['messages_count']:
+                    room['messages_count'] = expected
+
+    def _presence_heartbeat_loop(self):
+        while not self.stopped.wait(PRESENCE_HEARTBEAT_INTERVAL):
+            self.db.heartbeat_node(self.node_id)
+
+    def _reconcile_room_counts_loop(self):
+        while not self.stopped.wait(ROOM_COUNTER_RECONCILE_INTERVAL):
+            try:
+                self.reconcile_room_counts()
+            except Exception as e:
+                log.error("Error reconciling room counters: %s", e)
+
     def get_active_users_in_room(self, room_id):
         if room_id not in self.rooms:
             return []
         
-        active_users = [self.db.get_username_by_id(uid) for uid in self.rooms[room_id]['clients']]
-        return [u for u in active_users if u is not None]
+        return self._room_members(room_id)[1]
+
+    def get_history_page(self, room_id, before_timestamp=None, before_id=None, page_size=50):
+        if room_id not in self.rooms and not self.db.get_room_name(room_id): # May have been created by another process
+            return {"status": "error", "message": "Room does not exist."}
+        try:
+            page_size = max(1, min(int(page_size), HISTORY_MAX_PAGE_SIZE))
+            if before_timestamp is not None:
+                before_timestamp = datetime.datetime.fromisoformat(before_timestamp)
+            if before_id is not None:
+                before_id = int(before_id)
+        except (TypeError, ValueError):
+            return {"status": "error", "message": "Invalid history cursor."}
+
+        # Fetch one extra row to learn whether an older page exists
+        rows = self.db.get_message_history_page(room_id, before_timestamp, before_id, page_size + 1)
+        if rows is None:
+            return {"status": "error", "message": "Could not load history."}
+        has_more = len(rows) > page_size
+        rows = rows[:page_size]
+        next_cursor = None
+        if has_more:
+            next_cursor = {"before_timestamp": rows[-1]['timestamp'], "before_id": rows[-1]['id']}
+        return {
+            "status": "success",
+            "room_id": room_id,
+            "messages": list(reversed(rows)), # Oldest first, like join_room history
+            "next_cursor": next_cursor
+        }
+
+    def get_leaderboard(self, user_id=None, limit=10):
+        response = {"status": "success", "leaderboard": self.leaderboard.top(limit)}
+        if user_id is not None:
+            response["my_rank"] = self.leaderboard.rank_of(user_id)
+        return response
 
-    def get_leaderboard(self):
-        return {"status": "success", "leaderboard": self.db.get_leaderboard()}
+    def close(self):
+        # Flush buffered messages before the database goes away
+        self.stopped.set()
+        if self.shared_presence:
+            self.db.remove_node(self.node_id) # Users here go offline now rather than after PRESENCE_TTL
+        self.bus.close()
+        self.message_writer.close()
+        self.leaderboard.close()
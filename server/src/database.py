@@ -1,248 +1,657 @@
 # server/src/database.py
 import psycopg2
-import hashlib
+import psycopg2.pool
+import psycopg2.extras
+import psycopg2.extensions
+import collections
 import json
 import datetime
+import threading
+import time
+import logging
 
-class Database:
-    def __init__(self, dbname, user, password, host):
-        self.conn = None
-        self.cursor = None
+from migrations import apply_migrations, LATEST_VERSION
+from storage import Storage, StorageError, MessagesRejected, IDENTITY_CACHE_SIZE, PRESENCE_TTL, SEARCH_MAX_MATCHES
+
+log = logging.getLogger(__name__)
+
+POOL_CHECKOUT_TIMEOUT = 10 # Seconds to wait for a free pooled connection
+POOL_HEALTHCHECK_IDLE = 30 # Connections idle for longer than this are pinged before reuse
+
+# Hot-path statements. With prepared statements enabled each pooled connection PREPAREs them once and
+# runs them with EXECUTE afterwards, so Postgres skips parsing and planning on every call.
+Statement = collections.namedtuple('Statement', 'name sql')
+
+USER_CREDENTIALS = Statement('user_credentials', "SELECT id, password_hash FROM users WHERE username = %s;")
+USERNAME_BY_ID = Statement('username_by_id', "SELECT username FROM users WHERE id = %s;")
+SESSION_GENERATION = Statement('session_generation', "SELECT session_generation FROM users WHERE id = %s;")
+ROOM_ID = Statement('room_id', "SELECT id FROM rooms WHERE name = %s;")
+ROOM_NAME = Statement('room_name', "SELECT name FROM rooms WHERE id = %s;")
+ROOM_DETAILS = Statement('room_details', "SELECT id, name, is_private FROM rooms WHERE name = %s;")
+ROOM_STATS = Statement('room_stats', "SELECT message_count FROM room_counters WHERE room_id = %s;")
+RESERVE_MESSAGE_IDS = Statement('reserve_message_ids', """
+    SELECT nextval(pg_get_serial_sequence('messages', 'id')) FROM generate_series(1, %s::integer);
+""")
+MESSAGE_HISTORY = Statement('message_history', """
+    SELECT m.id, u.username, m.content, m.timestamp
+    FROM messages m
+    JOIN users u ON m.user_id = u.id
+    WHERE m.room_id = %s
+    ORDER BY m.timestamp DESC, m.id DESC
+    LIMIT %s;
+""")
+HISTORY_BEFORE_MESSAGE = Statement('history_before_message', """
+    SELECT m.id, u.username, m.content, m.timestamp
+    FROM messages m
+    JOIN users u ON m.user_id = u.id
+    WHERE m.room_id = %s AND (m.timestamp, m.id) < (%s::timestamp, %s::integer)
+    ORDER BY m.timestamp DESC, m.id DESC
+    LIMIT %s;
+""")
+HISTORY_BEFORE_TIMESTAMP = Statement('history_before_timestamp', """
+    SELECT m.id, u.username, m.content, m.timestamp
+    FROM messages m
+    JOIN users u ON m.user_id = u.id
+    WHERE m.room_id = %s AND m.timestamp < %s::timestamp
+    ORDER BY m.timestamp DESC, m.id DESC
+    LIMIT %s;
+""")
+MESSAGES_AFTER = Statement('messages_after', """
+    SELECT m.id, u.username, m.content, m.timestamp
+    FROM messages m
+    JOIN users u ON m.user_id = u.id
+    WHERE m.room_id = %s
+      AND (m.timestamp, m.id) >= (SELECT timestamp, id FROM messages WHERE id = %s)
+    ORDER BY m.timestamp, m.id
+    LIMIT %s;
+""")
+# Batches are passed as arrays and expanded with unnest, so one statement fits every batch size
+INSERT_MESSAGES = Statement('insert_messages', """
+    INSERT INTO messages (id, room_id, user_id, content, timestamp)
+    SELECT * FROM unnest(%s::integer[], %s::integer[], %s::integer[], %s::text[], %s::timestamp[]);
+""")
+ADD_LEADERBOARD_MESSAGES = Statement('add_leaderboard_messages', """
+    UPDATE leaderboard AS l
+    SET message_count = l.message_count + v.message_count,
+        last_active = GREATEST(l.last_active, v.last_active)
+    FROM unnest(%s::integer[], %s::integer[], %s::timestamp[]) AS v(user_id, message_count, last_active)
+    WHERE l.user_id = v.user_id;
+""")
+ADD_ROOM_MESSAGES = Statement('add_room_messages', """
+    INSERT INTO room_counters (room_id, message_count)
+    SELECT * FROM unnest(%s::integer[], %s::integer[])
+    ON CONFLICT (room_id) DO UPDATE SET message_count = room_counters.message_count + EXCLUDED.message_count;
+""")
+CHECKPOINT_LEADERBOARD = Statement('checkpoint_leaderboard', """
+    UPDATE leaderboard AS l
+    SET active_seconds = l.active_seconds + v.active_seconds,
+        last_active = GREATEST(l.last_active, v.last_active)
+    FROM unnest(%s::integer[], %s::bigint[], %s::timestamp[]) AS v(user_id, active_seconds, last_active)
+    WHERE l.user_id = v.user_id;
+""")
+
+# Full-text search over messages.search_vector (migration 6). Only the newest max_matches matches are
+# ranked, then one page of the ranking is returned. The query text is inlined rather than prepared so the
+# planner can use the word's frequency: rare words come from the GIN index, common ones from walking a
+# timestamp index until max_matches rows have matched.
+SEARCH_MESSAGES = """
+    WITH matches AS (
+        SELECT m.id, m.room_id, m.user_id, m.content, m.timestamp, m.search_vector
+        FROM messages m
+        JOIN rooms r ON m.room_id = r.id
+        WHERE m.search_vector @@ websearch_to_tsquery('english', %(query)s) AND {scope}
+        ORDER BY m.timestamp DESC, m.id DESC
+        LIMIT %(max_matches)s
+    )
+    SELECT matches.id, r.name, u.username, matches.content, matches.timestamp,
+           ts_rank(matches.search_vector, websearch_to_tsquery('english', %(query)s)) AS rank
+    FROM matches
+    JOIN rooms r ON matches.room_id = r.id
+    JOIN users u ON matches.user_id = u.id
+    ORDER BY rank DESC, matches.timestamp DESC, matches.id DESC
+    LIMIT %(limit)s OFFSET %(offset)s;
+"""
+SEARCH_ROOM_MESSAGES = SEARCH_MESSAGES.format(scope="m.room_id = %(room_id)s")
+SEARCH_PUBLIC_MESSAGES = SEARCH_MESSAGES.format(scope="NOT r.is_private")
+
+# Users whose server process has sent a heartbeat within PRESENCE_TTL (migration 8)
+LIVE_PRESENCE = """
+    FROM presence p
+    JOIN server_nodes n ON p.node_id = n.node_id
+    JOIN users u ON p.user_id = u.id
+    WHERE n.last_seen >= NOW() - make_interval(secs => %s)
+"""
+
+PREPARED_STATEMENTS = (
+    USER_CREDENTIALS, USERNAME_BY_ID, SESSION_GENERATION, ROOM_ID, ROOM_NAME, ROOM_DETAILS, ROOM_STATS, RESERVE_MESSAGE_IDS,
+    MESSAGE_HISTORY, HISTORY_BEFORE_MESSAGE, HISTORY_BEFORE_TIMESTAMP, MESSAGES_AFTER,
+    INSERT_MESSAGES, ADD_LEADERBOARD_MESSAGES, ADD_ROOM_MESSAGES, CHECKPOINT_LEADERBOARD,
+)
+
+
+def _numbered_placeholders(sql):
+    # PREPARE takes $1, $2, ... where psycopg2 takes %s
+    parts = sql.strip().rstrip(';').split('%s')
+    return parts[0] + ''.join(f"${number}{part}" for number, part in enumerate(parts[1:], start=1))
+
+
+class PreparingConnection(psycopg2.extensions.connection):
+    """Pooled connection that records whether PREPARED_STATEMENTS exist on its server session."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared = False # True once prepared; None if preparing failed and plain SQL is used
+
+
+class Database(Storage):
+    """PostgreSQL storage backend (DB_BACKEND=postgres) on a thread-safe connection pool."""
+
+    backend = 'postgres'
+    supports_notify = True
+
+    def __init__(self, dbname, user, password, host, min_connections=2, max_connections=20, identity_cache_size=IDENTITY_CACHE_SIZE,
+                 prepared_statements=True):
+        super().__init__(identity_cache_size)
+        self.pool = None
         self.dbname = dbname
         self.user = user
         self.password = password
         self.host = host
+        self.min_connections = min_connections
+        self.max_connections = max_connections
+        self.prepared_statements = prepared_statements
+        self._schema_ready = False # Statements can only be prepared once the tables exist
+        self._slots = threading.BoundedSemaphore(max_connections) # Blocks checkout instead of raising PoolError
+        self._last_used = {} # {id(conn): monotonic timestamp of last checkin}
         self._connect()
         self._create_tables()
 
     def _connect(self):
         try:
-            self.conn = psycopg2.connect(
+            self.pool = psycopg2.pool.ThreadedConnectionPool(
+                self.min_connections,
+                self.max_connections,
                 dbname=self.dbname,
                 user=self.user,
                 password=self.password,
-                host=self.host
+                host=self.host,
+                connection_factory=PreparingConnection
             )
-            self.cursor = self.conn.cursor()
-            print("Database connected successfully.")
-        except Exception as e:
-            print(f"Error connecting to database: {e}")
-            # In a real-world scenario, you might want to retry or exit
-            exit(1)
+            log.info("Database connected successfully (pool size %s-%s, prepared statements %s).",
+                     self.min_connections, self.max_connections, 'on' if self.prepared_statements else 'off')
+        except psycopg2.Error as e:
+            raise StorageError(f"Error connecting to database {self.dbname} at {self.host}: {e}") from e
+
+    def _checkout(self):
+        if not self._slots.acquire(timeout=POOL_CHECKOUT_TIMEOUT):
+            raise psycopg2.pool.PoolError("Timed out waiting for a database connection.")
+        try:
+            conn = self.pool.getconn()
+            if conn.closed or not self._is_healthy(conn):
+                # Replace a dead connection transparently; the pool opens a fresh one
+                self.pool.putconn(conn, close=True)
+                conn = self.pool.getconn()
+            if self.prepared_statements and self._schema_ready and conn.prepared is False:
+                self._prepare(conn)
+            return conn
+        except Exception:
+            self._slots.release()
+            raise
+
+    def _checkin(self, conn, broken=False):
+        try:
+            if broken or conn.closed:
+                self._last_used.pop(id(conn), None)
+                self.pool.putconn(conn, close=True)
+            else:
+                self._last_used[id(conn)] = time.monotonic()
+                self.pool.putconn(conn)
+        finally:
+            self._slots.release()
+
+    def _is_healthy(self, conn):
+        last_used = self._last_used.get(id(conn))
+        if last_used is None or time.monotonic() - last_used < POOL_HEALTHCHECK_IDLE:
+            return True # Freshly opened or recently used
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1;")
+            conn.rollback()
+            return True
+        except Exception:
+            return False
+
+    def _prepare(self, conn):
+        """PREPAREs the hot statements on a newly opened connection, in one round trip."""
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute(" ".join(
+                    f"PREPARE {statement.name} AS {_numbered_placeholders(statement.sql)};" for statement in PREPARED_STATEMENTS
+                ))
+            conn.commit()
+            conn.prepared = True
+        except psycopg2.Error as e:
+            # e.g. behind a transaction-pooling proxy that does not keep session state
+            conn.rollback()
+            conn.prepared = None
+            log.warning("Could not prepare statements, using plain queries on this connection: %s", e)
+
+    @staticmethod
+    def _run(cursor, query, params=None):
+        """Executes query, which is SQL text or a Statement; Statements use EXECUTE where they are prepared."""
+        if isinstance(query, Statement):
+            if getattr(cursor.connection, 'prepared', False) is True:
+                cursor.execute(f"EXECUTE {query.name} ({', '.join(['%s'] * len(params))});", params)
+                return
+            query = query.sql
+        cursor.execute(query, params)
+
+    def _execute(self, work):
+        """Runs work(cursor) in its own transaction on a pooled connection and returns its result.
+
+        The transaction is committed when work returns and rolled back if it raises.
+        A connection lost before commit is discarded and the work retried once on a new one.
+        """
+        for attempt in (1, 2):
+            conn = self._checkout()
+            try:
+                with conn.cursor() as cursor:
+                    result = work(cursor)
+            except (psycopg2.OperationalError, psycopg2.InterfaceError):
+                self._checkin(conn, broken=True)
+                if attempt == 2:
+                    raise
+                continue
+            except Exception:
+                try:
+                    conn.rollback()
+                finally:
+                    self._checkin(conn, broken=bool(conn.closed))
+                raise
+            try:
+                conn.commit()
+            except Exception:
+                self._checkin(conn, broken=True)
+                raise
+            self._checkin(conn)
+            return result
+
+    def _fetchone(self, query, params=None):
+        def fetch(cursor):
+            self._run(cursor, query, params)
+            return cursor.fetchone()
+        return self._execute(fetch)
+
+    def _fetchall(self, query, params=None):
+        def fetch(cursor):
+            self._run(cursor, query, params)
+            return cursor.fetchall()
+        return self._execute(fetch)
 
     def _create_tables(self):
         try:
-            # Users table
-            self.cursor.execute("""
-                CREATE TABLE IF NOT EXISTS users (
-                    id SERIAL PRIMARY KEY,
-                    username VARCHAR(50) UNIQUE NOT NULL,
-                    password_hash VARCHAR(128) NOT NULL,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                );
-            """)
-            # Rooms table
-            self.cursor.execute("""
-                CREATE TABLE IF NOT EXISTS rooms (
-                    id SERIAL PRIMARY KEY,
-                    name VARCHAR(50) UNIQUE NOT NULL,
-                    is_private BOOLEAN DEFAULT FALSE,
-                    created_by_user_id INTEGER REFERENCES users(id),
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                );
-            """)
-            # Messages table
-            self.cursor.execute("""
-                CREATE TABLE IF NOT EXISTS messages (
-                    id SERIAL PRIMARY KEY,
-                    room_id INTEGER REFERENCES rooms(id),
-                    user_id INTEGER REFERENCES users(id),
-                    content TEXT NOT NULL,
-                    timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                );
-            """)
-            # Leaderboard table (for message counts and active time)
-            self.cursor.execute("""
-                CREATE TABLE IF NOT EXISTS leaderboard (
-                    user_id INTEGER UNIQUE REFERENCES users(id),
-                    message_count INTEGER DEFAULT 0,
-                    last_active TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    PRIMARY KEY (user_id)
-                );
-            """)
-            self.conn.commit()
-            print("Tables created/verified successfully.")
-        except Exception as e:
-            print(f"Error creating tables: {e}")
-            self.conn.rollback()
-
-    def add_user(self, username, password):
-        try:
-            password_hash = hashlib.sha256(password.encode()).hexdigest()
-            self.cursor.execute(
+            applied = self._execute(apply_migrations)
+            if applied:
+                log.info("Applied schema migrations: %s.", ', '.join(str(v) for v in applied))
+            log.info("Schema is at version %s.", LATEST_VERSION)
+            self._schema_ready = True
+        except Exception as e:
+            log.error("Error migrating schema: %s", e)
+
+    def add_user(self, username, password_hash):
+        """Creates a user from an already computed password hash (see passwords.py)."""
+        def insert(cursor):
+            cursor.execute(
                 "INSERT INTO users (username, password_hash) VALUES (%s, %s) RETURNING id;",
                 (username, password_hash)
             )
-            user_id = self.cursor.fetchone()[0]
-            self.cursor.execute(
+            user_id = cursor.fetchone()[0]
+            cursor.execute(
                 "INSERT INTO leaderboard (user_id) VALUES (%s);",
                 (user_id,)
             )
-            self.conn.commit()
+            return user_id
+
+        try:
+            user_id = self._execute(insert)
+            self.usernames.put(user_id, username)
             return True
         except psycopg2.IntegrityError:
-            self.conn.rollback()
             return False # Username already exists
         except Exception as e:
-            print(f"Error adding user: {e}")
-            self.conn.rollback()
+            log.error("Error adding user: %s", e)
             return False
 
-    def verify_user(self, username, password):
+    def get_user_credentials(self, username):
+        """Returns (user_id, password_hash), or None if the user does not exist."""
         try:
-            self.cursor.execute(
-                "SELECT id, password_hash FROM users WHERE username = %s;",
-                (username,)
-            )
-            result = self.cursor.fetchone()
+            result = self._fetchone(USER_CREDENTIALS, (username,))
             if result:
-                user_id, stored_password_hash = result
-                input_password_hash = hashlib.sha256(password.encode()).hexdigest()
-                if stored_password_hash == input_password_hash:
-                    return user_id
-            return None
+                self.usernames.put(result[0], username)
+            return result
         except Exception as e:
-            print(f"Error verifying user: {e}")
+            log.error("Error fetching user credentials: %s", e)
             return None
 
-    def create_room(self, room_name, is_private, created_by_user_id):
+    def update_password_hash(self, user_id, password_hash):
         try:
-            self.cursor.execute(
+            self._execute(lambda cursor: cursor.execute(
+                "UPDATE users SET password_hash = %s WHERE id = %s;",
+                (password_hash, user_id)
+            ))
+            return True
+        except Exception as e:
+            log.error("Error updating password hash: %s", e)
+            return False
+
+    def create_room(self, room_name, is_private, created_by_user_id):
+        def insert(cursor):
+            cursor.execute(
                 "INSERT INTO rooms (name, is_private, created_by_user_id) VALUES (%s, %s, %s) RETURNING id;",
                 (room_name, is_private, created_by_user_id)
             )
-            room_id = self.cursor.fetchone()[0]
-            self.conn.commit()
+            room_id = cursor.fetchone()[0]
+            cursor.execute(
+                "INSERT INTO room_counters (room_id) VALUES (%s);",
+                (room_id,)
+            )
+            return room_id
+
+        try:
+            room_id = self._execute(insert)
+            self.room_names.put(room_id, room_name)
             return room_id
         except psycopg2.IntegrityError:
-            self.conn.rollback()
             return None # Room name already exists
         except Exception as e:
-            print(f"Error creating room: {e}")
-            self.conn.rollback()
+            log.error("Error creating room: %s", e)
             return None
 
     def get_room_id(self, room_name):
         try:
-            self.cursor.execute(
-                "SELECT id FROM rooms WHERE name = %s;",
-                (room_name,)
-            )
-            result = self.cursor.fetchone()
+            result = self._fetchone(ROOM_ID, (room_name,))
             return result[0] if result else None
         except Exception as e:
-            print(f"Error getting room ID: {e}")
+            log.error("Error getting room ID: %s", e)
             return None
 
     def get_room_name(self, room_id):
+        room_name = self.room_names.get(room_id)
+        if room_name is not None:
+            return room_name
         try:
-            self.cursor.execute(
-                "SELECT name FROM rooms WHERE id = %s;",
-                (room_id,)
-            )
-            result = self.cursor.fetchone()
+            result = self._fetchone(ROOM_NAME, (room_id,))
+            if result:
+                self.room_names.put(room_id, result[0])
             return result[0] if result else None
         except Exception as e:
-            print(f"Error getting room name: {e}")
+            log.error("Error getting room name: %s", e)
             return None
 
     def get_room_details(self, room_name):
         try:
-            self.cursor.execute(
-                "SELECT id, name, is_private FROM rooms WHERE name = %s;",
-                (room_name,)
-            )
-            result = self.cursor.fetchone()
+            result = self._fetchone(ROOM_DETAILS, (room_name,))
             if result:
+                self.room_names.put(result[0], result[1])
                 return {"id": result[0], "name": result[1], "is_private": result[2]}
             return None
         except Exception as e:
-            print(f"Error getting room details: {e}")
+            log.error("Error getting room details: %s", e)
             return None
 
     def get_all_rooms(self):
         try:
-            self.cursor.execute(
+            rows = self._fetchall(
                 "SELECT id, name, is_private FROM rooms;"
             )
-            return [{"id": r[0], "name": r[1], "is_private": r[2]} for r in self.cursor.fetchall()]
+            for r in rows:
+                self.room_names.put(r[0], r[1])
+            return [{"id": r[0], "name": r[1], "is_private": r[2]} for r in rows]
         except Exception as e:
-            print(f"Error getting all rooms: {e}")
+            log.error("Error getting all rooms: %s", e)
             return []
 
-    def save_message(self, room_id, user_id, content):
+    def save_messages_batch(self, messages):
+        """Persists [(id, room_id, user_id, content, timestamp), ...] with their leaderboard and room counter increments in one transaction."""
+        activity = {} # {user_id: [message_count, last_active]}
+        room_totals = {} # {room_id: message_count}
+        for message_id, room_id, user_id, content, timestamp in messages:
+            entry = activity.setdefault(user_id, [0, timestamp])
+            entry[0] += 1
+            entry[1] = max(entry[1], timestamp)
+            room_totals[room_id] = room_totals.get(room_id, 0) + 1
+
+        def insert(cursor):
+            # Each statement takes one array per column
+            self._run(cursor, INSERT_MESSAGES, [list(column) for column in zip(*messages)])
+            self._run(cursor, ADD_LEADERBOARD_MESSAGES, (
+                list(activity), [count for count, _ in activity.values()], [last for _, last in activity.values()]
+            ))
+            self._run(cursor, ADD_ROOM_MESSAGES, (list(room_totals), list(room_totals.values())))
+
         try:
-            self.cursor.execute(
-                "INSERT INTO messages (room_id, user_id, content) VALUES (%s, %s, %s);",
-                (room_id, user_id, content)
-            )
-            self.cursor.execute(
-                "UPDATE leaderboard SET message_count = message_count + 1, last_active = NOW() WHERE user_id = %s;",
-                (user_id,)
-            )
-            self.conn.commit()
+            self._execute(insert)
             return True
+        except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+            log.error("Error saving message batch of %s: %s", len(messages), e)
+            return False
+        except (psycopg2.Error, ValueError) as e:
+            # Constraint violations, bad values, NUL characters: retrying the same rows cannot help
+            raise MessagesRejected(str(e).strip())
         except Exception as e:
-            print(f"Error saving message: {e}")
-            self.conn.rollback()
+            log.error("Error saving message batch of %s: %s", len(messages), e)
             return False
 
+    def reserve_message_ids(self, count):
+        """Draws count ids from the messages id sequence in a single round trip."""
+        rows = self._fetchall(RESERVE_MESSAGE_IDS, (count,))
+        return [r[0] for r in rows]
+
     def get_message_history(self, room_id, limit=50):
         try:
-            self.cursor.execute(
-                """
-                SELECT u.username, m.content, m.timestamp
-                FROM messages m
-                JOIN users u ON m.user_id = u.id
-                WHERE m.room_id = %s
-                ORDER BY m.timestamp DESC
-                LIMIT %s;
-                """,
-                (room_id, limit)
-            )
-            return [{"username": r[0], "content": r[1], "timestamp": r[2].isoformat()} for r in reversed(self.cursor.fetchall())]
+            rows = self._fetchall(MESSAGE_HISTORY, (room_id, limit))
+            return [{"id": r[0], "username": r[1], "content": r[2], "timestamp": r[3].isoformat()} for r in reversed(rows)]
         except Exception as e:
-            print(f"Error getting message history: {e}")
+            log.error("Error getting message history: %s", e)
             return []
 
-    def get_username_by_id(self, user_id):
+    def get_message_history_page(self, room_id, before_timestamp=None, before_id=None, limit=50):
+        """Returns up to limit messages older than the (timestamp, id) cursor, newest first.
+
+        Keyset pagination over idx_messages_room_timestamp: each page is a bounded index range
+        scan no matter how far back the cursor is, unlike OFFSET.
+        """
+        if before_timestamp is not None and before_id is not None:
+            statement, params = HISTORY_BEFORE_MESSAGE, (room_id, before_timestamp, before_id, limit)
+        elif before_timestamp is not None:
+            statement, params = HISTORY_BEFORE_TIMESTAMP, (room_id, before_timestamp, limit)
+        else:
+            statement, params = MESSAGE_HISTORY, (room_id, limit)
+        try:
+            rows = self._fetchall(statement, params)
+            return [{"id": r[0], "username": r[1], "content": r[2], "timestamp": r[3].isoformat()} for r in rows]
+        except Exception as e:
+            log.error("Error getting message history page: %s", e)
+            return None
+
+    def get_messages_after(self, room_id, after_id, limit=500):
+        """Returns up to limit messages that follow message after_id in the room, oldest first.
+
+        Ordered by (timestamp, id) like the rest of the history queries, since ids are handed out
+        in blocks per server and are not ordered across servers. The query also returns after_id
+        itself, which tells a message with nothing after it apart from an unknown one.
+        """
+        try:
+            rows = self._fetchall(MESSAGES_AFTER, (room_id, after_id, limit + 1))
+            if not rows or rows[0][0] != after_id:
+                return None
+            return [{"id": r[0], "username": r[1], "content": r[2], "timestamp": r[3].isoformat()} for r in rows[1:]]
+        except Exception as e:
+            log.error("Error getting messages after %s: %s", after_id, e)
+            return None
+
+    def search_messages(self, query, room_id=None, limit=20, offset=0, max_matches=SEARCH_MAX_MATCHES):
+        statement = SEARCH_PUBLIC_MESSAGES if room_id is None else SEARCH_ROOM_MESSAGES
+        params = {"query": query, "room_id": room_id, "max_matches": max_matches, "limit": limit, "offset": offset}
+        try:
+            rows = self._fetchall(statement, params)
+            return [{"id": r[0], "room": r[1], "username": r[2], "content": r[3], "timestamp": r[4].isoformat(),
+                     "rank": r[5]} for r in rows]
+        except Exception as e:
+            log.error("Error searching messages: %s", e)
+            return None
+
+    def get_session_generation(self, user_id):
+        try:
+            result = self._fetchone(SESSION_GENERATION, (user_id,))
+            return result[0] if result else None
+        except Exception as e:
+            log.error("Error getting session generation: %s", e)
+            return None
+
+    def revoke_sessions(self, user_id):
         try:
-            self.cursor.execute(
-                "SELECT username FROM users WHERE id = %s;",
+            result = self._fetchone(
+                "UPDATE users SET session_generation = session_generation + 1 WHERE id = %s RETURNING session_generation;",
                 (user_id,)
             )
-            result = self.cursor.fetchone()
             return result[0] if result else None
         except Exception as e:
-            print(f"Error getting username by ID: {e}")
+            log.error("Error revoking sessions: %s", e)
+            return None
+
+    def get_or_create_setting(self, name, value):
+        try:
+            def fetch(cursor):
+                cursor.execute("INSERT INTO server_settings (name, value) VALUES (%s, %s) ON CONFLICT (name) DO NOTHING;", (name, value))
+                cursor.execute("SELECT value FROM server_settings WHERE name = %s;", (name,))
+                return cursor.fetchone()[0]
+            return self._execute(fetch)
+        except Exception as e:
+            log.error("Error reading setting %s: %s", name, e)
+            return None
+
+    def get_username_by_id(self, user_id):
+        username = self.usernames.get(user_id)
+        if username is not None:
+            return username
+        try:
+            result = self._fetchone(USERNAME_BY_ID, (user_id,))
+            if result:
+                self.usernames.put(user_id, result[0])
+            return result[0] if result else None
+        except Exception as e:
+            log.error("Error getting username by ID: %s", e)
             return None
 
     def get_room_stats(self, room_id):
         try:
-            self.cursor.execute(
-                "SELECT COUNT(*) FROM messages WHERE room_id = %s;",
-                (room_id,)
-            )
-            total_messages = self.cursor.fetchone()[0]
+            result = self._fetchone(ROOM_STATS, (room_id,))
             # Active users in room is handled by chat_manager in real-time, not purely from DB
-            return {"total_messages": total_messages}
+            return {"total_messages": result[0] if result else 0}
         except Exception as e:
-            print(f"Error getting room stats: {e}")
+            log.error("Error getting room stats: %s", e)
             return {"total_messages": 0}
 
+    def get_room_message_counts(self):
+        """Returns {room_id: total_messages} for every room in a single query."""
+        try:
+            return dict(self._fetchall("SELECT room_id, message_count FROM room_counters;"))
+        except Exception as e:
+            log.error("Error getting room message counts: %s", e)
+            return {}
+
+    def heartbeat_node(self, node_id):
+        def beat(cursor):
+            cursor.execute(
+                "INSERT INTO server_nodes (node_id, last_seen) VALUES (%s, NOW()) ON CONFLICT (node_id) DO UPDATE SET last_seen = NOW();",
+                (node_id,)
+            )
+            cursor.execute(
+                "DELETE FROM presence WHERE node_id IN (SELECT node_id FROM server_nodes WHERE last_seen < NOW() - make_interval(secs => %s));",
+                (PRESENCE_TTL,)
+            )
+            cursor.execute("DELETE FROM server_nodes WHERE last_seen < NOW() - make_interval(secs => %s);", (PRESENCE_TTL,))
+        try:
+            self._execute(beat)
+            return True
+        except Exception as e:
+            log.error("Error recording presence heartbeat: %s", e)
+            return False
+
+    def set_presence(self, user_id, node_id):
+        try:
+            self._execute(lambda cursor: cursor.execute(
+                "INSERT INTO presence (user_id, node_id) VALUES (%s, %s) ON CONFLICT (user_id) DO UPDATE SET node_id = EXCLUDED.node_id, room_id = NULL;",
+                (user_id, node_id)
+            ))
+            return True
+        except Exception as e:
+            log.error("Error recording presence: %s", e)
+            return False
+
+    def clear_presence(self, user_id, node_id):
+        try:
+            self._execute(lambda cursor: cursor.execute(
+                "DELETE FROM presence WHERE user_id = %s AND node_id = %s;", (user_id, node_id)
+            ))
+            return True
+        except Exception as e:
+            log.error("Error clearing presence: %s", e)
+            return False
+
+    def remove_node(self, node_id):
+        def remove(cursor):
+            cursor.execute("DELETE FROM presence WHERE node_id = %s;", (node_id,))
+            cursor.execute("DELETE FROM server_nodes WHERE node_id = %s;", (node_id,))
+        try:
+            self._execute(remove)
+            return True
+        except Exception as e:
+            log.error("Error removing server node: %s", e)
+            return False
+
+    def is_user_online(self, username):
+        try:
+            return self._fetchone("SELECT 1 " + LIVE_PRESENCE + "AND u.username = %s;", (PRESENCE_TTL, username)) is not None
+        except Exception as e:
+            log.error("Error checking presence: %s", e)
+            return None
+
+    def list_online_users(self, limit=100):
+        try:
+            rows = self._fetchall(
+                "SELECT u.username, COUNT(*) OVER () " + LIVE_PRESENCE + "ORDER BY u.username LIMIT %s;", (PRESENCE_TTL, limit)
+            )
+            return (rows[0][1] if rows else 0), [r[0] for r in rows]
+        except Exception as e:
+            log.error("Error listing online users: %s", e)
+            return None
+
+    def set_presence_room(self, user_id, node_id, room_id):
+        try:
+            self._execute(lambda cursor: cursor.execute(
+                "UPDATE presence SET room_id = %s WHERE user_id = %s AND node_id = %s;", (room_id, user_id, node_id)
+            ))
+            return True
+        except Exception as e:
+            log.error("Error recording room presence: %s", e)
+            return False
+
+    def list_room_members(self, room_id, limit=100):
+        try:
+            rows = self._fetchall(
+                "SELECT u.username, COUNT(*) OVER () " + LIVE_PRESENCE + "AND p.room_id = %s ORDER BY u.username LIMIT %s;",
+                (PRESENCE_TTL, room_id, limit)
+            )
+            return (rows[0][1] if rows else 0), [r[0] for r in rows]
+        except Exception as e:
+            log.error("Error listing room members: %s", e)
+            return None
+
     def get_leaderboard(self, limit=10):
         try:
-            self.cursor.execute(
+            rows = self._fetchall(
                 """
                 SELECT u.username, l.message_count, l.last_active
                 FROM leaderboard l
@@ -252,24 +661,55 @@ class Database:
                 """,
                 (limit,)
             )
-            return [{"username": r[0], "message_count": r[1], "last_active": r[2].isoformat()} for r in self.cursor.fetchall()]
+            return [{"username": r[0], "message_count": r[1], "last_active": r[2].isoformat()} for r in rows]
         except Exception as e:
-            print(f"Error getting leaderboard: {e}")
+            log.error("Error getting leaderboard: %s", e)
             return []
 
-    def update_user_active_time(self, user_id):
+    def load_leaderboard(self):
+        """Returns [(user_id, username, message_count, last_active, active_seconds), ...] for every user."""
         try:
-            self.cursor.execute(
-                "UPDATE leaderboard SET last_active = NOW() WHERE user_id = %s;",
-                (user_id,)
+            return self._fetchall(
+                """
+                SELECT l.user_id, u.username, l.message_count, l.last_active, l.active_seconds
+                FROM leaderboard l
+                JOIN users u ON l.user_id = u.id;
+                """
             )
-            self.conn.commit()
         except Exception as e:
-            print(f"Error updating user active time: {e}")
-            self.conn.rollback()
+            log.error("Error loading leaderboard: %s", e)
+            return []
+
+    def checkpoint_leaderboard(self, entries):
+        """Applies [(user_id, active_seconds_delta, last_active), ...] in one statement."""
+        try:
+            self._execute(lambda cursor: self._run(cursor, CHECKPOINT_LEADERBOARD, [list(column) for column in zip(*entries)]))
+            return True
+        except Exception as e:
+            log.error("Error checkpointing leaderboard: %s", e)
+            return False
+
+    def open_listener(self):
+        """Opens a dedicated autocommit connection for LISTEN, outside the pool so it is never handed to a request."""
+        conn = psycopg2.connect(dbname=self.dbname, user=self.user, password=self.password, host=self.host)
+        conn.autocommit = True
+        return conn
+
+    def notify_batch(self, notifications):
+        """Sends [(channel, payload), ...] as NOTIFYs in one statement; they are delivered when it commits."""
+        try:
+            self._execute(lambda cursor: psycopg2.extras.execute_values(
+                cursor,
+                "SELECT pg_notify(v.channel, v.payload) FROM (VALUES %s) AS v(channel, payload);",
+                notifications,
+                page_size=len(notifications)
+            ))
+            return True
+        except Exception as e:
+            log.error("Error sending notifications: %s", e)
+            return False
 
     def close(self):
-        if self.conn:
-            self.cursor.close()
-            self.conn.close()
-            print("Database connection closed.")
+        if self.pool:
+            self.pool.closeall()
+            log.info("Database connection pool closed.")
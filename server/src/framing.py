@@ -0,0 +1,85 @@
+# server/src/framing.py
+import os
+import struct
+
+LENGTH_PREFIX = struct.Struct('>I')
+
+MAX_FRAME_BYTES = int(os.getenv('MAX_FRAME_BYTES', 64 * 1024)) # Longest request frame accepted from a client
+RECV_CHUNK_BYTES = 65536
+
+
+class FrameTooLarge(Exception):
+    pass
+
+
+class FrameReader:
+    """Splits a client's byte stream into newline-terminated frames.
+
+    Bytes left over after a frame stay buffered for the next call, so pipelined commands
+    are returned one by one in order instead of being dropped. Data is received straight
+    into a reusable chunk, appended to a single bytearray, and only scanned once for
+    newlines, which keeps large frames linear rather than quadratic to assemble.
+
+    With length_prefixed=True (the negotiated binary protocol) frames are instead a 4-byte
+    big-endian length followed by the payload.
+    """
+
+    def __init__(self, sock, max_frame_size=MAX_FRAME_BYTES, chunk_size=RECV_CHUNK_BYTES):
+        self.socket = sock
+        self.max_frame_size = max_frame_size
+        self.buffer = bytearray()
+        self.start = 0 # Offset of the first unconsumed byte
+        self.scanned = 0 # Bytes before this offset are known not to contain a newline
+        self.chunk = bytearray(chunk_size)
+        self.chunk_view = memoryview(self.chunk)
+
+    def read_frame(self, length_prefixed=False):
+        """Returns the next frame without its delimiter or prefix, or None once the peer has closed the stream."""
+        while True:
+            if length_prefixed:
+                frame = self.next_buffered_prefixed_frame()
+            else:
+                frame = self.next_buffered_frame()
+            if frame is not None:
+                return frame
+            if len(self.buffer) - self.start > self.max_frame_size + LENGTH_PREFIX.size:
+                raise FrameTooLarge(f"Frame exceeds {self.max_frame_size} bytes.")
+            if self.start:
+                # Compact once per recv, not once per frame
+                del self.buffer[:self.start]
+                self.scanned -= self.start
+                self.start = 0
+            received = self.socket.recv_into(self.chunk)
+            if not received:
+                return None
+            self.buffer += self.chunk_view[:received]
+
+    def next_buffered_frame(self):
+        """Returns a complete frame already in the buffer, or None without touching the socket."""
+        newline = self.buffer.find(b'\n', self.scanned)
+        if newline == -1:
+            self.scanned = len(self.buffer)
+            return None
+        frame = bytes(self.buffer[self.start:newline])
+        self.start = self.scanned = newline + 1
+        if self.start == len(self.buffer):
+            self.buffer.clear()
+            self.start = self.scanned = 0
+        return frame
+
+    def next_buffered_prefixed_frame(self):
+        available = len(self.buffer) - self.start
+        if available < LENGTH_PREFIX.size:
+            return None
+        (length,) = LENGTH_PREFIX.unpack_from(self.buffer, self.start)
+        if length > self.max_frame_size:
+            raise FrameTooLarge(f"Frame exceeds {self.max_frame_size} bytes.")
+        if available < LENGTH_PREFIX.size + length:
+            return None
+        begin = self.start + LENGTH_PREFIX.size
+        frame = bytes(self.buffer[begin:begin + length])
+        self.start = self.scanned = begin + length
+        if self.start == len(self.buffer):
+            self.buffer.clear()
+            self.start = self.scanned = 0
+        return frame
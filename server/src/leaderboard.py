@@ -0,0 +1,271 @@
+# server/src/leaderboard.py
+import bisect
+import datetime
+import itertools
+import logging
+import os
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+LEADERBOARD_CHECKPOINT_INTERVAL = float(os.getenv('LEADERBOARD_CHECKPOINT_INTERVAL', 30)) # Seconds between writes of active time to the database
+RANKING_BUCKET_SIZE = 1000 # Rank keys per bucket; a bucket twice this size is split
+
+
+class RankIndex:
+    """Sorted rank keys kept in buckets of about RANKING_BUCKET_SIZE.
+
+    A flat sorted list shifts every key after the insertion point on each update, which is
+    O(n) per message under the leaderboard lock. Here an insert or removal shifts one bucket
+    (O(bucket size)). Bucket lengths are also kept in a Fenwick tree, so the number of keys
+    before a bucket, and with it a rank, takes O(log n). Splitting a full bucket or dropping an
+    empty one rebuilds the tree in O(n / bucket size), once per bucket_size inserts at most.
+    """
+
+    def __init__(self, keys=(), bucket_size=RANKING_BUCKET_SIZE):
+        self.bucket_size = bucket_size
+        keys = sorted(keys)
+        self.size = len(keys)
+        self.buckets = [keys[i:i + bucket_size] for i in range(0, len(keys), bucket_size)]
+        self.maxes = [bucket[-1] for bucket in self.buckets] # Largest key of each bucket
+        self._rebuild_counts()
+
+    def __len__(self):
+        return self.size
+
+    def _rebuild_counts(self):
+        # counts[i] (1-based) holds the lengths of buckets i - (i & -i) .. i - 1
+        self.counts = [0] * (len(self.buckets) + 1)
+        for i, bucket in enumerate(self.buckets, start=1):
+            self.counts[i] += len(bucket)
+            parent = i + (i & -i)
+            if parent < len(self.counts):
+                self.counts[parent] += self.counts[i]
+
+    def _adjust_count(self, bucket_index, delta):
+        i = bucket_index + 1
+        while i < len(self.counts):
+            self.counts[i] += delta
+            i += i & -i
+
+    def _keys_before(self, bucket_index):
+        total = 0
+        i = bucket_index
+        while i > 0:
+            total += self.counts[i]
+            i -= i & -i
+        return total
+
+    def add(self, key):
+        self.size += 1
+        if not self.buckets:
+            self.buckets.append([key])
+            self.maxes.append(key)
+            self._rebuild_counts()
+            return
+        i = min(bisect.bisect_left(self.maxes, key), len(self.buckets) - 1)
+        bucket = self.buckets[i]
+        bisect.insort(bucket, key)
+        self.maxes[i] = bucket[-1]
+        if len(bucket) > 2 * self.bucket_size:
+            self.buckets[i:i + 1] = [bucket[:self.bucket_size], bucket[self.bucket_size:]]
+            self.maxes[i:i + 1] = [bucket[self.bucket_size - 1], bucket[-1]]
+            self._rebuild_counts()
+        else:
+            self._adjust_count(i, 1)
+
+    def remove(self, key):
+        i = bisect.bisect_left(self.maxes, key)
+        if i == len(self.buckets):
+            return False
+        bucket = self.buckets[i]
+        j = bisect.bisect_left(bucket, key)
+        if j == len(bucket) or bucket[j] != key:
+            return False
+        del bucket[j]
+        self.size -= 1
+        if bucket:
+            self.maxes[i] = bucket[-1]
+            self._adjust_count(i, -1)
+        else:
+            del self.buckets[i]
+            del self.maxes[i]
+            self._rebuild_counts()
+        return True
+
+    def index(self, key):
+        """Number of keys smaller than key."""
+        i = bisect.bisect_left(self.maxes, key)
+        before = self._keys_before(i)
+        if i < len(self.buckets):
+            before += bisect.bisect_left(self.buckets[i], key)
+        return before
+
+    def first(self, limit):
+        return list(itertools.islice(itertools.chain.from_iterable(self.buckets), limit))
+
+
+class Leaderboard:
+    """In-memory ranking of users by message count, then most recent activity.
+
+    Ranks are kept in a RankIndex of (-message_count, -last_active, user_id) keys, so a
+    user's rank is a binary search plus a sum over buckets and the top K is a prefix. Message counts are persisted by
+    the write-behind message batches; this class checkpoints what only it knows about,
+    accumulated active (logged-in) time and last activity, every LEADERBOARD_CHECKPOINT_INTERVAL.
+    A shared leaderboard (several server processes on one database) also merges in the other
+    processes' progress from the database at each checkpoint.
+    """
+
+    def __init__(self, db, checkpoint_interval=LEADERBOARD_CHECKPOINT_INTERVAL, shared=False):
+        self.db = db
+        self.checkpoint_interval = checkpoint_interval
+        self.shared = shared
+        self.lock = threading.Lock()
+        self.entries = {} # {user_id: {'username', 'message_count', 'last_active', 'active_seconds'}}
+        self.ranking = RankIndex() # Sorted rank keys
+        self.sessions = {} # {user_id: [open_connections, monotonic time active time was last credited]}
+        self.dirty = {} # {user_id: active seconds not yet checkpointed}
+        self.fractions = {} # {user_id: part of a second left over from the last checkpoint}, added to the next one
+        self.load()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._checkpoint_loop, name='leaderboard', daemon=True)
+        self.thread.start()
+
+    @staticmethod
+    def _rank_key(user_id, entry):
+        return (-entry['message_count'], -entry['last_active'].timestamp(), user_id)
+
+    def load(self):
+        with self.lock:
+            self.entries = {}
+            for user_id, username, message_count, last_active, active_seconds in self.db.load_leaderboard():
+                self.entries[user_id] = {
+                    'username': username,
+                    'message_count': message_count,
+                    'last_active': last_active,
+                    'active_seconds': active_seconds
+                }
+            self.ranking = RankIndex(self._rank_key(user_id, entry) for user_id, entry in self.entries.items())
+        log.info("Leaderboard loaded with %s users.", len(self.entries))
+
+    def _update(self, user_id, username, message_delta, when):
+        # Caller holds self.lock. Re-positions the user's key in the ranking.
+        entry = self.entries.get(user_id)
+        if entry is None:
+            entry = {'username': username, 'message_count': 0, 'last_active': when, 'active_seconds': 0}
+            self.entries[user_id] = entry
+        else:
+            self.ranking.remove(self._rank_key(user_id, entry))
+        entry['message_count'] += message_delta
+        entry['last_active'] = max(entry['last_active'], when)
+        self.ranking.add(self._rank_key(user_id, entry))
+        if not message_delta:
+            self._mark_dirty(user_id, 0) # last_active changed outside a message batch; checkpoint it
+
+    def record_message(self, user_id, username, when):
+        with self.lock:
+            self._update(user_id, username, 1, when)
+
+    def touch(self, user_id, username):
+        """Marks the user as active now (e.g. on joining a room)."""
+        with self.lock:
+            self._update(user_id, username, 0, datetime.datetime.now())
+
+    def session_started(self, user_id, username):
+        with self.lock:
+            self._update(user_id, username, 0, datetime.datetime.now())
+            session = self.sessions.get(user_id)
+            if session:
+                session[0] += 1
+            else:
+                self.sessions[user_id] = [1, time.monotonic()]
+
+    def session_ended(self, user_id):
+        with self.lock:
+            session = self.sessions.get(user_id)
+            if not session:
+                return
+            self._credit_active_time(user_id, session, time.monotonic())
+            session[0] -= 1
+            if session[0] <= 0:
+                del self.sessions[user_id]
+
+    def _credit_active_time(self, user_id, session, now):
+        # Caller holds self.lock
+        elapsed = now - session[1]
+        session[1] = now
+        entry = self.entries.get(user_id)
+        if entry is not None and elapsed > 0:
+            entry['active_seconds'] += elapsed
+            self._mark_dirty(user_id, elapsed)
+
+    def _mark_dirty(self, user_id, seconds):
+        # Caller holds self.lock
+        self.dirty[user_id] = self.dirty.get(user_id, 0) + self.fractions.pop(user_id, 0) + seconds
+
+    def _public_entry(self, user_id, rank):
+        entry = self.entries[user_id]
+        return {
+            "rank": rank,
+            "username": entry['username'],
+            "message_count": entry['message_count'],
+            "last_active": entry['last_active'].isoformat(),
+            "active_seconds": int(entry['active_seconds'])
+        }
+
+    def top(self, limit=10):
+        with self.lock:
+            return [self._public_entry(key[2], rank) for rank, key in enumerate(self.ranking.first(limit), start=1)]
+
+    def rank_of(self, user_id):
+        with self.lock:
+            entry = self.entries.get(user_id)
+            if entry is None:
+                return None
+            rank = self.ranking.index(self._rank_key(user_id, entry)) + 1
+            return self._public_entry(user_id, rank)
+
+    def checkpoint(self):
+        """Persists accumulated active time and last activity for users that changed since the last checkpoint."""
+        with self.lock:
+            now = time.monotonic()
+            for user_id, session in self.sessions.items():
+                self._credit_active_time(user_id, session, now) # Bank time for users still online
+            pending = []
+            for user_id, seconds in self.dirty.items():
+                whole = int(seconds) # Only whole seconds are stored; the rest waits for the next checkpoint
+                if seconds > whole:
+                    self.fractions[user_id] = seconds - whole
+                pending.append((user_id, whole, self.entries[user_id]['last_active']))
+            self.dirty = {}
+        if pending and not self.db.checkpoint_leaderboard(pending):
+            with self.lock: # Keep the deltas for the next attempt
+                for user_id, seconds, _ in pending:
+                    self._mark_dirty(user_id, seconds)
+
+    def merge_from_db(self):
+        """Moves entries forward to the persisted totals where other processes got ahead of this one."""
+        rows = self.db.load_leaderboard()
+        with self.lock:
+            for user_id, username, message_count, last_active, active_seconds in rows:
+                entry = self.entries.get(user_id)
+                if entry is None:
+                    self._update(user_id, username, message_count, last_active)
+                elif message_count > entry['message_count'] or last_active > entry['last_active']:
+                    self._update(user_id, username, max(0, message_count - entry['message_count']), last_active)
+                entry = self.entries[user_id]
+                entry['active_seconds'] = max(entry['active_seconds'], active_seconds)
+
+    def _checkpoint_loop(self):
+        while not self.stopped.wait(self.checkpoint_interval):
+            try:
+                self.checkpoint()
+                if self.shared:
+                    self.merge_from_db()
+            except Exception as e:
+                log.error("Error checkpointing leaderboard: %s", e)
+
+    def close(self):
+        self.stopped.set()
+        self.checkpoint()
@@ -0,0 +1,134 @@
+# server/src/logs.py
+"""Structured logging that never blocks the threads serving clients.
+
+Loggers hand records to a bounded in-process queue; one listener thread formats them (JSON
+lines by default) and writes them to stdout. When the queue is full a record is dropped and
+counted instead of making the caller wait. Chatty events carry an event name
+(extra={'event': 'room_joined', ...}) so LOG_SAMPLING can keep only one in N of them.
+"""
+import atexit
+import itertools
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import time
+
+from metrics import METRICS
+
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO') # Level for every module not listed in LOG_LEVELS
+LOG_LEVELS = os.getenv('LOG_LEVELS', '') # 'module=LEVEL' pairs, e.g. 'bus=DEBUG,database=WARNING'
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'json') # 'json' (one object per line) or 'text'
+LOG_SAMPLING = os.getenv('LOG_SAMPLING', 'room_joined=10,room_left=10,send_failed=100') # 'event=N' keeps 1 in N records of that event
+LOG_QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', 10000)) # Records waiting to be written before new ones are dropped
+
+TEXT_FORMAT = '%(asctime)s %(levelname)s %(name)s: %(message)s'
+
+DROPPED_RECORDS = METRICS.counter('chat_log_records_dropped_total', 'Log records dropped because the log queue was full')
+SAMPLED_OUT = METRICS.counter('chat_log_records_sampled_out_total', 'Log records skipped by LOG_SAMPLING', ['event'])
+
+_STANDARD_ATTRIBUTES = set(vars(logging.makeLogRecord({}))) | {'message', 'asctime'} # Everything else came in through extra=
+
+
+def parse_pairs(text):
+    """'a=1,b=2' -> {'a': '1', 'b': '2'}"""
+    pairs = {}
+    for item in text.split(','):
+        if item.strip():
+            name, _, value = item.partition('=')
+            pairs[name.strip()] = value.strip()
+    return pairs
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record: time, level, logger and message, plus any extra= fields."""
+
+    def format(self, record):
+        entry = {
+            "time": time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(record.created)) + f".{int(record.msecs):03d}Z",
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _STANDARD_ATTRIBUTES:
+                entry[key] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class EventSampler(logging.Filter):
+    """Passes one in every rates[event] records of each sampled event; others pass untouched."""
+
+    def __init__(self, rates):
+        super().__init__()
+        self.rates = rates # {event: N}
+        self.counters = {event: itertools.count() for event in rates}
+
+    def filter(self, record):
+        counter = self.counters.get(getattr(record, 'event', None))
+        if counter is None:
+            return True
+        rate = self.rates[record.event]
+        if next(counter) % rate:
+            SAMPLED_OUT.labels(record.event).inc()
+            return False
+        record.sample_rate = rate # Lets whoever reads the logs scale counts back up
+        return True
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            DROPPED_RECORDS.inc()
+
+    def prepare(self, record):
+        # The queue stays in this process, so the record needs no pickling; only merge the arguments
+        # now, since they may change before the listener thread formats the record
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+class _Listener(logging.handlers.QueueListener):
+    def enqueue_sentinel(self):
+        self.queue.put(self._sentinel) # Wait for room rather than lose the stop signal when the queue is full
+
+
+_listener = None
+
+
+def setup_logging(level=LOG_LEVEL, levels=LOG_LEVELS, log_format=LOG_FORMAT, sampling=LOG_SAMPLING,
+                  queue_size=LOG_QUEUE_SIZE, stream=None):
+    """Routes every logger through the queue to stdout. Call once per process; later calls do nothing."""
+    global _listener
+    if _listener is not None:
+        return
+    output = logging.StreamHandler(stream or sys.stdout)
+    output.setFormatter(JsonFormatter() if log_format == 'json' else logging.Formatter(TEXT_FORMAT))
+    records = queue.Queue(queue_size)
+    handler = NonBlockingQueueHandler(records)
+    handler.addFilter(EventSampler({event: max(1, int(rate)) for event, rate in parse_pairs(sampling).items()}))
+
+    root = logging.getLogger()
+    root.handlers[:] = [handler]
+    root.setLevel(level.upper())
+    for name, module_level in parse_pairs(levels).items():
+        logging.getLogger(name).setLevel(module_level.upper())
+
+    _listener = _Listener(records, output)
+    _listener.start()
+    atexit.register(stop_logging)
+
+
+def stop_logging():
+    """Writes out every queued record and stops the listener thread."""
+    global _listener
+    if _listener is not None:
+        listener, _listener = _listener, None
+        listener.stop()
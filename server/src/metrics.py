@@ -0,0 +1,296 @@
+# server/src/metrics.py
+"""In-process metrics (counters, gauges, histograms) rendered in the Prometheus text format.
+
+Modules declare their metrics at import time on the shared METRICS registry, the same way they
+read their configuration constants. Recording is a lock-protected increment, or a bisect plus
+an increment for histograms, so instrumentation can stay on in production. Values that already
+live elsewhere (queue lengths, connection counts) are registered as callbacks and read only
+when the metrics are scraped.
+"""
+import bisect
+import http.server
+import logging
+import os
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1') # Interface for the /metrics endpoint; local only by default
+METRICS_PORT = int(os.getenv('METRICS_PORT', 0)) # Port of the /metrics endpoint; 0 (the default) disables it
+
+# Seconds, from 100 microseconds to 10 seconds
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SIZE_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class _CounterChild:
+    __slots__ = ('value', 'lock')
+
+    def __init__(self):
+        self.value = 0
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+
+class _GaugeChild(_CounterChild):
+    __slots__ = ()
+
+    def set(self, value):
+        self.value = value
+
+    def dec(self, amount=1):
+        self.inc(-amount)
+
+
+class _HistogramChild:
+    __slots__ = ('buckets', 'counts', 'sum', 'lock')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1) # Per bucket, not cumulative; the last one is +Inf
+        self.sum = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    def time(self):
+        return _Timer(self)
+
+    def snapshot(self):
+        with self.lock:
+            return list(self.counts), self.sum
+
+
+class _Timer:
+    """Context manager that observes the elapsed time of its block."""
+    __slots__ = ('child', 'started')
+
+    def __init__(self, child):
+        self.child = child
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.child.observe(time.perf_counter() - self.started)
+
+
+class Metric:
+    """A named metric with optional labels; labels(...) returns the child that records values."""
+
+    def __init__(self, kind, name, help_text, label_names=(), new_child=None):
+        self.kind = kind
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(label_names)
+        self.new_child = new_child
+        self.children = {} # {label values: child}
+        self.lock = threading.Lock()
+        if not self.label_names:
+            self._default = self.labels()
+
+    def labels(self, *values):
+        child = self.children.get(values)
+        if child is None:
+            with self.lock:
+                child = self.children.setdefault(values, self.new_child())
+        return child
+
+    # Shortcuts for metrics without labels
+    def inc(self, amount=1):
+        self._default.inc(amount)
+
+    def set(self, value):
+        self._default.set(value)
+
+    def observe(self, value):
+        self._default.observe(value)
+
+    def time(self):
+        return self._default.time()
+
+    def samples(self):
+        """Yields (suffix, label string, value) for every exposed series."""
+        for values, child in list(self.children.items()):
+            if self.kind != 'histogram':
+                yield '', _format_labels(self.label_names, values), child.value
+                continue
+            counts, total = child.snapshot()
+            cumulative = 0
+            for bound, count in zip(child.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else repr(float(bound))
+                yield '_bucket', _format_labels(self.label_names, values, f'le="{le}"'), cumulative
+            yield '_sum', _format_labels(self.label_names, values), total
+            yield '_count', _format_labels(self.label_names, values), cumulative
+
+    def summary(self):
+        """Plain values for admin_stats: a number per series, and count/sum/percentiles for histograms."""
+        result = {}
+        for values, child in list(self.children.items()):
+            key = ','.join(f"{name}={value}" for name, value in zip(self.label_names, values)) or 'value'
+            if self.kind != 'histogram':
+                result[key] = child.value
+                continue
+            counts, total = child.snapshot()
+            observed = sum(counts)
+            entry = {"count": observed, "sum": round(total, 6)}
+            for label, fraction in (("p50", 0.5), ("p90", 0.9), ("p99", 0.99)):
+                entry[label] = _bucket_quantile(child.buckets, counts, observed, fraction)
+            result[key] = entry
+        return result
+
+
+def _bucket_quantile(buckets, counts, observed, fraction):
+    # Upper bound of the bucket holding the quantile, as Prometheus' histogram_quantile would roughly report
+    if not observed:
+        return None
+    rank = fraction * observed
+    cumulative = 0
+    for bound, count in zip(buckets, counts):
+        cumulative += count
+        if cumulative >= rank:
+            return bound
+    return buckets[-1] # Beyond the largest bucket
+
+
+class CallbackMetric:
+    """A gauge or counter whose value is read from callback() at scrape time.
+
+    callback returns a number, or {label value or tuple of label values: number}.
+    """
+
+    def __init__(self, kind, name, help_text, callback, label_names=()):
+        self.kind = kind
+        self.name = name
+        self.help = help_text
+        self.callback = callback
+        self.label_names = tuple(label_names)
+
+    def _values(self):
+        try:
+            values = self.callback()
+        except Exception as e:
+            log.error("Error reading metric %s: %s", self.name, e)
+            return {}
+        if not isinstance(values, dict):
+            return {(): values}
+        return {key if isinstance(key, tuple) else (key,): value for key, value in values.items()}
+
+    def samples(self):
+        for values, value in self._values().items():
+            yield '', _format_labels(self.label_names, values), value
+
+    def summary(self):
+        return {','.join(f"{name}={value}" for name, value in zip(self.label_names, values)) or 'value': value
+                for values, value in self._values().items()}
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = {} # {name: Metric or CallbackMetric}
+        self.lock = threading.Lock()
+
+    def _register(self, metric):
+        with self.lock:
+            self.metrics[metric.name] = metric # Re-registering a name replaces the old metric
+        return metric
+
+    def counter(self, name, help_text, label_names=()):
+        return self._register(Metric('counter', name, help_text, label_names, _CounterChild))
+
+    def gauge(self, name, help_text, label_names=()):
+        return self._register(Metric('gauge', name, help_text, label_names, _GaugeChild))
+
+    def histogram(self, name, help_text, label_names=(), buckets=LATENCY_BUCKETS):
+        buckets = tuple(sorted(buckets))
+        return self._register(Metric('histogram', name, help_text, label_names, lambda: _HistogramChild(buckets)))
+
+    def callback(self, kind, name, help_text, callback, label_names=()):
+        return self._register(CallbackMetric(kind, name, help_text, callback, label_names))
+
+    def render(self):
+        """Returns every metric in the Prometheus text exposition format (version 0.0.4)."""
+        lines = []
+        for metric in sorted(self.metrics.values(), key=lambda m: m.name):
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for suffix, labels, value in metric.samples():
+                lines.append(f"{metric.name}{suffix}{labels} {value}")
+        return '\n'.join(lines) + '\n'
+
+    def summary(self):
+        return {name: metric.summary() for name, metric in sorted(self.metrics.items())}
+
+
+METRICS = Registry()
+
+
+class _MetricsHandler(http.server.BaseHTTPRequestHandler):
+    registry = METRICS
+
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/metrics', '/'):
+            self.send_error(404)
+            return
+        body = self.registry.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass # Scrapes every few seconds would drown the server log
+
+
+def start_http_server(host=None, port=None):
+    """Serves METRICS at http://host:port/metrics from a background thread. Returns the server, or None if disabled or the port is taken."""
+    host = host or METRICS_HOST
+    port = METRICS_PORT if port is None else port
+    if not port:
+        return None
+    try:
+        server = http.server.ThreadingHTTPServer((host, port), _MetricsHandler)
+    except OSError as e:
+        log.warning("Metrics endpoint disabled: cannot listen on %s:%s (%s).", host, port, e)
+        return None
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='metrics-http', daemon=True).start()
+    log.info("Metrics available at http://%s:%s/metrics", host, port)
+    return server
+
+
+def time_methods(obj, method_names, histogram):
+    """Replaces each named method on obj with a wrapper that observes its duration, labelled by method name."""
+    for name in method_names:
+        method = getattr(obj, name)
+        child = histogram.labels(name)
+
+        def timed(*args, _method=method, _child=child, **kwargs):
+            started = time.perf_counter()
+            try:
+                return _method(*args, **kwargs)
+            finally:
+                _child.observe(time.perf_counter() - started)
+        setattr(obj, name, timed)
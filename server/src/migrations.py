@@ -0,0 +1,137 @@
+# server/src/migrations.py
+"""Versioned schema migrations, applied in order at startup and tracked in schema_version.
+
+Never edit a migration that has shipped; append a new one instead. Every statement must be
+safe to run against a database created before migrations existed (hence IF NOT EXISTS).
+"""
+
+MIGRATION_LOCK_ID = 7427101 # pg_advisory_xact_lock key so concurrent servers migrate one at a time
+
+MIGRATIONS = [
+    (1, "Base schema", [
+        # Users table
+        """
+        CREATE TABLE IF NOT EXISTS users (
+            id SERIAL PRIMARY KEY,
+            username VARCHAR(50) UNIQUE NOT NULL,
+            password_hash VARCHAR(128) NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+        """,
+        # Rooms table
+        """
+        CREATE TABLE IF NOT EXISTS rooms (
+            id SERIAL PRIMARY KEY,
+            name VARCHAR(50) UNIQUE NOT NULL,
+            is_private BOOLEAN DEFAULT FALSE,
+            created_by_user_id INTEGER REFERENCES users(id),
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+        """,
+        # Messages table
+        """
+        CREATE TABLE IF NOT EXISTS messages (
+            id SERIAL PRIMARY KEY,
+            room_id INTEGER REFERENCES rooms(id),
+            user_id INTEGER REFERENCES users(id),
+            content TEXT NOT NULL,
+            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+        """,
+        # Leaderboard table (for message counts and active time)
+        """
+        CREATE TABLE IF NOT EXISTS leaderboard (
+            user_id INTEGER UNIQUE REFERENCES users(id),
+            message_count INTEGER DEFAULT 0,
+            last_active TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (user_id)
+        );
+        """,
+    ]),
+    (2, "Room message counters", [
+        """
+        CREATE TABLE IF NOT EXISTS room_counters (
+            room_id INTEGER PRIMARY KEY REFERENCES rooms(id),
+            message_count BIGINT NOT NULL DEFAULT 0
+        );
+        """,
+        # One-off backfill for rooms that predate the counters table
+        """
+        INSERT INTO room_counters (room_id, message_count)
+        SELECT r.id, (SELECT COUNT(*) FROM messages m WHERE m.room_id = r.id)
+        FROM rooms r
+        WHERE NOT EXISTS (SELECT 1 FROM room_counters c WHERE c.room_id = r.id);
+        """,
+    ]),
+    (3, "Indexes for room history and leaderboard ranking", [
+        # get_message_history: WHERE room_id = ? ORDER BY timestamp DESC, id DESC LIMIT n
+        "CREATE INDEX IF NOT EXISTS idx_messages_room_timestamp ON messages (room_id, timestamp DESC, id DESC);",
+        # get_leaderboard: ORDER BY message_count DESC, last_active DESC LIMIT n, served by an index-only scan
+        "CREATE INDEX IF NOT EXISTS idx_leaderboard_rank ON leaderboard (message_count DESC, last_active DESC) INCLUDE (user_id);",
+    ]),
+    (4, "Leaderboard active time", [
+        "ALTER TABLE leaderboard ADD COLUMN IF NOT EXISTS active_seconds BIGINT NOT NULL DEFAULT 0;",
+    ]),
+    (5, "Room for salted password hashes", [
+        # PBKDF2 hashes carry their algorithm, work factor and salt; legacy sha256 rows are re-hashed on login
+        "ALTER TABLE users ALTER COLUMN password_hash TYPE TEXT;",
+    ]),
+    (6, "Full-text search on message content", [
+        # A stored generated column is filled in by Postgres on every insert. Adding it rewrites the table once
+        "ALTER TABLE messages ADD COLUMN IF NOT EXISTS search_vector tsvector GENERATED ALWAYS AS (to_tsvector('english', content)) STORED;",
+        "CREATE INDEX IF NOT EXISTS idx_messages_search ON messages USING GIN (search_vector);",
+        # Lets a global search for a common word read messages newest first and stop at the cap instead of ranking every match
+        "CREATE INDEX IF NOT EXISTS idx_messages_timestamp ON messages (timestamp DESC, id DESC);",
+    ]),
+    (7, "Session token revocation", [
+        # Stamped into every session token; logout bumps it, which revokes the tokens issued before
+        "ALTER TABLE users ADD COLUMN IF NOT EXISTS session_generation INTEGER NOT NULL DEFAULT 0;",
+    ]),
+    (8, "Presence shared by every server process", [
+        # Server processes heartbeat into server_nodes; a user's presence counts only while its process is alive
+        "CREATE TABLE IF NOT EXISTS server_nodes (node_id TEXT PRIMARY KEY, last_seen TIMESTAMP NOT NULL DEFAULT NOW());",
+        "CREATE TABLE IF NOT EXISTS presence (user_id INTEGER PRIMARY KEY, node_id TEXT NOT NULL);",
+        "CREATE INDEX IF NOT EXISTS idx_presence_node ON presence (node_id);",
+    ]),
+    (9, "Room membership shared by every server process", [
+        "ALTER TABLE presence ADD COLUMN IF NOT EXISTS room_id INTEGER;",
+        "CREATE INDEX IF NOT EXISTS idx_presence_room ON presence (room_id);",
+    ]),
+    (10, "Server settings", [
+        # Values every server process must agree on, such as the key that signs session tokens
+        "CREATE TABLE IF NOT EXISTS server_settings (name TEXT PRIMARY KEY, value TEXT NOT NULL);",
+    ]),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def apply_migrations(cursor, target_version=LATEST_VERSION):
+    """Applies every migration newer than the recorded schema version, up to target_version.
+
+    Runs inside the caller's transaction, so a failing migration leaves the schema untouched.
+    Returns the list of versions that were applied.
+    """
+    cursor.execute("SELECT pg_advisory_xact_lock(%s);", (MIGRATION_LOCK_ID,))
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            description TEXT NOT NULL,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+    """)
+    cursor.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version;")
+    current_version = cursor.fetchone()[0]
+
+    applied = []
+    for version, description, statements in MIGRATIONS:
+        if version <= current_version or version > target_version:
+            continue
+        for statement in statements:
+            cursor.execute(statement)
+        cursor.execute(
+            "INSERT INTO schema_version (version, description) VALUES (%s, %s);",
+            (version, description)
+        )
+        applied.append(version)
+    return applied
@@ -0,0 +1,186 @@
+# server/src/outbound.py
+import collections
+import logging
+import os
+import socket
+import threading
+
+from protocol import JSON_CODEC
+
+log = logging.getLogger(__name__)
+
+OUTBOUND_QUEUE_SIZE = int(os.getenv('OUTBOUND_QUEUE_SIZE', 256)) # Frames buffered per client before the slow-consumer policy applies
+OUTBOUND_MAX_BYTES = int(os.getenv('OUTBOUND_MAX_BYTES', 1024 * 1024)) # Hard cap on bytes buffered per client
+SLOW_CONSUMER_POLICY = os.getenv('SLOW_CONSUMER_POLICY', 'drop_oldest') # 'drop_oldest', 'disconnect' or 'coalesce'
+SLOW_CONSUMER_POLICIES = ('drop_oldest', 'disconnect', 'coalesce')
+FLUSH_ON_CLOSE_TIMEOUT = 2 # Seconds a closing connection gets to flush its final frames
+
+
+class OutboundQueue:
+    """Bounded queue of pre-encoded frames waiting to be written to one client.
+
+    put() never blocks. When the queue is full the slow-consumer policy decides what happens:
+      drop_oldest - discard the oldest queued frame to make room
+      disconnect  - close the queue; the owner disconnects the client
+      coalesce    - merge queued frames into a single write, up to max_bytes
+    Exceeding max_bytes always closes the queue.
+    """
+
+    def __init__(self, max_frames=OUTBOUND_QUEUE_SIZE, max_bytes=OUTBOUND_MAX_BYTES, policy=SLOW_CONSUMER_POLICY):
+        if policy not in SLOW_CONSUMER_POLICIES:
+            log.warning("Unknown slow-consumer policy '%s', using 'drop_oldest'.", policy)
+            policy = 'drop_oldest'
+        self.max_frames = max_frames
+        self.max_bytes = max_bytes
+        self.policy = policy
+        self.lock = threading.Lock()
+        self.frames = collections.deque()
+        self.queued_bytes = 0
+        self.dropped_frames = 0
+        self.closed = False
+
+    def put(self, frame):
+        """Queues a frame. Returns False if the client has been cut off and should be disconnected."""
+        with self.lock:
+            if self.closed:
+                return False
+            if len(self.frames) >= self.max_frames:
+                if self.policy == 'drop_oldest':
+                    self.queued_bytes -= len(self.frames.popleft())
+                    self.dropped_frames += 1
+                elif self.policy == 'coalesce':
+                    merged = b''.join(self.frames)
+                    self.frames.clear()
+                    self.frames.append(merged)
+                else:
+                    self._close_locked()
+                    return False
+            if self.queued_bytes + len(frame) > self.max_bytes:
+                self._close_locked()
+                return False
+            self.frames.append(frame)
+            self.queued_bytes += len(frame)
+            return True
+
+    def take_all(self):
+        """Removes and returns everything queued so far as a single bytes object."""
+        with self.lock:
+            if not self.frames:
+                return b''
+            data = b''.join(self.frames)
+            self.frames.clear()
+            self.queued_bytes = 0
+            return data
+
+    def close(self):
+        with self.lock:
+            self._close_locked()
+
+    def _close_locked(self):
+        self.closed = True
+        self.frames.clear()
+        self.queued_bytes = 0
+
+    def __len__(self):
+        return len(self.frames)
+
+
+class ClientConnection:
+    """A client socket whose writes go through an OutboundQueue drained by a dedicated writer thread.
+
+    Exposes the socket methods the server uses (recv, sendall, shutdown, close), so callers that
+    used to write to the raw socket now just enqueue and return immediately.
+    """
+
+    def __init__(self, client_socket):
+        self.socket = client_socket
+        self.codec = JSON_CODEC # Switched when the client negotiates another protocol
+        self.queue = OutboundQueue()
+        self.ready = threading.Condition()
+        self.closing = False
+        self.writer_thread = threading.Thread(target=self._drain, daemon=True)
+        self.writer_thread.start()
+
+    def recv(self, size):
+        return self.socket.recv(size)
+
+    def recv_into(self, buffer):
+        return self.socket.recv_into(buffer)
+
+    def send(self, frame):
+        """Enqueues a pre-encoded frame. Returns False if the client is gone or was cut off as too slow."""
+        if self.closing:
+            return False
+        if not self.queue.put(frame):
+            self._abort()
+            return False
+        with self.ready:
+            self.ready.notify()
+        return True
+
+    def sendall(self, data):
+        if not self.send(data):
+            raise ConnectionResetError("Client connection is closed.")
+
+    def _drain(self):
+        while True:
+            with self.ready:
+                while not len(self.queue) and not self.closing and not self.queue.closed:
+                    self.ready.wait()
+            data = self.queue.take_all()
+            if data:
+                try:
+                    self.socket.sendall(data)
+                except OSError:
+                    self._abort()
+                    return
+            elif self.closing or self.queue.closed:
+                return
+
+    def _abort(self):
+        # Cut the client off without flushing; the reader notices the dead socket and cleans up.
+        self.queue.close()
+        with self.ready:
+            self.ready.notify()
+        try:
+            self.socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    def shutdown(self, how=socket.SHUT_RDWR):
+        # Let the writer flush what is already queued (e.g. a logout reply) before the socket goes away.
+        self.closing = True
+        with self.ready:
+            self.ready.notify()
+        if threading.current_thread() is not self.writer_thread:
+            self.writer_thread.join(FLUSH_ON_CLOSE_TIMEOUT)
+        self.queue.close()
+        self.socket.shutdown(how)
+
+    def close(self):
+        self.closing = True
+        self.queue.close()
+        with self.ready:
+            self.ready.notify()
+        self.socket.close()
+
+
+def fan_out(recipients, message_data, exclude_user_id=None):
+    """Enqueues one event for every (user_id, connection) in recipients.
+
+    The event is encoded once per protocol in use and the same immutable bytes object is
+    handed to every recipient's queue, so the per-recipient cost is an enqueue, not an encode.
+    Returns the user ids whose connections were closed or cut off as too slow.
+    """
+    frames = {} # {codec name: encoded frame}
+    failed = []
+    for user_id, connection in recipients:
+        if user_id == exclude_user_id:
+            continue
+        codec = connection.codec
+        frame = frames.get(codec.name)
+        if frame is None:
+            frame = frames[codec.name] = codec.encode(message_data)
+        if not connection.send(frame):
+            failed.append(user_id)
+    return failed
@@ -0,0 +1,85 @@
+# server/src/passwords.py
+import hashlib
+import hmac
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+PASSWORD_HASH_ITERATIONS = int(os.getenv('PASSWORD_HASH_ITERATIONS', 310000)) # PBKDF2-SHA256 work factor for new hashes
+AUTH_HASH_WORKERS = int(os.getenv('AUTH_HASH_WORKERS', os.cpu_count() or 2)) # Hashes computed in parallel
+AUTH_MAX_PENDING = int(os.getenv('AUTH_MAX_PENDING', 256)) # Hash requests queued or running before new ones are refused
+AUTH_HASH_TIMEOUT = 30 # Seconds a request waits for its hash before giving up
+SALT_BYTES = 16
+ALGORITHM = 'pbkdf2_sha256'
+
+
+class HasherBusy(Exception):
+    """Raised when too many password hashes are already queued."""
+
+
+def hash_password(password, iterations=PASSWORD_HASH_ITERATIONS):
+    """Returns 'pbkdf2_sha256$<iterations>$<salt hex>$<hash hex>'."""
+    salt = os.urandom(SALT_BYTES)
+    digest = hashlib.pbkdf2_hmac('sha256', password.encode(), salt, iterations)
+    return f"{ALGORITHM}${iterations}${salt.hex()}${digest.hex()}"
+
+
+def check_password(password, stored_hash, iterations=PASSWORD_HASH_ITERATIONS):
+    """Returns (matches, needs_rehash).
+
+    Accepts the current PBKDF2 format and legacy unsalted sha256 hex digests. A matching
+    legacy hash, or one made with fewer iterations than configured, should be re-hashed.
+    """
+    if '$' not in stored_hash: # Legacy: hashlib.sha256(password).hexdigest()
+        candidate = hashlib.sha256(password.encode()).hexdigest()
+        matches = hmac.compare_digest(candidate, stored_hash)
+        return matches, matches
+    try:
+        algorithm, rounds, salt, expected = stored_hash.split('$')
+        rounds = int(rounds)
+        salt = bytes.fromhex(salt)
+    except ValueError:
+        return False, False
+    if algorithm != ALGORITHM:
+        return False, False
+    digest = hashlib.pbkdf2_hmac('sha256', password.encode(), salt, rounds).hex()
+    matches = hmac.compare_digest(digest, expected)
+    return matches, matches and rounds < iterations
+
+
+class PasswordHasher:
+    """Runs password hashing on a bounded pool of threads.
+
+    PBKDF2 in hashlib releases the GIL, so AUTH_HASH_WORKERS threads hash in parallel while
+    the rest of the server keeps running. At most AUTH_MAX_PENDING hashes may be queued or
+    running; beyond that hash() and verify() raise HasherBusy straight away, so a login
+    storm is refused early instead of queueing without bound.
+    """
+
+    def __init__(self, workers=AUTH_HASH_WORKERS, max_pending=AUTH_MAX_PENDING, iterations=PASSWORD_HASH_ITERATIONS):
+        self.iterations = iterations
+        # Verified in place of a missing user's hash, so an unknown username costs the same PBKDF2 work
+        self.dummy_hash = f"{ALGORITHM}${iterations}${'00' * SALT_BYTES}${'00' * hashlib.sha256().digest_size}"
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='password-hash')
+        self.slots = threading.BoundedSemaphore(max_pending)
+
+    def _run(self, function, *args):
+        if not self.slots.acquire(blocking=False):
+            raise HasherBusy("Too many logins in progress, please try again.")
+        try:
+            future = self.executor.submit(function, *args)
+        except Exception:
+            self.slots.release()
+            raise
+        future.add_done_callback(lambda _: self.slots.release())
+        return future.result(AUTH_HASH_TIMEOUT)
+
+    def hash(self, password):
+        return self._run(hash_password, password, self.iterations)
+
+    def verify(self, password, stored_hash):
+        """Returns (matches, needs_rehash); see check_password."""
+        return self._run(check_password, password, stored_hash, self.iterations)
+
+    def close(self):
+        self.executor.shutdown(wait=False)
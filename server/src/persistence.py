@@ -0,0 +1,170 @@
+# server/src/persistence.py
+import collections
+import json
+import logging
+import os
+import threading
+import time
+
+from storage import MessagesRejected
+
+log = logging.getLogger(__name__)
+
+PERSIST_BATCH_SIZE = int(os.getenv('PERSIST_BATCH_SIZE', 500)) # Flush as soon as this many messages are buffered...
+PERSIST_FLUSH_INTERVAL = float(os.getenv('PERSIST_FLUSH_INTERVAL', 0.2)) # ...or when the oldest one has waited this long (seconds)
+PERSIST_MAX_QUEUE = int(os.getenv('PERSIST_MAX_QUEUE', 100000)) # Senders block once this many messages are waiting
+PERSIST_RETRY_DELAY = 1.0 # Seconds to back off after a failed flush
+PERSIST_MAX_RETRIES = int(os.getenv('PERSIST_MAX_RETRIES', 60)) # Failed attempts at one batch before it is moved to the dead-letter file
+PERSIST_DEAD_LETTER_PATH = os.getenv('PERSIST_DEAD_LETTER_PATH', 'unsaved_messages.jsonl') # Messages that could not be written, one JSON object per line
+
+
+MESSAGE_ID_BLOCK_SIZE = 1000 # Message ids reserved from the database per round trip
+
+
+class MessageIdAllocator:
+    """Hands out message ids from blocks reserved in advance from the messages id sequence.
+
+    Ids exist before the row is written, so a broadcast frame can carry the id of a message
+    that is still waiting in the write-behind queue. Ids are unique across servers sharing
+    the database; ids skipped when a server restarts are simply never used.
+    """
+
+    def __init__(self, db, block_size=MESSAGE_ID_BLOCK_SIZE):
+        self.db = db
+        self.block_size = block_size
+        self.lock = threading.Lock()
+        self.available = collections.deque()
+
+    def next_id(self):
+        with self.lock:
+            if not self.available:
+                self.available.extend(self.db.reserve_message_ids(self.block_size))
+            return self.available.popleft()
+
+
+class MessageWriter:
+    """Write-behind buffer that persists chat messages in batches off the request path.
+
+    submit() only appends to an in-memory queue. A background thread hands batches to
+    Database.save_messages_batch, which writes them and the matching leaderboard
+    increments in a single transaction. A batch that failed for a transient reason stays
+    queued and is retried, up to max_retries times. A batch the database rejects is split
+    in halves until the offending messages are isolated. Messages that cannot be written
+    either way go to the dead-letter file, so one bad row never holds up the queue behind it.
+    close() flushes everything that is still buffered.
+    """
+
+    def __init__(self, db, batch_size=PERSIST_BATCH_SIZE, flush_interval=PERSIST_FLUSH_INTERVAL, max_queue=PERSIST_MAX_QUEUE,
+                 max_retries=PERSIST_MAX_RETRIES, dead_letter_path=PERSIST_DEAD_LETTER_PATH):
+        self.db = db
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_queue = max_queue
+        self.max_retries = max_retries
+        self.dead_letter_path = dead_letter_path
+        self.pending = collections.deque() # (message_id, room_id, user_id, content, timestamp)
+        self.condition = threading.Condition()
+        self.running = True
+        self.stats = {'submitted': 0, 'persisted': 0, 'batches': 0, 'failed_flushes': 0, 'dead_lettered': 0}
+        self.thread = threading.Thread(target=self._run, name='message-writer', daemon=True)
+        self.thread.start()
+
+    def submit(self, message_id, room_id, user_id, content, timestamp):
+        with self.condition:
+            while len(self.pending) >= self.max_queue and self.running:
+                self.condition.wait() # Backpressure: the database is falling behind
+            self.pending.append((message_id, room_id, user_id, content, timestamp))
+            self.stats['submitted'] += 1
+            if len(self.pending) >= self.batch_size:
+                self.condition.notify_all()
+
+    def queue_depth(self):
+        return len(self.pending)
+
+    def pending_counts_by_room(self):
+        """Returns {room_id: messages still buffered} for reconciling in-memory counters."""
+        counts = {}
+        with self.condition:
+            for _, room_id, _, _, _ in self.pending:
+                counts[room_id] = counts.get(room_id, 0) + 1
+        return counts
+
+    def pending_for_room(self, room_id):
+        """Returns the room's messages that are still buffered, in submission order."""
+        with self.condition:
+            return [message for message in self.pending if message[1] == room_id]
+
+    def _run(self):
+        attempts = 0 # Consecutive failed attempts at the batch at the head of the queue
+        while True:
+            with self.condition:
+                deadline = time.monotonic() + self.flush_interval
+                while self.running and len(self.pending) < self.batch_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self.condition.wait(remaining)
+                if not self.running and not self.pending:
+                    return
+                batch = [self.pending[i] for i in range(min(self.batch_size, len(self.pending)))]
+            if not batch:
+                continue
+
+            done = self._save(batch)
+            if done < len(batch):
+                self.stats['failed_flushes'] += 1
+                attempts += 1
+                if not self.running or attempts >= self.max_retries:
+                    # Set the rest aside rather than stall shutdown or every sender behind it
+                    unsaved = batch[done:] if self.running else list(self.pending)[done:]
+                    self._dead_letter(unsaved, "not written after %s attempts" % attempts)
+                    done += len(unsaved)
+                    attempts = 0
+            else:
+                attempts = 0
+            with self.condition:
+                for _ in range(done):
+                    self.pending.popleft()
+                self.condition.notify_all() # Wake senders blocked on a full queue
+            if done < len(batch):
+                time.sleep(PERSIST_RETRY_DELAY)
+
+    def _save(self, batch):
+        """Writes batch, halving it to isolate messages the database rejects.
+
+        Returns how many leading messages are finished with, written or dead-lettered; fewer
+        than len(batch) means a transient failure and the rest should be retried.
+        """
+        try:
+            if not self.db.save_messages_batch(batch):
+                return 0
+        except MessagesRejected as e:
+            if len(batch) == 1:
+                self._dead_letter(batch, str(e))
+                return 1
+            middle = len(batch) // 2
+            done = self._save(batch[:middle])
+            return done if done < middle else middle + self._save(batch[middle:])
+        self.stats['persisted'] += len(batch)
+        self.stats['batches'] += 1
+        return len(batch)
+
+    def _dead_letter(self, messages, reason):
+        self.stats['dead_lettered'] += len(messages)
+        log.error("Could not save %s messages (%s); writing them to %s.", len(messages), reason, self.dead_letter_path,
+                  extra={'event': 'messages_dead_lettered', 'message_ids': [m[0] for m in messages]})
+        try:
+            with open(self.dead_letter_path, 'a', encoding='utf-8') as f:
+                for message_id, room_id, user_id, content, timestamp in messages:
+                    f.write(json.dumps({"id": message_id, "room_id": room_id, "user_id": user_id, "content": content,
+                                        "timestamp": timestamp.isoformat(), "error": reason}) + '\n')
+        except OSError as e:
+            log.error("Cannot write the dead-letter file %s: %s; %s messages are lost.", self.dead_letter_path, e, len(messages))
+
+    def close(self):
+        """Stops accepting work and blocks until everything buffered has been written."""
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+        self.thread.join()
+        log.info("Message writer stopped (%s messages persisted in %s batches).", self.stats['persisted'], self.stats['batches'])
@@ -0,0 +1,94 @@
+# server/src/protocol.py
+import datetime
+import json
+import struct
+
+
+class RawJSON(str):
+    """A value that is already serialized JSON and is written into responses verbatim."""
+
+
+def encode_json_line(data):
+    """Encodes a response dict as a newline-terminated JSON frame.
+
+    Top-level values wrapped in RawJSON are spliced in as-is instead of being re-serialized,
+    so large cached payloads (e.g. room history snapshots) cost a string join, not a json.dumps.
+    """
+    raw_values = [(key, value) for key, value in data.items() if isinstance(value, RawJSON)]
+    if not raw_values:
+        return (json.dumps(data) + '\n').encode('utf-8')
+
+    body = json.dumps({key: value for key, value in data.items() if not isinstance(value, RawJSON)})
+    parts = [body[:-1]]
+    separator = ', ' if len(body) > 2 else ''
+    for key, value in raw_values:
+        parts.append(f"{separator}{json.dumps(key)}: {value}")
+        separator = ', '
+    parts.append('}\n')
+    return ''.join(parts).encode('utf-8')
+
+
+# Binary protocol ("binary-v1"), negotiated with a JSON {"command": "hello", "protocol": "binary-v1"}
+# line. After the server acknowledges, every frame in both directions is a 4-byte big-endian length
+# followed by that many bytes: a 1-byte frame type and its body.
+FRAME_HEADER = struct.Struct('>I')
+FRAME_CHAT_MESSAGE = 0x01 # server -> client: CHAT_MESSAGE_HEADER, sender, content
+FRAME_JSON = 0x02 # either direction: UTF-8 JSON document
+FRAME_SEND_MESSAGE = 0x03 # client -> server: UTF-8 message text for send_message
+CHAT_MESSAGE_HEADER = struct.Struct('>BqdHI') # type, message id (0 if none), timestamp as seconds from the epoch in UTC, sender length, content length
+CHAT_MESSAGE_FIELDS = frozenset(('type', 'id', 'sender', 'content', 'timestamp'))
+
+
+class ProtocolError(ValueError):
+    pass
+
+
+class JsonLineCodec:
+    """The original protocol: one JSON document per line."""
+    name = 'json'
+    length_prefixed = False
+
+    def encode(self, data):
+        return encode_json_line(data)
+
+    def decode_request(self, frame):
+        request = json.loads(frame)
+        if not isinstance(request, dict):
+            raise ProtocolError("Expected a JSON object.")
+        return request
+
+
+class BinaryCodec:
+    """Length-prefixed frames; chat messages use a fixed struct layout instead of JSON."""
+    name = 'binary-v1'
+    length_prefixed = True
+
+    def encode(self, data):
+        if data.get('type') == 'chat_message' and CHAT_MESSAGE_FIELDS.issuperset(data):
+            sender = data['sender'].encode('utf-8')
+            content = data['content'].encode('utf-8')
+            timestamp = datetime.datetime.fromisoformat(data['timestamp'])
+            if timestamp.tzinfo is None:
+                timestamp = timestamp.replace(tzinfo=datetime.timezone.utc) # Read the same on every client, whatever its zone
+            timestamp = timestamp.timestamp()
+            body = CHAT_MESSAGE_HEADER.pack(FRAME_CHAT_MESSAGE, data.get('id') or 0, timestamp, len(sender), len(content))
+            return FRAME_HEADER.pack(len(body) + len(sender) + len(content)) + body + sender + content
+        payload = encode_json_line(data)[:-1] # Same JSON body, without the line delimiter
+        return FRAME_HEADER.pack(len(payload) + 1) + bytes((FRAME_JSON,)) + payload
+
+    def decode_request(self, frame):
+        if not frame:
+            raise ProtocolError("Empty frame.")
+        frame_type = frame[0]
+        if frame_type == FRAME_SEND_MESSAGE:
+            return {"command": "send_message", "message": bytes(frame[1:]).decode('utf-8')}
+        if frame_type == FRAME_JSON:
+            request = json.loads(bytes(frame[1:]))
+            if not isinstance(request, dict):
+                raise ProtocolError("Expected a JSON object.")
+            return request
+        raise ProtocolError(f"Unknown frame type {frame_type}.")
+
+
+JSON_CODEC = JsonLineCodec()
+CODECS = {codec.name: codec for codec in (JSON_CODEC, BinaryCodec())}
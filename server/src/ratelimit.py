@@ -0,0 +1,136 @@
+# server/src/ratelimit.py
+import collections
+import os
+import threading
+import time
+
+from cache import LRUCache
+
+# '<class>=<rate per second>/<burst>' pairs; commands are grouped into classes by COMMAND_CLASSES
+RATE_LIMITS = os.getenv('RATE_LIMITS', 'message=5/10,room=2/5,query=5/20,auth=1/5')
+ROOM_MESSAGE_RATE = os.getenv('ROOM_MESSAGE_RATE', '50/100') # Messages per second (and burst) a whole room may send
+RATE_LIMIT_DISCONNECT_AFTER = int(os.getenv('RATE_LIMIT_DISCONNECT_AFTER', 100)) # Consecutive throttled requests before a client is dropped; 0 never drops
+RATE_LIMIT_TRACKED_USERS = 100000 # Users whose buckets are kept; the least recently active are forgotten first
+RATE_LIMIT_TRACKED_ROOMS = 10000 # Rooms whose message buckets are kept, likewise
+
+COMMAND_CLASSES = {
+    'send_message': 'message', 'dm': 'message',
+    'create_room': 'room', 'join_room': 'room', 'leave_room': 'room',
+    'register': 'auth', 'login': 'auth', 'resume': 'auth',
+} # Anything else (list_rooms, history, leaderboard, ...) is a 'query'
+
+
+def parse_rate(text):
+    """'5/10' -> (5.0, 10.0); a bare '5' uses the rate as the burst."""
+    rate, _, burst = text.partition('/')
+    return float(rate), float(burst or rate)
+
+
+def parse_limits(text):
+    limits = {}
+    for item in text.split(','):
+        if item.strip():
+            name, _, rate = item.partition('=')
+            limits[name.strip()] = parse_rate(rate)
+    return limits
+
+
+class TokenBucket:
+    """Allows bursts of up to burst requests, refilled at rate per second."""
+
+    __slots__ = ('rate', 'burst', 'tokens', 'updated')
+
+    def __init__(self, rate, burst, now):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = now
+
+    def take(self, now):
+        """Spends one token. Returns 0 if allowed, otherwise the seconds until a token is available."""
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate if self.rate > 0 else float('inf')
+
+
+class RateLimiter:
+    """Token-bucket flood control applied before a request is dispatched.
+
+    A logged-in user gets one bucket per command class, shared by all of the user's
+    connections, so opening more connections does not raise the allowance. Before login the
+    buckets live in the connection's session dict. Chat messages also draw from a bucket
+    shared by the whole room, which caps the broadcast and persistence load one room can
+    generate no matter how many members send at once. User and room buckets are kept in LRU
+    caches; a forgotten bucket has been idle long enough that it would be full again anyway.
+    A client that keeps sending after being throttled RATE_LIMIT_DISCONNECT_AFTER times in a
+    row is disconnected.
+    """
+
+    def __init__(self, limits=RATE_LIMITS, room_rate=ROOM_MESSAGE_RATE, disconnect_after=RATE_LIMIT_DISCONNECT_AFTER,
+                 max_users=RATE_LIMIT_TRACKED_USERS, max_rooms=RATE_LIMIT_TRACKED_ROOMS):
+        self.limits = parse_limits(limits)
+        self.room_rate = parse_rate(room_rate) if room_rate else None
+        self.disconnect_after = disconnect_after
+        self.users = LRUCache(max_users) # {user_id: {command class: TokenBucket}}
+        self.rooms = LRUCache(max_rooms) # {room_id: TokenBucket}
+        self.lock = threading.Lock() # Guards every bucket and the counters
+        self.allowed = collections.Counter() # {command class: requests let through}
+        self.throttled = collections.Counter() # {command class: requests refused}; 'room_messages' counts messages refused by a room's bucket
+        self.disconnects = 0
+
+    def check(self, session, command):
+        """Returns 0 if command may run now, otherwise the seconds the client should wait."""
+        command_class = COMMAND_CLASSES.get(command, 'query')
+        limit = self.limits.get(command_class)
+        if limit is None:
+            return 0 # No limit configured for this class
+        now = time.monotonic()
+        with self.lock:
+            buckets = self._user_buckets(session)
+            bucket = buckets.get(command_class)
+            if bucket is None:
+                bucket = buckets[command_class] = TokenBucket(limit[0], limit[1], now)
+            retry_after = bucket.take(now)
+            if not retry_after and command == 'send_message' and self.room_rate and session['current_room_id']:
+                retry_after = self._take_room(session['current_room_id'], now)
+                if retry_after:
+                    bucket.tokens += 1 # Refund: the user was within their own limit
+                    command_class = 'room_messages'
+            if retry_after:
+                self.throttled[command_class] += 1
+            else:
+                self.allowed[command_class] += 1
+        session['throttled_streak'] = session['throttled_streak'] + 1 if retry_after else 0
+        return retry_after
+
+    def _user_buckets(self, session):
+        # Caller holds self.lock
+        user_id = session['user_id']
+        if user_id is None:
+            return session['rate_limits']
+        buckets = self.users.get(user_id)
+        if buckets is None:
+            buckets = session['rate_limits'] # Carry over what the connection spent before logging in
+            self.users.put(user_id, buckets)
+        return buckets
+
+    def _take_room(self, room_id, now):
+        bucket = self.rooms.get(room_id)
+        if bucket is None:
+            bucket = TokenBucket(self.room_rate[0], self.room_rate[1], now)
+            self.rooms.put(room_id, bucket)
+        return bucket.take(now)
+
+    def should_disconnect(self, session):
+        if self.disconnect_after and session['throttled_streak'] >= self.disconnect_after:
+            with self.lock:
+                self.disconnects += 1
+            return True
+        return False
+
+    def summary(self):
+        throttled = ', '.join(f"{name} {count}" for name, count in sorted(self.throttled.items())) or 'none'
+        return f"{sum(self.allowed.values())} requests allowed, throttled: {throttled}, {self.disconnects} clients disconnected"
@@ -0,0 +1,73 @@
+# server/src/room_history.py
+import collections
+import json
+import os
+import threading
+
+from protocol import RawJSON
+
+ROOM_HISTORY_SIZE = int(os.getenv('ROOM_HISTORY_SIZE', 50)) # Recent messages kept in memory per room
+
+
+class RoomHistory:
+    """Ring buffer of a room's most recent chat messages with a cached JSON snapshot.
+
+    The buffer is warmed from the database the first time the room is touched, before any
+    new message is appended, so it always holds the newest messages in order. Joins reuse
+    the serialized snapshot until the next append invalidates it.
+    """
+
+    def __init__(self, size=ROOM_HISTORY_SIZE):
+        self.messages = collections.deque(maxlen=size)
+        self.lock = threading.Lock()
+        self.warmed = False
+        self._snapshot = None
+
+    def ensure_warm(self, load):
+        """Fills the buffer once using load(limit) -> [message, ...] (oldest first)."""
+        if self.warmed:
+            return
+        with self.lock:
+            if not self.warmed:
+                self.messages.extend(load(self.messages.maxlen))
+                self.warmed = True
+                self._snapshot = None
+
+    def append(self, message):
+        with self.lock:
+            if not self.warmed:
+                return # The warm-up load will include it once it is persisted
+            self.messages.append(message)
+            self._snapshot = None
+
+    def since(self, message_id):
+        """Returns the buffered messages after message_id, or None if it is not in the buffer.
+
+        Ids come from per-process blocks and are not ordered across servers, so this looks for
+        the message itself rather than comparing ids. since(None) returns the whole buffer.
+        """
+        with self.lock:
+            messages = list(self.messages)
+        if message_id is None:
+            return messages
+        for index in range(len(messages) - 1, -1, -1):
+            if messages[index].get('id') == message_id:
+                return messages[index + 1:]
+        return None
+
+    def reset(self):
+        """Forgets the buffered messages so the next ensure_warm() reloads them."""
+        with self.lock:
+            self.messages.clear()
+            self.warmed = False
+            self._snapshot = None
+
+    def snapshot(self):
+        """Returns the buffered messages as pre-serialized JSON, oldest first."""
+        snapshot = self._snapshot
+        if snapshot is None:
+            with self.lock:
+                if self._snapshot is None:
+                    self._snapshot = RawJSON(json.dumps(list(self.messages)))
+                snapshot = self._snapshot
+        return snapshot
@@ -4,249 +4,439 @@ import threading
 import json
 import os 
 import time
+import signal
+import logging
 
 from authentication import Authentication
 from chat_manager import ChatManager
-from database import Database
+from storage import open_storage, DB_BACKEND, StorageError, STORAGE_METHODS
+from outbound import ClientConnection
+from bus import PostgresNotifyBus, ROOM_BUS
+from protocol import CODECS, JSON_CODEC
+from framing import FrameReader, FrameTooLarge
+from ratelimit import RateLimiter
+from metrics import METRICS, start_http_server, time_methods
+from logs import setup_logging
 
+log = logging.getLogger('server') # Run as a script, __name__ is '__main__'
 
 # Server Configuration
 HOST = '0.0.0.0'  # Listen on all available interfaces
 PORT = 12345      # Port for the server to listen on
+SERVER_MODE = os.getenv('SERVER_MODE', 'threaded') # 'threaded' (one thread per client) or 'asyncio' (single event loop)
+LISTEN_BACKLOG = int(os.getenv('LISTEN_BACKLOG', 1024)) # Pending connections queued by the kernel before accept()
+SERVER_WORKERS = int(os.getenv('SERVER_WORKERS', 1)) # Worker processes sharing the port; more than 1 starts a supervisor
 
 # Database Configuration (These will be passed from environment variables in Docker Compose)
+# DB_BACKEND (storage.py) picks PostgreSQL or an embedded SQLite database; the settings below are for PostgreSQL
 DB_NAME = os.getenv('POSTGRES_DB', 'chat_db')
 DB_USER = os.getenv('POSTGRES_USER', 'chat_user')
 DB_PASSWORD = os.getenv('POSTGRES_PASSWORD', 'chat_password')
 DB_HOST = os.getenv('DB_HOST', 'db') # 'db' is the service name in docker-compose
+DB_POOL_MIN = int(os.getenv('DB_POOL_MIN', 2))
+DB_POOL_MAX = int(os.getenv('DB_POOL_MAX', 20))
+DB_PREPARED_STATEMENTS = os.getenv('DB_PREPARED_STATEMENTS', 'on') != 'off' # 'off' when a transaction-pooling proxy sits in front of Postgres
+ADMIN_USERS = {name.strip() for name in os.getenv('ADMIN_USERS', '').split(',') if name.strip()} # Usernames allowed to run admin_stats
+
+# Commands get their own latency series; anything else is recorded as 'unknown' so clients cannot create new series
+KNOWN_COMMANDS = {'register', 'login', 'resume', 'create_room', 'join_room', 'leave_room', 'send_message', 'list_rooms',
+                  'room_stats', 'history', 'search', 'leaderboard', 'dm', 'online', 'help', 'logout', 'admin_stats'}
+COMMAND_SECONDS = METRICS.histogram('chat_command_seconds', 'Time to handle one client command', ['command'])
+COMMAND_ERRORS = METRICS.counter('chat_command_errors_total', 'Commands that failed with an unexpected server error', ['command'])
+DB_CALL_SECONDS = METRICS.histogram('chat_db_call_seconds', 'Duration of each storage backend call', ['method'])
+
+AUTH_PROMPT = {"type": "prompt", "message": "Enter command (register/login): "}
+
+HELP_MESSAGE = """
+Available commands:
+  register <username> <password> - Create a new account
+  login <username> <password> - Log in to your account
+  create_room <room_name> [private] - Create a new chat room (add 'private' for private room)
+  join_room <room_name> - Join an existing chat room
+  leave_room - Leave the current chat room
+  send <message> - Send a message to the current room
+  dm <username> <message> - Send a direct message to an online user
+  online [username] - List online users, or check whether one user is online
+  list_rooms - List all available chat rooms
+  room_stats - View statistics for the current room (active users, total messages)
+  history [count] - Load older messages from the current room, a page at a time
+  search [--all] <words> - Search the current room (or every public room) for messages; 'search' alone shows more results
+  leaderboard - View the message leaderboard and your rank
+  admin_stats - Show server metrics (ADMIN_USERS only)
+  logout - Disconnect from the server
+  help - Show this help message
+"""
 
 class ChatServer:
-    def __init__(self, host, port):
+    def __init__(self, host, port, backlog=LISTEN_BACKLOG, reuse_port=False, bus=None):
         self.host = host
         self.port = port
-        self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.backlog = backlog
+        self.reuse_port = reuse_port # Several worker processes bind the same port; the kernel spreads connections
+        self.server_socket = None
 
-        self.db = Database(DB_NAME, DB_USER, DB_PASSWORD, DB_HOST)
+        self.db = open_storage(DB_BACKEND, dbname=DB_NAME, user=DB_USER, password=DB_PASSWORD, host=DB_HOST,
+                               min_connections=DB_POOL_MIN, max_connections=DB_POOL_MAX, prepared_statements=DB_PREPARED_STATEMENTS)
+        time_methods(self.db, STORAGE_METHODS, DB_CALL_SECONDS)
         self.auth = Authentication(self.db)
-        self.chat_manager = ChatManager(self.db)
+        if bus is None and ROOM_BUS == 'postgres':
+            bus = PostgresNotifyBus(self.db) # Cluster mode: rooms span every node on this database
+        self.chat_manager = ChatManager(self.db, bus)
+        self.rate_limiter = RateLimiter()
 
         self.clients = {}  # {client_socket: {'user_id': id, 'username': username, 'thread': thread}}
         self.client_id_counter = 0 # Simple counter for unique client IDs before login
+        self.register_metrics()
+        self.metrics_server = start_http_server()
+
+    def register_metrics(self):
+        # Read at scrape time only, so none of these cost anything on the request path
+        METRICS.callback('gauge', 'chat_connections', 'Open client connections', lambda: len(self.clients))
+        METRICS.callback('gauge', 'chat_sessions', 'Logged-in client connections',
+                         lambda: sum(1 for info in list(self.clients.values()) if info['user_id'] is not None))
+        METRICS.callback('gauge', 'chat_outbound_queued_frames', 'Frames waiting in client send queues',
+                         lambda: sum(len(connection.queue) for connection in list(self.clients)))
+        METRICS.callback('gauge', 'chat_outbound_queue_max_frames', 'Longest client send queue',
+                         lambda: max((len(connection.queue) for connection in list(self.clients)), default=0))
+        METRICS.callback('counter', 'chat_outbound_dropped_frames_total', 'Frames dropped for slow clients still connected',
+                         lambda: sum(connection.queue.dropped_frames for connection in list(self.clients)))
+        METRICS.callback('counter', 'chat_throttled_requests_total', 'Requests refused by the rate limiter',
+                         lambda: dict(self.rate_limiter.throttled), ['class'])
+        METRICS.callback('counter', 'chat_identity_cache_hits_total', 'Username and room name lookups served from memory',
+                         lambda: {'usernames': self.db.usernames.hits, 'room_names': self.db.room_names.hits}, ['cache'])
+        METRICS.callback('counter', 'chat_identity_cache_misses_total', 'Username and room name lookups that went to the database',
+                         lambda: {'usernames': self.db.usernames.misses, 'room_names': self.db.room_names.misses}, ['cache'])
 
     def start(self):
         try:
+            self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            if self.reuse_port:
+                self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
             self.server_socket.bind((self.host, self.port))
-            self.server_socket.listen(5)
-            print(f"Server listening on {self.host}:{self.port}")
+            self.server_socket.listen(self.backlog)
+            log.info("Server listening on %s:%s (threaded mode, backlog %s)", self.host, self.port, self.backlog)
             while True:
                 client_socket, client_address = self.server_socket.accept()
+                client_socket = ClientConnection(client_socket) # Writes go through a bounded per-client queue
                 self.client_id_counter += 1
                 client_thread = threading.Thread(target=self.handle_client, args=(client_socket, client_address, self.client_id_counter))
                 client_thread.daemon = True # Allow main program to exit even if threads are running
-                client_thread.start()
                 self.clients[client_socket] = {'thread': client_thread, 'address': client_address, 'user_id': None, 'username': None}
-                print(f"New connection from {client_address}. Assigned temporary ID: {self.client_id_counter}")
-        except Exception as e:
-            print(f"Server error: {e}")
+                client_thread.start()
+                log.info("New connection from %s. Assigned temporary ID: %s", client_address, self.client_id_counter,
+                         extra={'event': 'connection_opened'})
+        except Exception:
+            log.exception("Server error")
         finally:
             self.shutdown()
 
+    def new_session(self, client_address):
+        # Per-connection state shared by the threaded and asyncio front ends
+        return {'user_id': None, 'username': None, 'current_room_id': None, 'address': client_address,
+                'rate_limits': {}, 'throttled_streak': 0} # {command class: TokenBucket} and consecutive throttled requests
+
     def handle_client(self, client_socket, client_address, temp_client_id):
-        user_id = None
-        username = None
-        current_room_id = None
-        
-        # Initial authentication loop
-        while user_id is None:
+        session = self.new_session(client_address)
+        self.send_response(client_socket, AUTH_PROMPT)
+
+        while True:
             try:
-                self.send_response(client_socket, {"type": "prompt", "message": "Enter command (register/login): "})
                 data = self.receive_data(client_socket)
+                if data is None:
+                    if session['user_id'] is not None:
+                        log.info("Client %s (ID: %s) disconnected gracefully.", session['username'], session['user_id'])
+                    break
                 if not data:
-                    break # Client disconnected
-                
-                try:
-                    request = json.loads(data)
-                    command = request.get('command')
+                    continue # Ignore blank lines
+                if not self.handle_request(client_socket, session, data):
+                    break
+            except ConnectionResetError:
+                log.info("Client %s disconnected abruptly.", client_address)
+                break
+            except Exception:
+                log.exception("Unexpected error with client %s", client_address)
+                break
 
-                    if command == 'register':
-                        response = self.auth.register_user(request.get('username'), request.get('password'))
-                        self.send_response(client_socket, response)
-                    elif command == 'login':
-                        response = self.auth.login_user(request.get('username'), request.get('password'))
-                        self.send_response(client_socket, response)
-                        if response.get('status') == 'success':
-                            user_id = response['user_id']
-                            username = response['username']
-                            self.clients[client_socket]['user_id'] = user_id
-                            self.clients[client_socket]['username'] = username
-                            self.chat_manager.active_users[user_id] = {'username': username, 'current_room_id': None}
-                            print(f"User {username} (ID: {user_id}) authenticated from {client_address}")
-                            break
-                    else:
-                        self.send_response(client_socket, {"status": "error", "message": "Invalid command. Use 'register' or 'login'."})
-
-                except json.JSONDecodeError:
-                    self.send_response(client_socket, {"status": "error", "message": "Invalid JSON format."})
+        self.cleanup_client(client_socket, session['user_id'], session['current_room_id'])
+
+    def handle_request(self, client_socket, session, data):
+        """Decodes and dispatches one framed request. Returns False when the connection should close."""
+        try:
+            request = client_socket.codec.decode_request(data)
+        except ValueError: # Malformed JSON, bad UTF-8 or an unknown binary frame
+            self.send_response(client_socket, {"status": "error", "message": "Invalid JSON format."})
+            if session['user_id'] is None:
+                self.send_response(client_socket, AUTH_PROMPT)
+            return True
+        if any(isinstance(value, str) and '\x00' in value for value in request.values()):
+            # PostgreSQL text cannot hold NUL, so such a message could never be saved
+            self.send_response(client_socket, {"status": "error", "message": "Requests cannot contain NUL characters."})
+            return True
+
+        if request.get('command') == 'hello':
+            self.negotiate_protocol(client_socket, request.get('protocol'))
+            return True
+
+        command = request.get('command')
+        retry_after = self.rate_limiter.check(session, command)
+        if retry_after:
+            if self.rate_limiter.should_disconnect(session):
+                log.warning("Disconnecting %s: still flooding after being throttled.", session['username'] or session['address'],
+                            extra={'event': 'flood_disconnect', 'user_id': session['user_id']})
+                self.send_response(client_socket, {"status": "error", "message": "Too many requests. Disconnecting."})
+                return False
+            self.send_response(client_socket, {"status": "error", "type": "throttled", "command": command,
+                                               "message": f"Too many requests; try again in {retry_after:.1f}s.",
+                                               "retry_after": round(retry_after, 3)})
+            return True
+
+        label = command if command in KNOWN_COMMANDS else 'unknown'
+        with COMMAND_SECONDS.labels(label).time(): # Throttled requests are left out; they never reach a handler
+            if session['user_id'] is None:
+                try:
+                    self.handle_auth_command(client_socket, session, command, request)
                 except Exception as e:
-                    print(f"Error during authentication: {e}")
+                    COMMAND_ERRORS.labels(label).inc()
+                    log.exception("Error during authentication")
                     self.send_response(client_socket, {"status": "error", "message": f"Server error: {e}"})
+                if session['user_id'] is None:
+                    self.send_response(client_socket, AUTH_PROMPT)
+                return True
 
-            except ConnectionResetError:
-                print(f"Client {client_address} disconnected abruptly during authentication.")
-                break
+            try:
+                return self.handle_chat_command(client_socket, session, command, request)
             except Exception as e:
-                print(f"Error during authentication for {client_address}: {e}")
-                break
+                COMMAND_ERRORS.labels(label).inc()
+                log.exception("Error handling %s from client %s (ID: %s)", command, session['username'], session['user_id'])
+                self.send_response(client_socket, {"status": "error", "message": f"Server internal error: {e}"})
+                return True
 
-        if user_id is None: # If authentication failed or client disconnected
-            self.cleanup_client(client_socket, user_id)
+    def negotiate_protocol(self, client_socket, requested):
+        # The acknowledgement goes out in the current protocol; everything after it uses the new one
+        codec = CODECS.get(requested, JSON_CODEC)
+        self.send_response(client_socket, {"type": "hello", "status": "success", "protocol": codec.name})
+        client_socket.codec = codec
+
+    def handle_auth_command(self, client_socket, session, command, request):
+        if command == 'register':
+            response = self.auth.register_user(request.get('username'), request.get('password'))
+            self.send_response(client_socket, response)
+        elif command == 'login':
+            response = self.auth.login_user(request.get('username'), request.get('password'))
+            self.send_response(client_socket, response)
+            if response.get('status') == 'success':
+                self.start_session(client_socket, session, response['user_id'], response['username'])
+        elif command == 'resume':
+            self.resume_session(client_socket, session, request)
+        else:
+            self.send_response(client_socket, {"status": "error", "message": "Invalid command. Use 'register' or 'login'."})
+
+    def start_session(self, client_socket, session, user_id, username):
+        session['user_id'] = user_id
+        session['username'] = username
+        if client_socket in self.clients:
+            self.clients[client_socket]['user_id'] = user_id
+            self.clients[client_socket]['username'] = username
+        self.chat_manager.user_logged_in(user_id, username, client_socket)
+        log.info("User %s (ID: %s) authenticated from %s", username, user_id, session['address'],
+                 extra={'event': 'authenticated', 'user_id': user_id})
+
+    def resume_session(self, client_socket, session, request):
+        """Restores a session from a token: no password hash, and only the messages missed since last_seen_id."""
+        response = self.auth.resume_session(request.get('token'))
+        if response.get('status') != 'success':
+            self.send_response(client_socket, response)
             return
+        user_id, username = response['user_id'], response['username']
+        self.start_session(client_socket, session, user_id, username)
+        room_id = response.pop('room_id')
+        if room_id:
+            room_response = self.chat_manager.resume_room(user_id, username, client_socket, room_id, request.get('last_seen_id'))
+            if room_response.get('status') == 'success':
+                session['current_room_id'] = room_id
+                room_response.pop('message')
+                response.update(room_response)
+        response['token'] = self.auth.issue_token(user_id, username, session['current_room_id'])
+        self.send_response(client_socket, response)
 
-        # Main chat loop after authentication
-        while True:
-            try:
-                data = self.receive_data(client_socket)
-                if not data:
-                    print(f"Client {username} (ID: {user_id}) disconnected gracefully.")
-                    break
+    def handle_chat_command(self, client_socket, session, command, request):
+        user_id = session['user_id']
+        username = session['username']
+        current_room_id = session['current_room_id']
 
-                try:
-                    request = json.loads(data)
-                    command = request.get('command')
-                    
-                    if command == 'create_room':
-                        room_name = request.get('room_name')
-                        is_private = request.get('is_private', False)
-                        response = self.chat_manager.create_room(room_name, is_private, user_id)
-                        if response:
-                            self.send_response(client_socket, {"status": "success", "message": f"Room '{room_name}' created (ID: {response})."})
-                        else:
-                            self.send_response(client_socket, {"status": "error", "message": f"Failed to create room '{room_name}'. It might already exist."})
-                    
-                    elif command == 'join_room':
-                        room_name = request.get('room_name')
-                        response = self.chat_manager.join_room(user_id, username, client_socket, room_name)
-                        self.send_response(client_socket, response)
-                        if response.get('status') == 'success':
-                            current_room_id = response['room_id']
-                        else:
-                            current_room_id = None # Ensure client is marked as not in a room on server side
-                    
-                    elif command == 'leave_room':
-                        if current_room_id:
-                            if self.chat_manager.leave_room(user_id, current_room_id):
-                                self.send_response(client_socket, {"status": "success", "message": f"Left room '{self.db.get_room_name(current_room_id)}'."})
-                                current_room_id = None
-                            else:
-                                self.send_response(client_socket, {"status": "error", "message": "Failed to leave room."})
-                        else:
-                            self.send_response(client_socket, {"status": "error", "message": "You are not currently in a room."})
-
-                    elif command == 'send_message':
-                        if current_room_id:
-                            message_content = request.get('message')
-                            if message_content:
-                                response = self.chat_manager.send_message(user_id, current_room_id, message_content)
-                                # Only send success/error to the sender, broadcast handles others
-                                if response.get('status') == 'error':
-                                    self.send_response(client_socket, response)
-                            else:
-                                self.send_response(client_socket, {"status": "error", "message": "Message content cannot be empty."})
-                        else:
-                            self.send_response(client_socket, {"status": "error", "message": "You must join a room to send messages."})
-
-                    elif command == 'list_rooms':
-                        response = self.chat_manager.get_room_list(user_id)
-                        self.send_response(client_socket, response)
+        if command == 'create_room':
+            room_name = request.get('room_name')
+            is_private = request.get('is_private', False)
+            response = self.chat_manager.create_room(room_name, is_private, user_id)
+            if response:
+                self.send_response(client_socket, {"status": "success", "message": f"Room '{room_name}' created (ID: {response})."})
+            else:
+                self.send_response(client_socket, {"status": "error", "message": f"Failed to create room '{room_name}'. It might already exist."})
+
+        elif command == 'join_room':
+            room_name = request.get('room_name')
+            response = self.chat_manager.join_room(user_id, username, client_socket, room_name)
+            if response.get('status') == 'success':
+                session['current_room_id'] = response['room_id']
+                response['token'] = self.auth.issue_token(user_id, username, response['room_id']) # Resumes into this room
+            else:
+                session['current_room_id'] = None # Ensure client is marked as not in a room on server side
+            self.send_response(client_socket, response)
+
+        elif command == 'leave_room':
+            if current_room_id:
+                if self.chat_manager.leave_room(user_id, current_room_id, client_socket):
+                    self.send_response(client_socket, {"status": "success", "message": f"Left room '{self.db.get_room_name(current_room_id)}'.",
+                                                       "token": self.auth.issue_token(user_id, username)})
+                    session['current_room_id'] = None
+                else:
+                    self.send_response(client_socket, {"status": "error", "message": "Failed to leave room."})
+            else:
+                self.send_response(client_socket, {"status": "error", "message": "You are not currently in a room."})
 
-                    elif command == 'room_stats':
-                        if current_room_id:
-                            stats = self.chat_manager.get_room_stats(current_room_id)
-                            active_users = self.chat_manager.get_active_users_in_room(current_room_id)
-                            self.send_response(client_socket, {
-                                "status": "success",
-                                "room_stats": stats,
-                                "active_users": active_users
-                            })
-                        else:
-                            self.send_response(client_socket, {"status": "error", "message": "You must be in a room to view stats."})
-
-                    elif command == 'leaderboard':
-                        response = self.chat_manager.get_leaderboard()
+        elif command == 'send_message':
+            if current_room_id:
+                message_content = request.get('message')
+                if message_content:
+                    response = self.chat_manager.send_message(user_id, current_room_id, message_content)
+                    # Only send success/error to the sender, broadcast handles others
+                    if response.get('status') == 'error':
                         self.send_response(client_socket, response)
+                else:
+                    self.send_response(client_socket, {"status": "error", "message": "Message content cannot be empty."})
+            else:
+                self.send_response(client_socket, {"status": "error", "message": "You must join a room to send messages."})
 
-                    elif command == 'help':
-                        help_message = """
-Available commands:
-  register <username> <password> - Create a new account
-  login <username> <password> - Log in to your account
-  create_room <room_name> [private] - Create a new chat room (add 'private' for private room)
-  join_room <room_name> - Join an existing chat room
-  leave_room - Leave the current chat room
-  send <message> - Send a message to the current room
-  list_rooms - List all available chat rooms
-  room_stats - View statistics for the current room (active users, total messages)
-  leaderboard - View the message leaderboard
-  logout - Disconnect from the server
-  help - Show this help message
-"""
-                        self.send_response(client_socket, {"type": "info", "message": help_message})
+        elif command == 'dm':
+            recipient = request.get('username')
+            message_content = request.get('message')
+            if recipient and message_content:
+                response = self.chat_manager.send_direct_message(user_id, recipient, message_content)
+                self.send_response(client_socket, response)
+            else:
+                self.send_response(client_socket, {"status": "error", "message": "Usage: dm <username> <message>"})
 
-                    elif command == 'logout':
-                        self.send_response(client_socket, {"status": "success", "message": "Logging out. Goodbye!"})
-                        break # Exit the loop, leading to client cleanup
+        elif command == 'online':
+            response = self.chat_manager.get_online_users(request.get('username'))
+            self.send_response(client_socket, response)
 
-                    else:
-                        self.send_response(client_socket, {"status": "error", "message": "Unknown command."})
+        elif command == 'list_rooms':
+            response = self.chat_manager.get_room_list(user_id)
+            self.send_response(client_socket, response)
 
-                except json.JSONDecodeError:
-                    self.send_response(client_socket, {"status": "error", "message": "Invalid JSON format."})
-                except Exception as e:
-                    print(f"Error handling client {username} (ID: {user_id}): {e}")
-                    self.send_response(client_socket, {"status": "error", "message": f"Server internal error: {e}"})
+        elif command == 'room_stats':
+            if current_room_id:
+                stats = self.chat_manager.get_room_stats(current_room_id)
+                active_users = self.chat_manager.get_active_users_in_room(current_room_id)
+                self.send_response(client_socket, {
+                    "status": "success",
+                    "room_stats": stats,
+                    "active_users": active_users
+                })
+            else:
+                self.send_response(client_socket, {"status": "error", "message": "You must be in a room to view stats."})
 
-            except ConnectionResetError:
-                print(f"Client {username} (ID: {user_id}) disconnected abruptly.")
-                break
-            except Exception as e:
-                print(f"Unexpected error with client {username} (ID: {user_id}): {e}")
-                break
-        
-        self.cleanup_client(client_socket, user_id, current_room_id)
+        elif command == 'history':
+            room_id, error = current_room_id, None
+            if request.get('room_name'):
+                room_id, error = self.readable_room(request['room_name'], current_room_id)
+            if error:
+                self.send_response(client_socket, {"status": "error", "message": error})
+            elif room_id:
+                response = self.chat_manager.get_history_page(
+                    room_id, request.get('before_timestamp'), request.get('before_id'), request.get('limit', 50)
+                )
+                self.send_response(client_socket, response)
+            else:
+                self.send_response(client_socket, {"status": "error", "message": "Specify an existing room or join one to view history."})
+
+        elif command == 'search':
+            room_id, error = current_room_id, None # No room joined: search every public room
+            if request.get('global'):
+                room_id = None
+            elif request.get('room_name'):
+                room_id, error = self.readable_room(request['room_name'], current_room_id)
+            if error:
+                self.send_response(client_socket, {"status": "error", "message": error})
+            else:
+                response = self.chat_manager.search_messages(request.get('query'), room_id, request.get('limit', 20), request.get('offset', 0))
+                self.send_response(client_socket, response)
+
+        elif command == 'leaderboard':
+            response = self.chat_manager.get_leaderboard(user_id)
+            self.send_response(client_socket, response)
+
+        elif command == 'help':
+            self.send_response(client_socket, {"type": "info", "message": HELP_MESSAGE})
+
+        elif command == 'admin_stats':
+            if username in ADMIN_USERS:
+                self.send_response(client_socket, {"status": "success", "message": "Server metrics", "stats": METRICS.summary()})
+            else:
+                self.send_response(client_socket, {"status": "error", "message": "admin_stats is only available to ADMIN_USERS."})
+
+        elif command == 'logout':
+            self.auth.revoke_sessions(user_id) # Tokens issued before now, including leaked ones, stop resuming
+            self.send_response(client_socket, {"status": "success", "message": "Logging out. Goodbye!"})
+            return False # Close the connection, leading to client cleanup
+
+        else:
+            self.send_response(client_socket, {"status": "error", "message": "Unknown command."})
+
+        return True
+
+    def readable_room(self, room_name, current_room_id):
+        """Returns (room_id, None) if the user may read the named room's messages, else (None, error).
+
+        Public rooms are open to everyone; a private room only to the member currently in it.
+        """
+        room = self.db.get_room_details(room_name)
+        if room is None:
+            return None, "Room does not exist."
+        if room['is_private'] and room['id'] != current_room_id:
+            return None, "Join a private room to read its messages."
+        return room['id'], None
 
     def receive_data(self, client_socket):
-        # Reads data until a newline character is found, to handle multiple commands in one send or partial sends
-        buffer = b''
+        # Returns the next newline-delimited request. Each connection keeps its own FrameReader, so
+        # bytes after the first newline (pipelined commands) are kept for the following calls.
+        client_info = self.clients.get(client_socket)
+        if client_info is None:
+            return None
+        reader = client_info.get('reader')
+        if reader is None:
+            reader = client_info['reader'] = FrameReader(client_socket)
         while True:
             try:
-                chunk = client_socket.recv(4096)
-                if not chunk:
+                frame = reader.read_frame(client_socket.codec.length_prefixed)
+                if frame is None:
                     return None # Client disconnected
-                buffer += chunk
-                if b'\n' in buffer:
-                    line, buffer = buffer.split(b'\n', 1)
-                    return line.decode('utf-8').strip()
+                if client_socket.codec.length_prefixed:
+                    return frame
+                return frame.decode('utf-8', errors='replace').strip()
             except socket.timeout:
                 continue # No data yet, keep waiting
             except ConnectionResetError:
                 return None # Client disconnected
+            except FrameTooLarge as e:
+                self.send_response(client_socket, {"status": "error", "message": f"{e} Closing connection."})
+                return None
             except Exception as e:
-                print(f"Error receiving data: {e}")
+                log.error("Error receiving data: %s", e)
                 return None
 
     def send_response(self, client_socket, response_data):
         try:
-            message = json.dumps(response_data) + '\n' # Add newline delimiter
-            client_socket.sendall(message.encode('utf-8'))
+            client_socket.sendall(client_socket.codec.encode(response_data)) # JSON line or binary frame, as negotiated
         except Exception as e:
-            print(f"Error sending response: {e}")
+            log.warning("Error sending response: %s", e, extra={'event': 'send_failed'})
 
     def cleanup_client(self, client_socket, user_id, current_room_id=None):
         if user_id:
             if current_room_id:
-                self.chat_manager.leave_room(user_id, current_room_id)
-            self.chat_manager.disconnect_user(user_id) # Remove from active_users
+                self.chat_manager.leave_room(user_id, current_room_id, client_socket)
+            self.chat_manager.disconnect_user(user_id, client_socket) # Remove from active_users and the online index
         
         if client_socket in self.clients:
             del self.clients[client_socket]
@@ -255,25 +445,66 @@ Available commands:
             client_socket.shutdown(socket.SHUT_RDWR)
             client_socket.close()
         except OSError as e:
-            print(f"Error during socket shutdown/close: {e} (Client might already be closed)")
+            log.debug("Error during socket shutdown/close: %s (Client might already be closed)", e)
         except Exception as e:
-            print(f"Unexpected error during client cleanup: {e}")
+            log.error("Unexpected error during client cleanup: %s", e)
         
-        print(f"Client socket closed.")
+        log.debug("Client socket closed.")
 
 
     def shutdown(self):
-        print("Shutting down server...")
+        log.info("Shutting down server...")
         for client_socket in list(self.clients.keys()):
             try:
                 client_socket.shutdown(socket.SHUT_RDWR)
                 client_socket.close()
             except OSError as e:
-                print(f"Error closing client socket during shutdown: {e}")
-        self.server_socket.close()
+                log.error("Error closing client socket during shutdown: %s", e)
+        if self.server_socket:
+            self.server_socket.close()
+        if self.metrics_server:
+            self.metrics_server.shutdown()
+        self.chat_manager.close()
+        self.auth.close()
         self.db.close()
-        print("Server shut down.")
+        log.info("Rate limiter: %s.", self.rate_limiter.summary())
+        log.info("Server shut down.")
+
+shutdown_requested = threading.Event() # Set by the first SIGTERM
+
+def create_server(reuse_port=False, bus=None):
+    """Builds the server for the configured SERVER_MODE ('threaded' or 'asyncio')."""
+    if SERVER_MODE == 'asyncio':
+        from async_server import AsyncChatServer
+        return AsyncChatServer(HOST, PORT, LISTEN_BACKLOG, reuse_port, bus)
+    if SERVER_MODE != 'threaded':
+        log.warning("Unknown SERVER_MODE '%s', falling back to threaded mode.", SERVER_MODE)
+    return ChatServer(HOST, PORT, LISTEN_BACKLOG, reuse_port, bus)
+
+def handle_sigterm(signum, frame):
+    # docker stop sends SIGTERM; exit through the normal shutdown path so buffered messages are flushed.
+    # Only the first one does: a repeat (docker and timeout both resend) must not interrupt that flush.
+    if shutdown_requested.is_set():
+        return
+    shutdown_requested.set()
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    raise SystemExit(0)
 
 if __name__ == "__main__":
-    server = ChatServer(HOST, PORT)
-    server.start()
+    setup_logging()
+    if SERVER_WORKERS > 1:
+        from supervisor import Supervisor
+        try:
+            supervisor = Supervisor(SERVER_WORKERS)
+        except StorageError as e:
+            log.error("Could not start workers: %s", e)
+            raise SystemExit(1)
+        supervisor.run()
+    else:
+        signal.signal(signal.SIGTERM, handle_sigterm)
+        try:
+            server = create_server()
+        except StorageError as e:
+            log.error("Could not open storage: %s", e)
+            raise SystemExit(1)
+        server.start()
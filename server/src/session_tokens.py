@@ -0,0 +1,61 @@
+# server/src/session_tokens.py
+import base64
+import hashlib
+import hmac
+import json
+import logging
+import os
+import secrets
+import time
+
+log = logging.getLogger(__name__)
+
+SESSION_SECRET = os.getenv('SESSION_SECRET') # HMAC key; unset, a key generated once and stored in the database is used
+SESSION_TOKEN_TTL = int(os.getenv('SESSION_TOKEN_TTL', 24 * 3600)) # Seconds a token stays valid after it was issued
+
+
+def _b64encode(data):
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode('ascii')
+
+
+def _b64decode(text):
+    return base64.urlsafe_b64decode(text + '=' * (-len(text) % 4))
+
+
+class SessionTokens:
+    """Issues and checks signed session tokens: '<base64 payload>.<base64 HMAC-SHA256>'.
+
+    The payload carries the user id, username, current room and expiry, so resuming a
+    session costs one HMAC check and one small lookup instead of a password hash. It also
+    carries the user's session generation at issue time; logout bumps the generation, which
+    revokes every token issued before it. Authentication passes SESSION_SECRET, or else a
+    key stored in the database, so every server process and restart signs with the same key.
+    """
+
+    def __init__(self, secret=SESSION_SECRET, ttl=SESSION_TOKEN_TTL):
+        if not secret:
+            log.warning("No session secret is configured or stored; session tokens will not survive a restart.")
+            secret = secrets.token_hex(32)
+        self.key = secret.encode()
+        self.ttl = ttl
+
+    def _sign(self, payload):
+        return _b64encode(hmac.new(self.key, payload.encode('ascii'), hashlib.sha256).digest())
+
+    def issue(self, user_id, username, room_id=None, generation=0):
+        claims = {"uid": user_id, "name": username, "room": room_id, "gen": generation, "exp": int(time.time()) + self.ttl}
+        payload = _b64encode(json.dumps(claims, separators=(',', ':')).encode())
+        return f"{payload}.{self._sign(payload)}"
+
+    def verify(self, token):
+        """Returns the token's claims, or None if it is malformed, forged or expired."""
+        try:
+            payload, signature = token.split('.')
+            if not hmac.compare_digest(signature, self._sign(payload)):
+                return None
+            claims = json.loads(_b64decode(payload))
+        except (AttributeError, ValueError, UnicodeError):
+            return None
+        if claims.get('exp', 0) < time.time():
+            return None
+        return claims
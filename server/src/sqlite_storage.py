@@ -0,0 +1,635 @@
+# server/src/sqlite_storage.py
+import datetime
+import logging
+import queue
+import sqlite3
+import threading
+
+from storage import Storage, StorageError, MessagesRejected, IDENTITY_CACHE_SIZE, PRESENCE_TTL, SEARCH_MAX_MATCHES
+
+log = logging.getLogger(__name__)
+
+SQLITE_BUSY_TIMEOUT = 10 # Seconds a writer waits for another process's write transaction
+SQLITE_MAX_CONNECTIONS = 8 # Connections to a database file; readers run in parallel under WAL
+POOL_CHECKOUT_TIMEOUT = 10 # Seconds to wait for a free connection
+
+# Mirrors the PostgreSQL schema at migrations.LATEST_VERSION; the version is kept in PRAGMA user_version.
+SCHEMA = [
+    (1, "Base schema", [
+        """
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY,
+            username TEXT UNIQUE NOT NULL,
+            password_hash TEXT NOT NULL,
+            created_at TEXT NOT NULL
+        );
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS rooms (
+            id INTEGER PRIMARY KEY,
+            name TEXT UNIQUE NOT NULL,
+            is_private INTEGER NOT NULL DEFAULT 0,
+            created_by_user_id INTEGER REFERENCES users(id),
+            created_at TEXT NOT NULL
+        );
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS messages (
+            id INTEGER PRIMARY KEY,
+            room_id INTEGER REFERENCES rooms(id),
+            user_id INTEGER REFERENCES users(id),
+            content TEXT NOT NULL,
+            timestamp TEXT NOT NULL
+        );
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS leaderboard (
+            user_id INTEGER PRIMARY KEY REFERENCES users(id),
+            message_count INTEGER NOT NULL DEFAULT 0,
+            last_active TEXT NOT NULL,
+            active_seconds INTEGER NOT NULL DEFAULT 0
+        );
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS room_counters (
+            room_id INTEGER PRIMARY KEY REFERENCES rooms(id),
+            message_count INTEGER NOT NULL DEFAULT 0
+        );
+        """,
+        # Stands in for the messages id sequence that reserve_message_ids draws from
+        """
+        CREATE TABLE IF NOT EXISTS message_id_sequence (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            last_value INTEGER NOT NULL
+        );
+        """,
+        "INSERT OR IGNORE INTO message_id_sequence (id, last_value) VALUES (1, 0);",
+        "CREATE INDEX IF NOT EXISTS idx_messages_room_timestamp ON messages (room_id, timestamp, id);",
+        "CREATE INDEX IF NOT EXISTS idx_leaderboard_rank ON leaderboard (message_count DESC, last_active DESC);",
+    ]),
+    (2, "Full-text search on message content", [
+        # FTS5 index over messages.content, kept in step by a trigger; messages are never updated or deleted
+        """
+        CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts
+        USING fts5(content, content='messages', content_rowid='id', tokenize='porter unicode61');
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages BEGIN
+            INSERT INTO messages_fts (rowid, content) VALUES (new.id, new.content);
+        END;
+        """,
+        "INSERT INTO messages_fts (messages_fts) VALUES ('rebuild');", # Indexes messages written before this version
+    ]),
+    (3, "Session token revocation", [
+        "ALTER TABLE users ADD COLUMN session_generation INTEGER NOT NULL DEFAULT 0;",
+    ]),
+    (4, "Presence shared by every server process", [
+        "CREATE TABLE IF NOT EXISTS server_nodes (node_id TEXT PRIMARY KEY, last_seen TEXT NOT NULL);",
+        "CREATE TABLE IF NOT EXISTS presence (user_id INTEGER PRIMARY KEY, node_id TEXT NOT NULL);",
+        "CREATE INDEX IF NOT EXISTS idx_presence_node ON presence (node_id);",
+    ]),
+    (5, "Room membership shared by every server process", [
+        "ALTER TABLE presence ADD COLUMN room_id INTEGER;",
+        "CREATE INDEX IF NOT EXISTS idx_presence_room ON presence (room_id);",
+    ]),
+    (6, "Server settings", [
+        "CREATE TABLE IF NOT EXISTS server_settings (name TEXT PRIMARY KEY, value TEXT NOT NULL);",
+    ]),
+]
+
+LATEST_VERSION = SCHEMA[-1][0]
+
+# Users whose server process has sent a heartbeat within PRESENCE_TTL; takes the expiry modifier, e.g. '-30 seconds'
+LIVE_PRESENCE = """
+    FROM presence p
+    JOIN server_nodes n ON p.node_id = n.node_id
+    JOIN users u ON p.user_id = u.id
+    WHERE n.last_seen >= datetime('now', ?)
+"""
+
+HISTORY_COLUMNS = """
+    SELECT m.id, u.username, m.content, m.timestamp
+    FROM messages m
+    JOIN users u ON m.user_id = u.id
+"""
+
+
+def _timestamp(value):
+    # Fixed-width text sorts in time order, so comparisons and indexes work on the raw column
+    return value.strftime('%Y-%m-%d %H:%M:%S.%f')
+
+
+def _datetime(text):
+    return datetime.datetime.fromisoformat(text) # Much faster than strptime, and reads the same format
+
+
+def _message(row):
+    return {"id": row[0], "username": row[1], "content": row[2], "timestamp": _datetime(row[3]).isoformat()}
+
+
+class SQLiteStorage(Storage):
+    """Embedded storage backend for single-machine runs (DB_BACKEND=sqlite or memory).
+
+    A database file is opened in WAL mode: readers never block the writer or each other, and
+    several worker processes may share the file. Writes are serialized, within a process by a
+    lock and across processes by BEGIN IMMEDIATE. ':memory:' keeps everything in one
+    connection that all threads share, and is lost when the process exits.
+    """
+
+    backend = 'sqlite'
+
+    def __init__(self, path, max_connections=SQLITE_MAX_CONNECTIONS, identity_cache_size=IDENTITY_CACHE_SIZE):
+        super().__init__(identity_cache_size)
+        self.path = path
+        if path == ':memory:':
+            self.backend = 'memory'
+            max_connections = 1 # Every connection to ':memory:' would be a separate, empty database
+        self.max_connections = max_connections
+        self._idle = queue.LifoQueue()
+        self._connections = []
+        self._connections_lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        try:
+            self._idle.put(self._open())
+            self._create_tables()
+        except sqlite3.Error as e:
+            raise StorageError(f"Error opening SQLite database {path}: {e}") from e
+        log.info("SQLite storage ready at %s (schema version %s, %s).",
+                 path, LATEST_VERSION, 'in memory' if self.backend == 'memory' else 'WAL mode')
+
+    def _open(self):
+        # Autocommit mode: transactions are opened explicitly by _write
+        conn = sqlite3.connect(self.path, timeout=SQLITE_BUSY_TIMEOUT, isolation_level=None, check_same_thread=False)
+        if self.backend == 'sqlite':
+            conn.execute("PRAGMA journal_mode = WAL;")
+            conn.execute("PRAGMA synchronous = NORMAL;") # Durable at checkpoints; a power cut may lose the last commits
+        self._connections.append(conn)
+        return conn
+
+    def _checkout(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._connections_lock:
+            if len(self._connections) < self.max_connections:
+                return self._open()
+        try:
+            return self._idle.get(timeout=POOL_CHECKOUT_TIMEOUT)
+        except queue.Empty:
+            raise StorageError("Timed out waiting for a database connection.")
+
+    def _read(self, work):
+        """Runs work(conn) on a pooled connection; each statement sees the latest committed data."""
+        conn = self._checkout()
+        try:
+            return work(conn)
+        finally:
+            self._idle.put(conn)
+
+    def _write(self, work):
+        """Runs work(conn) in a write transaction, committed when it returns and rolled back if it raises."""
+        def transaction(conn):
+            with self._write_lock:
+                conn.execute("BEGIN IMMEDIATE;")
+                try:
+                    result = work(conn)
+                except BaseException:
+                    conn.execute("ROLLBACK;")
+                    raise
+                conn.execute("COMMIT;")
+                return result
+        return self._read(transaction)
+
+    def _fetchone(self, query, params=()):
+        return self._read(lambda conn: conn.execute(query, params).fetchone())
+
+    def _fetchall(self, query, params=()):
+        return self._read(lambda conn: conn.execute(query, params).fetchall())
+
+    def _create_tables(self):
+        def migrate(conn):
+            current_version = conn.execute("PRAGMA user_version;").fetchone()[0]
+            for version, description, statements in SCHEMA:
+                if version <= current_version:
+                    continue
+                for statement in statements:
+                    conn.execute(statement)
+                conn.execute(f"PRAGMA user_version = {int(version)};")
+        self._write(migrate)
+
+    def add_user(self, username, password_hash):
+        def insert(conn):
+            now = _timestamp(datetime.datetime.now())
+            user_id = conn.execute(
+                "INSERT INTO users (username, password_hash, created_at) VALUES (?, ?, ?);",
+                (username, password_hash, now)
+            ).lastrowid
+            conn.execute("INSERT INTO leaderboard (user_id, last_active) VALUES (?, ?);", (user_id, now))
+            return user_id
+
+        try:
+            user_id = self._write(insert)
+            self.usernames.put(user_id, username)
+            return True
+        except sqlite3.IntegrityError:
+            return False # Username already exists
+        except Exception as e:
+            log.error("Error adding user: %s", e)
+            return False
+
+    def get_user_credentials(self, username):
+        try:
+            result = self._fetchone("SELECT id, password_hash FROM users WHERE username = ?;", (username,))
+            if result:
+                self.usernames.put(result[0], username)
+            return result
+        except Exception as e:
+            log.error("Error fetching user credentials: %s", e)
+            return None
+
+    def update_password_hash(self, user_id, password_hash):
+        try:
+            self._write(lambda conn: conn.execute("UPDATE users SET password_hash = ? WHERE id = ?;", (password_hash, user_id)))
+            return True
+        except Exception as e:
+            log.error("Error updating password hash: %s", e)
+            return False
+
+    def get_session_generation(self, user_id):
+        try:
+            result = self._fetchone("SELECT session_generation FROM users WHERE id = ?;", (user_id,))
+            return result[0] if result else None
+        except Exception as e:
+            log.error("Error getting session generation: %s", e)
+            return None
+
+    def revoke_sessions(self, user_id):
+        try:
+            def bump(conn):
+                conn.execute("UPDATE users SET session_generation = session_generation + 1 WHERE id = ?;", (user_id,))
+                return conn.execute("SELECT session_generation FROM users WHERE id = ?;", (user_id,)).fetchone()[0]
+            return self._write(bump)
+        except Exception as e:
+            log.error("Error revoking sessions: %s", e)
+            return None
+
+    def get_or_create_setting(self, name, value):
+        try:
+            def fetch(conn):
+                conn.execute("INSERT OR IGNORE INTO server_settings (name, value) VALUES (?, ?);", (name, value))
+                return conn.execute("SELECT value FROM server_settings WHERE name = ?;", (name,)).fetchone()[0]
+            return self._write(fetch)
+        except Exception as e:
+            log.error("Error reading setting %s: %s", name, e)
+            return None
+
+    def get_username_by_id(self, user_id):
+        username = self.usernames.get(user_id)
+        if username is not None:
+            return username
+        try:
+            result = self._fetchone("SELECT username FROM users WHERE id = ?;", (user_id,))
+            if result:
+                self.usernames.put(user_id, result[0])
+            return result[0] if result else None
+        except Exception as e:
+            log.error("Error getting username by ID: %s", e)
+            return None
+
+    def create_room(self, room_name, is_private, created_by_user_id):
+        def insert(conn):
+            room_id = conn.execute(
+                "INSERT INTO rooms (name, is_private, created_by_user_id, created_at) VALUES (?, ?, ?, ?);",
+                (room_name, bool(is_private), created_by_user_id, _timestamp(datetime.datetime.now()))
+            ).lastrowid
+            conn.execute("INSERT INTO room_counters (room_id) VALUES (?);", (room_id,))
+            return room_id
+
+        try:
+            room_id = self._write(insert)
+            self.room_names.put(room_id, room_name)
+            return room_id
+        except sqlite3.IntegrityError:
+            return None # Room name already exists
+        except Exception as e:
+            log.error("Error creating room: %s", e)
+            return None
+
+    def get_room_id(self, room_name):
+        try:
+            result = self._fetchone("SELECT id FROM rooms WHERE name = ?;", (room_name,))
+            return result[0] if result else None
+        except Exception as e:
+            log.error("Error getting room ID: %s", e)
+            return None
+
+    def get_room_name(self, room_id):
+        room_name = self.room_names.get(room_id)
+        if room_name is not None:
+            return room_name
+        try:
+            result = self._fetchone("SELECT name FROM rooms WHERE id = ?;", (room_id,))
+            if result:
+                self.room_names.put(room_id, result[0])
+            return result[0] if result else None
+        except Exception as e:
+            log.error("Error getting room name: %s", e)
+            return None
+
+    def get_room_details(self, room_name):
+        try:
+            result = self._fetchone("SELECT id, name, is_private FROM rooms WHERE name = ?;", (room_name,))
+            if result:
+                self.room_names.put(result[0], result[1])
+                return {"id": result[0], "name": result[1], "is_private": bool(result[2])}
+            return None
+        except Exception as e:
+            log.error("Error getting room details: %s", e)
+            return None
+
+    def get_all_rooms(self):
+        try:
+            rows = self._fetchall("SELECT id, name, is_private FROM rooms;")
+            for r in rows:
+                self.room_names.put(r[0], r[1])
+            return [{"id": r[0], "name": r[1], "is_private": bool(r[2])} for r in rows]
+        except Exception as e:
+            log.error("Error getting all rooms: %s", e)
+            return []
+
+    def get_room_stats(self, room_id):
+        try:
+            result = self._fetchone("SELECT message_count FROM room_counters WHERE room_id = ?;", (room_id,))
+            return {"total_messages": result[0] if result else 0}
+        except Exception as e:
+            log.error("Error getting room stats: %s", e)
+            return {"total_messages": 0}
+
+    def get_room_message_counts(self):
+        try:
+            return dict(self._fetchall("SELECT room_id, message_count FROM room_counters;"))
+        except Exception as e:
+            log.error("Error getting room message counts: %s", e)
+            return {}
+
+    def reserve_message_ids(self, count):
+        def reserve(conn):
+            conn.execute("UPDATE message_id_sequence SET last_value = last_value + ? WHERE id = 1;", (count,))
+            return conn.execute("SELECT last_value FROM message_id_sequence WHERE id = 1;").fetchone()[0]
+        last = self._write(reserve)
+        return list(range(last - count + 1, last + 1))
+
+    def save_messages_batch(self, messages):
+        activity = {} # {user_id: [message_count, last_active]}
+        room_totals = {} # {room_id: message_count}
+        for message_id, room_id, user_id, content, timestamp in messages:
+            entry = activity.setdefault(user_id, [0, timestamp])
+            entry[0] += 1
+            entry[1] = max(entry[1], timestamp)
+            room_totals[room_id] = room_totals.get(room_id, 0) + 1
+
+        def insert(conn):
+            conn.executemany(
+                "INSERT INTO messages (id, room_id, user_id, content, timestamp) VALUES (?, ?, ?, ?, ?);",
+                [(message_id, room_id, user_id, content, _timestamp(timestamp)) for message_id, room_id, user_id, content, timestamp in messages]
+            )
+            conn.executemany(
+                "UPDATE leaderboard SET message_count = message_count + ?, last_active = MAX(last_active, ?) WHERE user_id = ?;",
+                [(count, _timestamp(last), user_id) for user_id, (count, last) in activity.items()]
+            )
+            conn.executemany(
+                """
+                INSERT INTO room_counters (room_id, message_count) VALUES (?, ?)
+                ON CONFLICT (room_id) DO UPDATE SET message_count = message_count + excluded.message_count;
+                """,
+                list(room_totals.items())
+            )
+
+        try:
+            self._write(insert)
+            return True
+        except (sqlite3.IntegrityError, sqlite3.DataError, sqlite3.InterfaceError, ValueError) as e:
+            raise MessagesRejected(str(e))
+        except Exception as e:
+            log.error("Error saving message batch of %s: %s", len(messages), e)
+            return False
+
+    def get_message_history(self, room_id, limit=50):
+        try:
+            rows = self._fetchall(
+                HISTORY_COLUMNS + "WHERE m.room_id = ? ORDER BY m.timestamp DESC, m.id DESC LIMIT ?;",
+                (room_id, limit)
+            )
+            return [_message(r) for r in reversed(rows)]
+        except Exception as e:
+            log.error("Error getting message history: %s", e)
+            return []
+
+    def get_message_history_page(self, room_id, before_timestamp=None, before_id=None, limit=50):
+        if before_timestamp is not None and before_id is not None:
+            condition, params = "AND (m.timestamp, m.id) < (?, ?)", (room_id, _timestamp(before_timestamp), before_id, limit)
+        elif before_timestamp is not None:
+            condition, params = "AND m.timestamp < ?", (room_id, _timestamp(before_timestamp), limit)
+        else:
+            condition, params = "", (room_id, limit)
+        try:
+            rows = self._fetchall(
+                HISTORY_COLUMNS + f"WHERE m.room_id = ? {condition} ORDER BY m.timestamp DESC, m.id DESC LIMIT ?;",
+                params
+            )
+            return [_message(r) for r in rows]
+        except Exception as e:
+            log.error("Error getting message history page: %s", e)
+            return None
+
+    def get_messages_after(self, room_id, after_id, limit=500):
+        try:
+            rows = self._fetchall(
+                HISTORY_COLUMNS + """
+                WHERE m.room_id = ?
+                  AND (m.timestamp, m.id) >= (SELECT timestamp, id FROM messages WHERE id = ?)
+                ORDER BY m.timestamp, m.id
+                LIMIT ?;
+                """,
+                (room_id, after_id, limit + 1)
+            )
+            if not rows or rows[0][0] != after_id:
+                return None # after_id is not a message of this room
+            return [_message(r) for r in rows[1:]]
+        except Exception as e:
+            log.error("Error getting messages after %s: %s", after_id, e)
+            return None
+
+    def search_messages(self, query, room_id=None, limit=20, offset=0, max_matches=SEARCH_MAX_MATCHES):
+        # Every word is quoted, so FTS5 operators in user input are matched as text; the words are ANDed
+        terms = ' '.join('"' + word.replace('"', '""') + '"' for word in query.split())
+        if not terms:
+            return []
+        if room_id is None:
+            scope, params = "r.is_private = 0", (terms, max_matches, limit, offset)
+        else:
+            scope, params = "m.room_id = ?", (terms, room_id, max_matches, limit, offset)
+        try:
+            rows = self._fetchall(
+                f"""
+                WITH matches AS (
+                    SELECT m.id, m.room_id, m.user_id, m.content, m.timestamp, bm25(messages_fts) AS score
+                    FROM messages_fts
+                    JOIN messages m ON m.id = messages_fts.rowid
+                    JOIN rooms r ON m.room_id = r.id
+                    WHERE messages_fts MATCH ? AND {scope}
+                    ORDER BY m.timestamp DESC, m.id DESC
+                    LIMIT ?
+                )
+                SELECT matches.id, r.name, u.username, matches.content, matches.timestamp, matches.score
+                FROM matches
+                JOIN rooms r ON matches.room_id = r.id
+                JOIN users u ON matches.user_id = u.id
+                ORDER BY matches.score, matches.timestamp DESC, matches.id DESC
+                LIMIT ? OFFSET ?;
+                """,
+                params
+            )
+            # bm25() is lower for better matches; flip it so rank means the same as ts_rank
+            return [{"id": r[0], "room": r[1], "username": r[2], "content": r[3], "timestamp": _datetime(r[4]).isoformat(),
+                     "rank": -r[5]} for r in rows]
+        except Exception as e:
+            log.error("Error searching messages: %s", e)
+            return None
+
+    def heartbeat_node(self, node_id):
+        expired = f"-{PRESENCE_TTL} seconds"
+        def beat(conn):
+            conn.execute(
+                "INSERT INTO server_nodes (node_id, last_seen) VALUES (?, datetime('now')) "
+                "ON CONFLICT (node_id) DO UPDATE SET last_seen = excluded.last_seen;",
+                (node_id,)
+            )
+            conn.execute("DELETE FROM presence WHERE node_id IN (SELECT node_id FROM server_nodes WHERE last_seen < datetime('now', ?));", (expired,))
+            conn.execute("DELETE FROM server_nodes WHERE last_seen < datetime('now', ?);", (expired,))
+        try:
+            self._write(beat)
+            return True
+        except Exception as e:
+            log.error("Error recording presence heartbeat: %s", e)
+            return False
+
+    def set_presence(self, user_id, node_id):
+        try:
+            self._write(lambda conn: conn.execute(
+                "INSERT INTO presence (user_id, node_id) VALUES (?, ?) ON CONFLICT (user_id) DO UPDATE SET node_id = excluded.node_id, room_id = NULL;",
+                (user_id, node_id)
+            ))
+            return True
+        except Exception as e:
+            log.error("Error recording presence: %s", e)
+            return False
+
+    def clear_presence(self, user_id, node_id):
+        try:
+            self._write(lambda conn: conn.execute("DELETE FROM presence WHERE user_id = ? AND node_id = ?;", (user_id, node_id)))
+            return True
+        except Exception as e:
+            log.error("Error clearing presence: %s", e)
+            return False
+
+    def remove_node(self, node_id):
+        def remove(conn):
+            conn.execute("DELETE FROM presence WHERE node_id = ?;", (node_id,))
+            conn.execute("DELETE FROM server_nodes WHERE node_id = ?;", (node_id,))
+        try:
+            self._write(remove)
+            return True
+        except Exception as e:
+            log.error("Error removing server node: %s", e)
+            return False
+
+    def is_user_online(self, username):
+        try:
+            return self._fetchone(
+                "SELECT 1 " + LIVE_PRESENCE + "AND u.username = ?;", (f"-{PRESENCE_TTL} seconds", username)
+            ) is not None
+        except Exception as e:
+            log.error("Error checking presence: %s", e)
+            return None
+
+    def list_online_users(self, limit=100):
+        try:
+            expired = f"-{PRESENCE_TTL} seconds"
+            count = self._fetchone("SELECT COUNT(*) " + LIVE_PRESENCE + ";", (expired,))[0]
+            rows = self._fetchall("SELECT u.username " + LIVE_PRESENCE + "ORDER BY u.username LIMIT ?;", (expired, limit))
+            return count, [r[0] for r in rows]
+        except Exception as e:
+            log.error("Error listing online users: %s", e)
+            return None
+
+    def set_presence_room(self, user_id, node_id, room_id):
+        try:
+            self._write(lambda conn: conn.execute(
+                "UPDATE presence SET room_id = ? WHERE user_id = ? AND node_id = ?;", (room_id, user_id, node_id)
+            ))
+            return True
+        except Exception as e:
+            log.error("Error recording room presence: %s", e)
+            return False
+
+    def list_room_members(self, room_id, limit=100):
+        try:
+            params = (f"-{PRESENCE_TTL} seconds", room_id)
+            count = self._fetchone("SELECT COUNT(*) " + LIVE_PRESENCE + "AND p.room_id = ?;", params)[0]
+            rows = self._fetchall("SELECT u.username " + LIVE_PRESENCE + "AND p.room_id = ? ORDER BY u.username LIMIT ?;",
+                                  params + (limit,))
+            return count, [r[0] for r in rows]
+        except Exception as e:
+            log.error("Error listing room members: %s", e)
+            return None
+
+    def get_leaderboard(self, limit=10):
+        try:
+            rows = self._fetchall(
+                """
+                SELECT u.username, l.message_count, l.last_active
+                FROM leaderboard l
+                JOIN users u ON l.user_id = u.id
+                ORDER BY l.message_count DESC, l.last_active DESC
+                LIMIT ?;
+                """,
+                (limit,)
+            )
+            return [{"username": r[0], "message_count": r[1], "last_active": _datetime(r[2]).isoformat()} for r in rows]
+        except Exception as e:
+            log.error("Error getting leaderboard: %s", e)
+            return []
+
+    def load_leaderboard(self):
+        try:
+            rows = self._fetchall(
+                """
+                SELECT l.user_id, u.username, l.message_count, l.last_active, l.active_seconds
+                FROM leaderboard l
+                JOIN users u ON l.user_id = u.id;
+                """
+            )
+            return [(r[0], r[1], r[2], _datetime(r[3]), r[4]) for r in rows]
+        except Exception as e:
+            log.error("Error loading leaderboard: %s", e)
+            return []
+
+    def checkpoint_leaderboard(self, entries):
+        try:
+            self._write(lambda conn: conn.executemany(
+                "UPDATE leaderboard SET active_seconds = active_seconds + ?, last_active = MAX(last_active, ?) WHERE user_id = ?;",
+                [(active_seconds, _timestamp(last_active), user_id) for user_id, active_seconds, last_active in entries]
+            ))
+            return True
+        except Exception as e:
+            log.error("Error checkpointing leaderboard: %s", e)
+            return False
+
+    def close(self):
+        with self._connections_lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections.clear()
+        log.info("SQLite storage closed.")
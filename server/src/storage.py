@@ -0,0 +1,237 @@
+# server/src/storage.py
+"""Storage backends behind one interface, chosen with DB_BACKEND.
+
+'postgres' is the production backend (database.py). 'sqlite' keeps everything in one local
+file in WAL mode and 'memory' in an in-process SQLite database (sqlite_storage.py), so the
+server and its benchmarks run on a single machine without a database container.
+"""
+import abc
+import os
+
+from cache import LRUCache
+
+DB_BACKEND = os.getenv('DB_BACKEND', 'postgres') # 'postgres', 'sqlite' or 'memory'
+SQLITE_PATH = os.getenv('SQLITE_PATH', 'chat.db') # Database file for DB_BACKEND=sqlite
+IDENTITY_CACHE_SIZE = 10000 # user_id -> username and room_id -> room name entries kept in memory
+PRESENCE_TTL = 30 # Seconds without a heartbeat after which a server process's users count as offline
+SEARCH_MAX_MATCHES = int(os.getenv('SEARCH_MAX_MATCHES', 1000)) # Newest matches ranked per search; bounds the cost of common words
+
+
+class StorageError(Exception):
+    """Raised when a storage backend cannot be opened or does not support a feature."""
+
+
+class MessagesRejected(StorageError):
+    """Raised by save_messages_batch when the database refuses the data itself; the same batch would fail again."""
+
+
+class Storage(abc.ABC):
+    """What the chat server needs from its database.
+
+    Every abstract method must be implemented, so an incomplete backend fails when it is
+    created rather than on first use. Timestamps go in and come out as naive datetime objects; message dicts carry them as
+    ISO strings. Methods log and return an empty result on failure unless noted, so a
+    database hiccup fails one request rather than the connection.
+    """
+
+    backend = None
+    supports_notify = False # True if open_listener/notify_batch work (needed by ROOM_BUS=postgres)
+
+    def __init__(self, identity_cache_size=IDENTITY_CACHE_SIZE):
+        # Usernames and room names never change once created, so cached entries never go stale
+        self.usernames = LRUCache(identity_cache_size) # {user_id: username}
+        self.room_names = LRUCache(identity_cache_size) # {room_id: room_name}
+
+    # Users
+    @abc.abstractmethod
+    def add_user(self, username, password_hash):
+        """Creates a user and their leaderboard row; False if the name is taken."""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def get_user_credentials(self, username):
+        """Returns (user_id, password_hash), or None if the user does not exist."""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def update_password_hash(self, user_id, password_hash):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def get_username_by_id(self, user_id):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def get_session_generation(self, user_id):
+        """Returns the generation stamped into the user's session tokens, or None on failure."""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def revoke_sessions(self, user_id):
+        """Bumps the user's session generation so older tokens stop working; returns the new one, or None on failure."""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def get_or_create_setting(self, name, value):
+        """Returns the stored value of setting name, storing value first if there is none yet; None on failure."""
+        raise NotImplementedError
+
+    # Rooms
+    @abc.abstractmethod
+    def create_room(self, room_name, is_private, created_by_user_id):
+        """Returns the new room's id, or None if the name is taken."""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def get_room_id(self, room_name):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def get_room_name(self, room_id):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def get_room_details(self, room_name):
+        """Returns {"id", "name", "is_private"}, or None."""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def get_all_rooms(self):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def get_room_stats(self, room_id):
+        """Returns {"total_messages": n}."""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def get_room_message_counts(self):
+        """Returns {room_id: total_messages} for every room."""
+        raise NotImplementedError
+
+    # Messages
+    @abc.abstractmethod
+    def reserve_message_ids(self, count):
+        """Returns count unused message ids; raises on failure."""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def save_messages_batch(self, messages):
+        """Persists [(id, room_id, user_id, content, timestamp), ...] with the matching leaderboard and room counter increments, atomically.
+
+        Returns False if the write failed for a reason worth retrying (lost connection, locked
+        database) and raises MessagesRejected if some message in the batch can never be written.
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def get_message_history(self, room_id, limit=50):
+        """Returns the room's latest limit messages, oldest first."""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def get_message_history_page(self, room_id, before_timestamp=None, before_id=None, limit=50):
+        """Returns up to limit messages older than the (timestamp, id) cursor, newest first; None on failure."""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def get_messages_after(self, room_id, after_id, limit=500):
+        """Returns up to limit messages that follow message after_id in the room, oldest first.
+
+        None on failure, or if after_id is not a persisted message of the room.
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def search_messages(self, query, room_id=None, limit=20, offset=0, max_matches=SEARCH_MAX_MATCHES):
+        """Full-text search of one room, or of every public room when room_id is None.
+
+        Only the newest max_matches matches are ranked; results come best match first as
+        [{"id", "room", "username", "content", "timestamp", "rank"}, ...], or None on failure.
+        A higher rank is a better match. The scale is the backend's own (ts_rank or negated bm25),
+        so ranks are unrounded and only comparable within one backend.
+        """
+        raise NotImplementedError
+
+    # Presence, shared by every server process when rooms span processes
+    @abc.abstractmethod
+    def heartbeat_node(self, node_id):
+        """Marks server process node_id alive and forgets processes silent for PRESENCE_TTL, with their users."""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def set_presence(self, user_id, node_id):
+        """Records that the user is connected to node_id, replacing any other process."""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def clear_presence(self, user_id, node_id):
+        """Forgets the user's presence if node_id still holds it."""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def remove_node(self, node_id):
+        """Forgets a stopping server process and every user connected to it."""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def is_user_online(self, username):
+        """True if the user is connected to a live server process; None on failure."""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def list_online_users(self, limit=100):
+        """Returns (users online on live server processes, up to limit of their usernames, sorted), or None on failure."""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def set_presence_room(self, user_id, node_id, room_id):
+        """Records the room the user is in (None after leaving), if node_id still holds the user."""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def list_room_members(self, room_id, limit=100):
+        """Returns (users in the room on live server processes, up to limit of their usernames, sorted), or None on failure."""
+        raise NotImplementedError
+
+    # Leaderboard
+    @abc.abstractmethod
+    def get_leaderboard(self, limit=10):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def load_leaderboard(self):
+        """Returns [(user_id, username, message_count, last_active, active_seconds), ...] for every user."""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def checkpoint_leaderboard(self, entries):
+        """Applies [(user_id, active_seconds_delta, last_active), ...]."""
+        raise NotImplementedError
+
+    # Cluster notifications
+    def open_listener(self):
+        raise StorageError(f"The {self.backend} backend does not support LISTEN/NOTIFY.")
+
+    def notify_batch(self, notifications):
+        raise StorageError(f"The {self.backend} backend does not support LISTEN/NOTIFY.")
+
+    def close(self):
+        pass
+
+
+STORAGE_METHODS = tuple(name for name, value in vars(Storage).items() if callable(value) and not name.startswith('_'))
+
+
+def open_storage(backend=DB_BACKEND, **postgres_settings):
+    """Opens the backend named by DB_BACKEND; postgres_settings are passed to the PostgreSQL Database."""
+    if backend == 'postgres':
+        try:
+            from database import Database # psycopg2 is only needed when PostgreSQL is used
+        except ImportError as e:
+            raise StorageError(f"DB_BACKEND=postgres needs psycopg2 ({e}); use DB_BACKEND=sqlite or memory to run without it.")
+        return Database(**postgres_settings)
+    if backend in ('sqlite', 'memory'):
+        from sqlite_storage import SQLiteStorage
+        return SQLiteStorage(SQLITE_PATH if backend == 'sqlite' else ':memory:')
+    raise StorageError(f"Unknown DB_BACKEND '{backend}'; expected postgres, sqlite or memory.")
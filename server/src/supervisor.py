@@ -0,0 +1,99 @@
+# server/src/supervisor.py
+import logging
+import multiprocessing
+import os
+import signal
+import threading
+
+from bus import BusHub, UnixSocketBus, BUS_SOCKET_PATH, ROOM_BUS
+from storage import DB_BACKEND, StorageError
+from logs import setup_logging, stop_logging
+
+log = logging.getLogger(__name__)
+
+WORKER_CHECK_INTERVAL = 1 # Seconds between checks for crashed workers
+WORKER_SHUTDOWN_TIMEOUT = 10 # Seconds a worker gets to flush buffered messages after SIGTERM
+WORKER_STORAGE_ERROR = 3 # Exit code of a worker that could not open storage; restarting it would not help
+
+
+def run_worker(index, bus_path):
+    """Entry point of one worker process: a full ChatServer on the shared port, joined to the room bus."""
+    import server # Imported here so the supervisor itself never opens a database pool
+    import metrics
+    setup_logging()
+    if metrics.METRICS_PORT:
+        metrics.METRICS_PORT += index # Each worker serves its own /metrics on consecutive ports
+    signal.signal(signal.SIGTERM, server.handle_sigterm)
+    log.info("Worker %s starting (pid %s).", index, os.getpid())
+    bus = UnixSocketBus(bus_path) if bus_path else None # None: the worker joins the PostgreSQL bus as its own node
+    try:
+        chat_server = server.create_server(reuse_port=True, bus=bus)
+    except StorageError as e:
+        log.error("Worker %s could not open storage: %s", index, e)
+        raise SystemExit(WORKER_STORAGE_ERROR)
+    try:
+        chat_server.start()
+    finally:
+        stop_logging() # Write out queued records before the process exits
+
+
+class Supervisor:
+    """Runs N worker processes that share the listening port through SO_REUSEPORT.
+
+    Each worker is an independent ChatServer with its own GIL, database pool and rooms; the
+    kernel spreads new connections across them. Room events cross workers through the
+    BusHub, which only forwards a room's events to workers that currently hold members of it.
+    Crashed workers are restarted; SIGTERM is passed on so every worker flushes before exiting.
+    """
+
+    def __init__(self, num_workers, bus_path=BUS_SOCKET_PATH):
+        if DB_BACKEND == 'memory':
+            raise StorageError("DB_BACKEND=memory cannot be shared by several workers; use DB_BACKEND=sqlite or SERVER_WORKERS=1.")
+        self.num_workers = num_workers
+        self.context = multiprocessing.get_context('spawn') # Workers must not inherit the supervisor's threads
+        self.hub = BusHub(bus_path) if ROOM_BUS != 'postgres' else None # With the cluster bus the workers talk through PostgreSQL
+        self.workers = {} # {index: multiprocessing.Process}
+        self.stopping = threading.Event()
+
+    def start_worker(self, index):
+        bus_path = self.hub.path if self.hub else None
+        process = self.context.Process(target=run_worker, args=(index, bus_path), name=f"chat-worker-{index}")
+        process.start()
+        self.workers[index] = process
+
+    def run(self):
+        signal.signal(signal.SIGTERM, lambda signum, frame: self.stopping.set())
+        if self.hub:
+            self.hub.start()
+        for index in range(self.num_workers):
+            self.start_worker(index)
+        log.info("Supervisor started %s workers (pid %s).", self.num_workers, os.getpid())
+        try:
+            while not self.stopping.wait(WORKER_CHECK_INTERVAL):
+                for index, process in list(self.workers.items()):
+                    if not process.is_alive():
+                        if process.exitcode == WORKER_STORAGE_ERROR:
+                            log.error("Worker %s could not open storage; stopping.", index)
+                            self.stopping.set()
+                            break
+                        log.warning("Worker %s exited with code %s; restarting.", index, process.exitcode)
+                        self.start_worker(index)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stop()
+
+    def stop(self):
+        log.info("Stopping workers...")
+        for process in self.workers.values():
+            if process.is_alive():
+                process.terminate() # SIGTERM: the worker shuts down through its normal flush path
+        for index, process in self.workers.items():
+            process.join(WORKER_SHUTDOWN_TIMEOUT)
+            if process.is_alive():
+                log.warning("Worker %s did not stop in time; killing it.", index)
+                process.kill()
+                process.join()
+        if self.hub:
+            self.hub.close()
+        log.info("Supervisor stopped.")
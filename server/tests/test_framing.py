@@ -0,0 +1,64 @@
+# server/tests/test_framing.py
+import socket
+
+import pytest
+
+from framing import FrameReader, FrameTooLarge, LENGTH_PREFIX
+
+
+@pytest.fixture
+def pair():
+    server_side, client_side = socket.socketpair()
+    yield server_side, client_side
+    server_side.close()
+    client_side.close()
+
+
+def test_pipelined_frames_come_out_one_by_one(pair):
+    server_side, client_side = pair
+    client_side.sendall(b'{"a": 1}\n{"b": 2}\n{"c"')
+    reader = FrameReader(server_side)
+    assert reader.read_frame() == b'{"a": 1}'
+    assert reader.read_frame() == b'{"b": 2}'
+    client_side.sendall(b': 3}\n')
+    assert reader.read_frame() == b'{"c": 3}'
+
+
+def test_frame_split_across_many_reads(pair):
+    server_side, client_side = pair
+    reader = FrameReader(server_side, chunk_size=4)
+    client_side.sendall(b'x' * 1000 + b'\n')
+    assert reader.read_frame() == b'x' * 1000
+
+
+def test_closed_stream_returns_none(pair):
+    server_side, client_side = pair
+    client_side.sendall(b'last\nunterminated')
+    client_side.close()
+    reader = FrameReader(server_side)
+    assert reader.read_frame() == b'last'
+    assert reader.read_frame() is None
+
+
+def test_oversized_line_is_refused(pair):
+    server_side, client_side = pair
+    client_side.sendall(b'x' * 200)
+    reader = FrameReader(server_side, max_frame_size=64, chunk_size=32)
+    with pytest.raises(FrameTooLarge):
+        reader.read_frame()
+
+
+def test_length_prefixed_frames(pair):
+    server_side, client_side = pair
+    frames = [b'', b'\x01hello', b'with\nnewline']
+    client_side.sendall(b''.join(LENGTH_PREFIX.pack(len(f)) + f for f in frames))
+    reader = FrameReader(server_side, chunk_size=3)
+    assert [reader.read_frame(length_prefixed=True) for _ in frames] == frames
+
+
+def test_length_prefix_over_the_limit_is_refused(pair):
+    server_side, client_side = pair
+    client_side.sendall(LENGTH_PREFIX.pack(1000))
+    reader = FrameReader(server_side, max_frame_size=100)
+    with pytest.raises(FrameTooLarge):
+        reader.read_frame(length_prefixed=True)
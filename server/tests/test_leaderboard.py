@@ -0,0 +1,82 @@
+# server/tests/test_leaderboard.py
+import bisect
+import datetime
+import random
+
+import pytest
+
+from leaderboard import Leaderboard, RankIndex
+from storage import open_storage
+
+
+@pytest.mark.parametrize('bucket_size', [1, 2, 16, 1000])
+def test_rank_index_matches_a_sorted_list(bucket_size):
+    rng = random.Random(bucket_size)
+    keys = [(rng.randint(-50, 0), rng.random(), user_id) for user_id in range(3000)]
+    index, expected = RankIndex(keys[:1000], bucket_size=bucket_size), sorted(keys[:1000])
+    for key in keys[1000:]:
+        index.add(key)
+        bisect.insort(expected, key)
+        if rng.random() < 0.6:
+            removed = rng.choice(expected)
+            expected.remove(removed)
+            assert index.remove(removed)
+    assert len(index) == len(expected)
+    assert index.first(len(expected) + 10) == expected
+    for key in rng.sample(expected, 200):
+        assert index.index(key) == expected.index(key)
+    assert index.index((-100, 0, 0)) == 0
+    assert index.index((1, 0, 0)) == len(expected)
+
+
+def test_rank_index_removing_a_missing_key():
+    index = RankIndex([(0, 0, 1)])
+    assert not index.remove((0, 0, 2))
+    assert index.remove((0, 0, 1))
+    assert not index.remove((0, 0, 1))
+    assert len(index) == 0 and index.first(5) == []
+
+
+@pytest.fixture
+def db():
+    storage = open_storage('memory')
+    for name in ('alice', 'bob', 'carol'):
+        storage.add_user(name, 'x')
+    yield storage
+    storage.close()
+
+
+@pytest.fixture
+def leaderboard(db):
+    board = Leaderboard(db, checkpoint_interval=3600)
+    yield board
+    board.close()
+
+
+def user_id(db, name):
+    return db.get_user_credentials(name)[0]
+
+
+def test_ranks_by_message_count_then_recent_activity(db, leaderboard):
+    alice, bob, carol = (user_id(db, name) for name in ('alice', 'bob', 'carol'))
+    start = datetime.datetime(2026, 1, 1)
+    for n in range(3):
+        leaderboard.record_message(bob, 'bob', start + datetime.timedelta(seconds=n))
+    leaderboard.record_message(alice, 'alice', start)
+    leaderboard.record_message(carol, 'carol', start + datetime.timedelta(minutes=1))
+    assert [entry['username'] for entry in leaderboard.top(3)] == ['bob', 'carol', 'alice']
+    assert leaderboard.rank_of(alice)['rank'] == 3
+    assert leaderboard.rank_of(10 ** 6) is None
+
+
+def test_checkpoint_carries_fractional_seconds(db, leaderboard, monkeypatch):
+    alice = user_id(db, 'alice')
+    clock = [100.0]
+    monkeypatch.setattr('leaderboard.time.monotonic', lambda: clock[0])
+    leaderboard.session_started(alice, 'alice')
+    for _ in range(10):
+        clock[0] += 0.25
+        leaderboard.checkpoint()
+    stored = {row[0]: row[4] for row in db.load_leaderboard()}
+    assert stored[alice] == 2 # 10 x 0.25s; rounding each delta would have stored 0
+    assert leaderboard.fractions[alice] == 0.5
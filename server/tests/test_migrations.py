@@ -0,0 +1,110 @@
+# server/tests/test_migrations.py
+"""Upgrading from every earlier schema version must end in the same schema as a fresh database.
+
+The PostgreSQL tests need a scratch database, which is emptied before each test:
+
+    TEST_POSTGRES_DB=chat_test python -m pytest server/tests/test_migrations.py
+
+Connection settings come from the same DB_HOST / POSTGRES_USER / POSTGRES_PASSWORD variables as the server.
+"""
+import os
+import sqlite3
+
+import pytest
+
+import migrations
+import sqlite_storage
+from sqlite_storage import SQLiteStorage
+
+
+def sqlite_schema(path):
+    conn = sqlite3.connect(path)
+    try:
+        tables = [row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table' ORDER BY name;")]
+        return {
+            "version": conn.execute("PRAGMA user_version;").fetchone()[0],
+            "columns": {table: conn.execute(f"PRAGMA table_info('{table}');").fetchall() for table in tables},
+            "indexes": conn.execute("SELECT name, tbl_name FROM sqlite_master WHERE type = 'index' ORDER BY name;").fetchall(),
+            "triggers": conn.execute("SELECT name FROM sqlite_master WHERE type = 'trigger' ORDER BY name;").fetchall(),
+        }
+    finally:
+        conn.close()
+
+
+def create_sqlite_at(path, version):
+    conn = sqlite3.connect(path, isolation_level=None)
+    for schema_version, _, statements in sqlite_storage.SCHEMA:
+        if schema_version > version:
+            break
+        for statement in statements:
+            conn.execute(statement)
+        conn.execute(f"PRAGMA user_version = {schema_version};")
+    conn.close()
+
+
+@pytest.mark.parametrize('version', range(sqlite_storage.LATEST_VERSION))
+def test_sqlite_upgrades_from_every_version(tmp_path, version):
+    fresh, upgraded = str(tmp_path / 'fresh.db'), str(tmp_path / 'upgraded.db')
+    SQLiteStorage(fresh).close()
+    create_sqlite_at(upgraded, version)
+    storage = SQLiteStorage(upgraded)
+    assert storage.add_user('alice', 'x')
+    storage.close()
+    assert sqlite_schema(upgraded) == sqlite_schema(fresh)
+    assert sqlite_schema(upgraded)["version"] == sqlite_storage.LATEST_VERSION
+
+
+def test_sqlite_reopening_applies_nothing(tmp_path):
+    path = str(tmp_path / 'chat.db')
+    SQLiteStorage(path).close()
+    before = sqlite_schema(path)
+    SQLiteStorage(path).close()
+    assert sqlite_schema(path) == before
+
+
+@pytest.fixture
+def pg_cursor():
+    dbname = os.getenv('TEST_POSTGRES_DB')
+    if not dbname:
+        pytest.skip("TEST_POSTGRES_DB is not set")
+    psycopg2 = pytest.importorskip('psycopg2')
+    conn = psycopg2.connect(
+        dbname=dbname,
+        user=os.getenv('POSTGRES_USER', 'chat_user'),
+        password=os.getenv('POSTGRES_PASSWORD', 'chat_password'),
+        host=os.getenv('DB_HOST', 'localhost')
+    )
+    conn.autocommit = True
+    cursor = conn.cursor()
+    yield cursor
+    cursor.close()
+    conn.close()
+
+
+def reset_pg(cursor):
+    cursor.execute("DROP SCHEMA public CASCADE; CREATE SCHEMA public;")
+
+
+def pg_schema(cursor):
+    cursor.execute("""
+        SELECT table_name, column_name, data_type, is_nullable, column_default, is_generated
+        FROM information_schema.columns WHERE table_schema = 'public' AND table_name <> 'schema_version'
+        ORDER BY table_name, column_name;
+    """)
+    columns = cursor.fetchall()
+    cursor.execute("SELECT indexname, indexdef FROM pg_indexes WHERE schemaname = 'public' ORDER BY indexname;")
+    return {"columns": columns, "indexes": cursor.fetchall()}
+
+
+@pytest.mark.parametrize('version', range(migrations.LATEST_VERSION))
+def test_postgres_upgrades_from_every_version(pg_cursor, version):
+    reset_pg(pg_cursor)
+    migrations.apply_migrations(pg_cursor)
+    fresh = pg_schema(pg_cursor)
+
+    reset_pg(pg_cursor)
+    migrations.apply_migrations(pg_cursor, target_version=version)
+    applied = migrations.apply_migrations(pg_cursor)
+    assert applied == list(range(version + 1, migrations.LATEST_VERSION + 1))
+    assert pg_schema(pg_cursor) == fresh
+    assert migrations.apply_migrations(pg_cursor) == []
@@ -0,0 +1,38 @@
+# server/tests/test_outbound.py
+from outbound import OutboundQueue
+
+
+def test_drop_oldest_keeps_the_newest_frames():
+    queue = OutboundQueue(max_frames=2, max_bytes=1000, policy='drop_oldest')
+    assert all(queue.put(frame) for frame in (b'1', b'2', b'3'))
+    assert queue.dropped_frames == 1
+    assert queue.take_all() == b'23'
+
+
+def test_disconnect_closes_the_queue_when_full():
+    queue = OutboundQueue(max_frames=2, max_bytes=1000, policy='disconnect')
+    assert queue.put(b'1') and queue.put(b'2')
+    assert not queue.put(b'3')
+    assert queue.closed
+    assert not queue.put(b'4')
+    assert queue.take_all() == b''
+
+
+def test_coalesce_merges_queued_frames_without_losing_any():
+    queue = OutboundQueue(max_frames=2, max_bytes=1000, policy='coalesce')
+    for frame in (b'1', b'2', b'3', b'4', b'5'):
+        assert queue.put(frame)
+    assert len(queue) <= 2
+    assert queue.take_all() == b'12345'
+
+
+def test_byte_cap_closes_the_queue_under_any_policy():
+    for policy in ('drop_oldest', 'disconnect', 'coalesce'):
+        queue = OutboundQueue(max_frames=100, max_bytes=10, policy=policy)
+        assert queue.put(b'x' * 6)
+        assert not queue.put(b'x' * 6)
+        assert queue.closed
+
+
+def test_unknown_policy_falls_back_to_drop_oldest():
+    assert OutboundQueue(policy='bogus').policy == 'drop_oldest'
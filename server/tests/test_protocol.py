@@ -0,0 +1,75 @@
+# server/tests/test_protocol.py
+import json
+import time
+
+import pytest
+
+import wire
+from protocol import CODECS, FRAME_HEADER, JSON_CODEC, BinaryCodec, ProtocolError, RawJSON, encode_json_line
+
+BINARY = BinaryCodec()
+
+
+@pytest.fixture
+def berlin_time(monkeypatch):
+    # A local zone with DST, which must not change the decoded text
+    monkeypatch.setenv('TZ', 'Europe/Berlin')
+    time.tzset()
+    yield
+    monkeypatch.undo()
+    time.tzset()
+
+
+def body(frame):
+    (length,) = FRAME_HEADER.unpack_from(frame)
+    assert length == len(frame) - FRAME_HEADER.size
+    return frame[FRAME_HEADER.size:]
+
+
+def test_raw_json_values_are_spliced_in():
+    line = encode_json_line({"status": "success", "history": RawJSON('[{"id": 1}]')})
+    assert line.endswith(b'\n')
+    assert json.loads(line) == {"status": "success", "history": [{"id": 1}]}
+    assert json.loads(encode_json_line({"history": RawJSON('[]')})) == {"history": []}
+
+
+@pytest.mark.parametrize('message', [
+    {"type": "chat_message", "id": 42, "sender": "alice", "content": "héllo ✓", "timestamp": "2026-03-29T01:59:59.123456"},
+    {"type": "chat_message", "id": 7, "sender": "bob", "content": "", "timestamp": "2026-10-25T02:30:00"},
+    {"type": "chat_message", "sender": "SERVER", "content": "bob has joined the room.", "timestamp": "2026-01-01T00:00:00.000001"},
+])
+def test_chat_message_round_trips_to_the_json_form(message, berlin_time):
+    frame = BINARY.encode(message)
+    assert body(frame)[0] == wire.FRAME_CHAT_MESSAGE
+    assert wire.decode_binary_frame(body(frame)) == message
+
+
+def test_other_responses_travel_as_json_frames():
+    response = {"status": "success", "history": RawJSON('[{"id": 1}]'), "message": "Joined."}
+    frame = BINARY.encode(response)
+    assert body(frame)[0] == wire.FRAME_JSON
+    assert wire.decode_binary_frame(body(frame)) == {"status": "success", "history": [{"id": 1}], "message": "Joined."}
+
+
+def test_client_requests_decode_on_the_server():
+    send = {"command": "send_message", "message": "hi there"}
+    other = {"command": "join_room", "room_name": "lobby"}
+    for request in (send, other):
+        assert BINARY.decode_request(body(wire.encode_command(wire.PROTOCOL_BINARY, request))) == request
+        line = wire.encode_command(wire.PROTOCOL_JSON, request)
+        assert JSON_CODEC.decode_request(line.rstrip(b'\n')) == request
+
+
+@pytest.mark.parametrize('frame', [b'', b'\x09junk', b'\x02[1, 2]'])
+def test_malformed_binary_requests_are_refused(frame):
+    with pytest.raises(ProtocolError):
+        BINARY.decode_request(frame)
+
+
+def test_json_requests_must_be_objects():
+    with pytest.raises(ProtocolError):
+        JSON_CODEC.decode_request(b'[1]')
+
+
+def test_codecs_are_registered_by_name():
+    assert set(CODECS) == {wire.PROTOCOL_JSON, wire.PROTOCOL_BINARY}
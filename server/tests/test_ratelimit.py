@@ -0,0 +1,71 @@
+# server/tests/test_ratelimit.py
+import pytest
+
+from ratelimit import RateLimiter, TokenBucket, parse_limits, parse_rate
+
+
+def session(user_id=None, room_id=None):
+    return {'user_id': user_id, 'current_room_id': room_id, 'rate_limits': {}, 'throttled_streak': 0}
+
+
+def test_parse_rates():
+    assert parse_rate('5/10') == (5.0, 10.0)
+    assert parse_rate('5') == (5.0, 5.0)
+    assert parse_limits('message=5/10, auth=1') == {'message': (5.0, 10.0), 'auth': (1.0, 1.0)}
+
+
+def test_bucket_allows_a_burst_then_refills_at_the_rate():
+    bucket = TokenBucket(rate=2, burst=3, now=0)
+    assert [bucket.take(0) for _ in range(3)] == [0, 0, 0]
+    assert bucket.take(0) == pytest.approx(0.5) # One token takes 1 / rate seconds
+    assert bucket.take(0.5) == 0
+    assert bucket.take(0.5) > 0
+
+
+def test_bucket_never_refills_past_the_burst():
+    bucket = TokenBucket(rate=10, burst=2, now=0)
+    assert bucket.take(1000) == 0
+    assert bucket.take(1000) == 0
+    assert bucket.take(1000) > 0
+
+
+def test_zero_rate_never_refills():
+    bucket = TokenBucket(rate=0, burst=1, now=0)
+    assert bucket.take(0) == 0
+    assert bucket.take(10 ** 6) == float('inf')
+
+
+def test_connections_of_one_user_share_their_buckets():
+    limiter = RateLimiter(limits='message=0.001/3', room_rate='')
+    first, second = session(user_id=7), session(user_id=7)
+    allowed = [not limiter.check(s, 'dm') for s in (first, second, first, second)]
+    assert allowed == [True, True, True, False]
+    assert not limiter.check(session(user_id=8), 'dm') # Another user has their own allowance
+
+
+def test_room_bucket_refunds_the_users_token():
+    limiter = RateLimiter(limits='message=0.001/2', room_rate='0.001/1')
+    sender = session(user_id=1, room_id=5)
+    assert not limiter.check(sender, 'send_message')
+    assert limiter.check(session(user_id=2, room_id=5), 'send_message') # The room is spent
+    assert limiter.throttled['room_messages'] == 1
+    sender['current_room_id'] = 6
+    assert not limiter.check(sender, 'send_message') # The refunded token is still there
+
+
+def test_idle_room_buckets_are_evicted():
+    limiter = RateLimiter(limits='message=1000/1000', room_rate='1/1', max_rooms=3)
+    sender = session(user_id=1)
+    for room_id in range(10):
+        sender['current_room_id'] = room_id
+        limiter.check(sender, 'send_message')
+    assert len(limiter.rooms) == 3
+
+
+def test_flooding_client_is_disconnected_after_the_streak():
+    limiter = RateLimiter(limits='query=0.001/1', room_rate='', disconnect_after=3)
+    client = session()
+    limiter.check(client, 'history')
+    for _ in range(3):
+        assert limiter.check(client, 'history')
+    assert limiter.should_disconnect(client)